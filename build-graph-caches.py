@@ -0,0 +1,93 @@
+"""Builds, or checks, the binary caches of the graphs used by single_gene_inference.py, so that experiments
+never pay for the first construction of a graph.
+
+Each graph is built by its own worker process, including all its graph types (e.g. every StringDB channel)
+so that the edge store shared by the types is only built once. A report with the build time, the number of
+nodes and edges and the size of the cache of every graph is printed at the end.
+
+    python build-graph-caches.py --graphs genemania,stringdb --workers 2
+"""
+
+import os
+import time
+import argparse
+import traceback
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+from data.gene_graphs import graph_dict
+from data.utils import gene_id_table
+from data import graph_store, array_store
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--graphs', default=None, type=str,
+                    help='Comma separated names of the graphs to build. Default - every graph of graph_dict')
+parser.add_argument('--workers', default=None, type=int, help='Number of worker processes. Default - one per graph')
+parser.add_argument('--datastore', default=None, type=str, help='Datastore of the graphs. Default - data/')
+parser.add_argument('--rebuild', action='store_true',
+                    help='Build the graphs, their edge stores and the gene id table again even if they are cached')
+
+
+def dir_size(path):
+    """ Returns the total size in bytes of the files of the directory path """
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def build_graph(job):
+    """ Builds or loads every graph type of the graph name, and returns one report per graph type """
+    name, datastore, rebuild = job
+    graph_class = graph_dict[name]
+    graph_types = sorted(graph_class.name_to_edge.keys()) if hasattr(graph_class, "name_to_edge") else [None]
+    reports = []
+    for graph_type in graph_types:
+        kwargs = {"datastore": datastore, "rebuild": rebuild}
+        if graph_type is not None:
+            kwargs["graph_type"] = graph_type
+        report = {"graph": name, "graph_type": graph_type}
+        try:
+            start = time.time()
+            graph = graph_class(**kwargs)
+            report["seconds"] = time.time() - start
+            cache_file = graph.cache_file()
+            report["nodes"] = len(graph.node_names)
+            report["edges"] = int((graph.csr.nnz + np.count_nonzero(graph.csr.diagonal())) // 2)
+            cached = cache_file is not None and graph_store.is_cached(cache_file)
+            report["cache_mb"] = dir_size(cache_file) / 2. ** 20 if cached else None
+            report["cache"] = cache_file
+        except (Exception, SystemExit):
+            # e.g. missing source files, which make some loaders exit
+            report["error"] = traceback.format_exc().strip().split("\n")[-1]
+        reports.append(report)
+    return reports
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    names = args.graphs.split(",") if args.graphs else [name for name, cls in graph_dict.items() if cls is not None]
+    for name in names:
+        assert graph_dict.get(name) is not None, "Unknown graph " + name
+
+    datastore = args.datastore or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+    if args.rebuild:
+        # The edge stores are shared by the graph types, they are removed here so that each is built again once
+        for name in names:
+            edge_store_name = getattr(graph_dict[name], "edge_store_name", None)
+            if edge_store_name is not None:
+                array_store.remove(os.path.join(datastore, "graphs", edge_store_name))
+    # Compile the gene id table once, before the workers need it
+    gene_id_table(datastore, rebuild=args.rebuild)
+
+    pool = multiprocessing.Pool(processes=args.workers or len(names))
+    reports = []
+    for graph_reports in pool.imap_unordered(build_graph, [(name, datastore, args.rebuild) for name in names]):
+        for report in graph_reports:
+            print(" {graph} {graph_type}: {status}".format(
+                status=report.get("error") or "{:.1f}s".format(report["seconds"]), **report))
+        reports.extend(graph_reports)
+    pool.close()
+    pool.join()
+
+    reports = pd.DataFrame(reports).sort_values(["graph", "graph_type"], na_position="first")
+    print(reports.to_string(index=False))
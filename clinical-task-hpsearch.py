@@ -152,7 +152,7 @@ def doGGC():
     else:
         print("unknown graph")
         sys.exit(1)
-    adj = graph.adj()
+    adj = graph.adj(nodelist=task.gene_ids)
 
 
 
@@ -21,6 +21,7 @@ import matplotlib.pyplot as plt
 from sklearn.model_selection import StratifiedKFold
 from genegraphconv.data.gene_graphs import StringDBGraph, HetIOGraph, FunCoupGraph, HumanNetV2Graph, GeneManiaGraph, \
     RegNetGraph
+from genegraphconv.data.graph_bundle import GraphBundle
 
 
 ########################################################################################################################
@@ -88,16 +89,10 @@ def getdata(graph_index, datastore="/network/home/bertinpa/Documents/gene-graph-
 
         # Restrict to covered genes only
         if covered_genes is None:
-            graph_genes = list(graph.nx_graph.nodes)
-            dataset_genes = task.gene_ids
-            covered_genes = list(set(graph_genes).intersection(dataset_genes))
+            covered_genes = list(GraphBundle({graph_name: graph}).covered_genes(task.gene_ids))
 
-        # Get subggraph
-        subgraph = graph.nx_graph.subgraph(covered_genes)
-        # subgraph_genes = list(subgraph.nodes)
-
-        # Get Adjacency Matrix of the subgraph
-        adj_matrix = torch.Tensor(np.array(nx.adjacency_matrix(subgraph, nodelist=covered_genes).todense()))
+        # Get Adjacency Matrix of the subgraph, with the rows and columns in the order of covered_genes
+        adj_matrix = torch.Tensor(graph.adj(nodelist=covered_genes, weighted=False).toarray())
         adj_matrix += torch.eye(adj_matrix.shape[0])  # add diagonal
         if torch.cuda.is_available():
             adj_matrix = adj_matrix.cuda()
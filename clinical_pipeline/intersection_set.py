@@ -7,6 +7,7 @@ import meta_dataloader.TCGA
 import numpy as np
 from genegraphconv.data.gene_graphs import StringDBGraph, HetIOGraph, FunCoupGraph, HumanNetV2Graph, GeneManiaGraph, \
     RegNetGraph
+from genegraphconv.data.graph_bundle import GraphBundle
 
 ####################################################################################################################
 # Evaluate simple classification pipeline on a specific task
@@ -21,17 +22,12 @@ datastore = "/Users/paul/Desktop/user1/PycharmProjects/gene-graph-conv/genegraph
 
 graph_initializer_list = [StringDBGraph, HetIOGraph, FunCoupGraph, HumanNetV2Graph, GeneManiaGraph, RegNetGraph]
 graph_names_list = ["stringdb", "hetio", "funcoup", "humannet", "genemania", "regnet"]
-all_sets_of_genes = []
-covered_genes = set(task.gene_ids)
-print(len(covered_genes))
-
-for graph_index in range(5):
-    # Loop over all graphs but regnet
-    graph = graph_initializer_list[graph_index](datastore=datastore)
+print(len(task.gene_ids))
 
-    # Computing interestection
-    covered_genes = covered_genes.intersection(graph.nx_graph.nodes)
-    print(len(covered_genes))
+# All graphs but regnet, only their gene tables are read from their cache
+bundle = GraphBundle(dict(zip(graph_names_list[:5], graph_initializer_list[:5])), datastore=datastore)
+covered_genes = bundle.covered_genes(task.gene_ids)
+print(len(covered_genes))
 
 np.save("/Users/paul/PycharmProjects/TCGA_Benchmark/data/covered_genes",
         list(covered_genes))
@@ -0,0 +1,103 @@
+""" This file contains the directory format shared by our binary caches (graphs, edge stores, expression data).
+
+    Each array is saved as its own .npy file inside the cache directory, next to a meta.json file holding the
+    version of the format and any meta data. Arrays can then be memory-mapped on load: opening a cache costs
+    milliseconds, only the pages which are used are read, and processes on the same machine share them.
+    The cache path itself is a symbolic link to the directory of the current version, see save_arrays.
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+
+
+def is_complete(path, version):
+    """ Returns True if path contains a complete cache written with the given format version """
+    try:
+        meta = load_meta(path)
+    except (IOError, ValueError):
+        return False
+    return meta.get("version") == version
+
+
+def save_arrays(path, arrays, version, **meta):
+    """
+    Writes named arrays to the cache directory path, one .npy file each, along with the meta data in meta.json.
+    The arrays are written to a new hidden directory next to path, and path is a symbolic link which is then
+    switched to it atomically: concurrent readers see either the previous cache or the new one, never a partial or
+    missing one. The directory of the previous version is kept until the next write, so that the readers which are
+    still opening its files find them.
+    :param version: version of the format of the cache, checked by is_complete
+    """
+    path = os.path.abspath(path)
+    parent, name = os.path.split(path)
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    tmp_path = tempfile.mkdtemp(dir=parent, prefix=".tmp_" + name)
+    for array_name, array in arrays.items():
+        np.save(os.path.join(tmp_path, array_name + ".npy"), array)
+    meta = dict(meta, version=version, arrays=list(arrays.keys()))
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    # the link is relative, so that the cache can be moved along with its parent directory
+    version_path = tempfile.mkdtemp(dir=parent, prefix="." + name + ".")
+    os.rename(tmp_path, version_path)
+    tmp_link = version_path + ".link"
+    os.symlink(os.path.basename(version_path), tmp_link)
+    # the version the link pointed to is kept as .<name>.previous until the next write, for the readers which
+    # resolved the link just before it was switched, and the version before it is removed
+    previous_link = os.path.join(parent, "." + name + ".previous")
+    removed = os.path.join(parent, os.readlink(previous_link)) if os.path.islink(previous_link) else None
+    if os.path.islink(path):
+        os.symlink(os.readlink(path), tmp_link + ".previous")
+        os.replace(tmp_link + ".previous", previous_link)
+    elif os.path.isdir(path):
+        # a cache written as a plain directory is moved aside first, this only happens once
+        moved = tempfile.mkdtemp(dir=parent, prefix="." + name + ".")
+        os.rename(path, os.path.join(moved, name))
+        os.symlink(os.path.basename(moved), tmp_link + ".previous")
+        os.replace(tmp_link + ".previous", previous_link)
+    os.replace(tmp_link, path)
+    if removed is not None and removed not in (version_path, os.path.join(parent, os.readlink(previous_link))):
+        shutil.rmtree(removed, ignore_errors=True)
+
+
+def remove(path):
+    """ Removes the cache directory path, written by save_arrays, along with its previous version """
+    parent, name = os.path.split(os.path.abspath(path))
+    for link in [os.path.join(parent, name), os.path.join(parent, "." + name + ".previous")]:
+        if os.path.islink(link):
+            target = os.path.join(parent, os.readlink(link))
+            os.remove(link)
+            shutil.rmtree(target, ignore_errors=True)
+        elif os.path.isdir(link):
+            shutil.rmtree(link)
+
+
+def load_arrays(path, names=None, mmap=True):
+    """
+    Reads named arrays from the cache directory path.
+    :param names: arrays to read, defaults to all the arrays of the cache
+    :return: dictionary from name to array. With mmap=True the arrays are read-only views on the files.
+    """
+    while True:
+        # the link is only resolved once, so that all the arrays come from the same version of the cache
+        version_path = os.path.realpath(path)
+        try:
+            if names is None:
+                names = load_meta(version_path)["arrays"]
+            mmap_mode = "r" if mmap else None
+            return {name: np.load(os.path.join(version_path, name + ".npy"), mmap_mode=mmap_mode) for name in names}
+        except IOError:
+            # the version was removed while it was read, the cache is then read again from its new version
+            if os.path.realpath(path) == version_path:
+                raise
+
+
+def load_meta(path):
+    """ Returns the meta data stored with the cache directory path """
+    with open(os.path.join(path, "meta.json")) as f:
+        return json.load(f)
@@ -2,15 +2,253 @@
 import csv
 import glob
 import os
+import queue
+import threading
 import urllib
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 import h5py
 import pandas as pd
 import numpy as np
 from torch.utils.data import Dataset
-import academictorrents as at
 import data.utils
-from data.utils import symbol_map, ensg_to_hugo_map
+from data.utils import symbol_map, map_gene_ids
+from data import array_store
+from data.normalization import ExpressionStats, hdf5_stats
+
+# Bump this whenever the layout of the expression stores changes, older stores will then be rebuilt
+EXPRESSION_STORE_VERSION = 2
+
+
+def write_expression_store(path, df):
+    """
+    Writes the samples x genes DataFrame df to the expression store path. The data is stored as float32, centered
+    on the mean of each gene, and gene-major: the samples of each gene are contiguous on disk.
+    The mean of each gene is stored alongside, so that the raw data is expression + mean, with the other
+    statistics of each gene (see expression_store_stats).
+    """
+    data = df.values.astype(np.float32)
+    stats = ExpressionStats.from_array(data)
+    mean = stats.mean.astype(np.float32)
+    data -= mean
+    array_store.save_arrays(path, {"expression": np.ascontiguousarray(data.T), "mean": mean, "m2": stats.m2,
+                                   "min": stats.min, "max": stats.max,
+                                   "genes": np.asarray(df.columns).astype(str),
+                                   "samples": np.asarray(df.index).astype(str)},
+                            EXPRESSION_STORE_VERSION, num_samples=data.shape[0], num_genes=data.shape[1])
+
+
+def read_expression_store(path, genes=None):
+    """
+    Opens the expression store path. The data is memory-mapped, so opening is instant and only the genes
+    which are used are read from disk.
+    :param genes: if given, only the rows of these genes are read, and the columns follow the order of genes
+    :return: samples x genes DataFrame of the centered data, which is a read-only view on the store if genes is
+             None, and the mean of each gene
+    """
+    arrays = array_store.load_arrays(path)
+    expression, mean, columns = arrays["expression"], arrays["mean"], arrays["genes"]
+    if genes is not None:
+        positions = gene_positions(columns, genes)
+        expression, mean, columns = expression[positions], mean[positions], columns[positions]
+    df = pd.DataFrame(expression.T, index=arrays["samples"], columns=columns, copy=False)
+    return df, mean
+
+
+def expression_store_stats(path, genes=None):
+    """
+    Returns the ExpressionStats of the raw data of the expression store path, for the genes genes if given
+    """
+    arrays = array_store.load_arrays(path, ["mean", "m2", "min", "max", "genes"])
+    stats = ExpressionStats(len(arrays["genes"]))
+    stats.count = array_store.load_meta(path)["num_samples"]
+    stats.mean = arrays["mean"].astype(np.float64)
+    stats.m2, stats.min, stats.max = arrays["m2"], arrays["min"], arrays["max"]
+    if genes is not None:
+        stats = stats.select(gene_positions(arrays["genes"], genes))
+    return stats
+
+
+def gene_positions(names, genes):
+    """
+    Returns the position in names of each gene of genes, using the first occurrence of duplicated names.
+    Raises a KeyError if some genes are not in names.
+    """
+    names = pd.Index(np.asarray(names, dtype=object))
+    first = np.flatnonzero(~names.duplicated())
+    genes = np.asarray(list(genes), dtype=object)
+    positions = names[first].get_indexer(genes)
+    if (positions < 0).any():
+        raise KeyError("Genes not in the dataset: " + ", ".join(map(str, genes[positions < 0][:10])))
+    return first[positions]
+
+
+class HDF5RowReader(object):
+    """
+    Reads subsets of the rows of a 2d HDF5 dataset. The rows are grouped by block of block_rows rows, the HDF5 chunk
+    size for chunked datasets, and each block is read with one contiguous read from its first to its last selected
+    row, instead of one scattered read per row. Uncompressed contiguous datasets are memory-mapped, which bypasses the
+    lock of h5py so that blocks can be read in parallel by workers threads.
+    """
+
+    # Size of the blocks of contiguous datasets
+    block_bytes = 4 * 2 ** 20
+
+    def __init__(self, dataset, block_rows=None, workers=1):
+        self.dataset = dataset
+        self.nrows, self.ncols = dataset.shape
+        self.workers = workers
+        self.source = dataset
+        offset = dataset.id.get_offset()
+        if dataset.chunks is None and offset is not None:
+            self.source = np.memmap(dataset.file.filename, dtype=dataset.dtype, mode="r", offset=offset,
+                                    shape=dataset.shape)
+        if block_rows is None:
+            row_bytes = self.ncols * dataset.dtype.itemsize
+            block_rows = dataset.chunks[0] if dataset.chunks else max(1, self.block_bytes // row_bytes)
+        self.block_rows = block_rows
+
+    def sample(self, size, seed=0, columns=None):
+        """
+        Returns size random rows drawn with seed, sorted, and their data (see read)
+        """
+        rows = np.sort(np.random.RandomState(seed).choice(self.nrows, size=size, replace=False))
+        return rows, self.read(rows, columns)
+
+    def read(self, rows, columns=None):
+        """
+        Returns the data of the rows, which must be sorted, as a len(rows) x ncols array.
+        :param columns: if given, only these columns are kept, in this order
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        nb_columns = self.ncols if columns is None else len(columns)
+        data = np.empty((len(rows), nb_columns), dtype=self.dataset.dtype)
+        blocks = rows // self.block_rows
+        bounds = np.flatnonzero(np.diff(blocks)) + 1
+        starts, stops = np.r_[0, bounds], np.r_[bounds, len(rows)]
+
+        def read_block(bound):
+            start, stop = bound
+            first = rows[start]
+            block = np.asarray(self.source[first:rows[stop - 1] + 1])[rows[start:stop] - first]
+            data[start:stop] = block if columns is None else block[:, columns]
+
+        if self.workers > 1:
+            with ThreadPoolExecutor(self.workers) as pool:
+                list(pool.map(read_block, zip(starts, stops)))
+        else:
+            for bound in zip(starts, stops):
+                read_block(bound)
+        return data
+
+
+class HDF5BatchStream(object):
+    """
+    Iterable over the mini-batches (inputs, labels) of the rows of a 2d HDF5 dataset, which is read chunk by chunk so
+    that it never has to fit in memory. Each iteration is an epoch: the chunks are visited in a new random order and
+    the rows of each chunk are shuffled, while a background thread reads the next chunks.
+    The stream has a shape and the classes of its labels, so that it can be given to Model.fit instead of X.
+    """
+
+    # Size of the chunks which are read at once
+    chunk_bytes = 64 * 2 ** 20
+
+    def __init__(self, dataset, labels, rows=None, columns=None, classes=None, batch_size=10, chunk_rows=None,
+                 transform=None, shuffle=True, seed=0, prefetch=2, workers=1):
+        """
+        :param dataset: 2d h5py dataset, samples x genes
+        :param labels: label of each row of dataset, or function which returns the labels of an array of rows of
+                       dataset (with all its columns), e.g. whether a gene is expressed
+        :param rows: rows of dataset in the stream, e.g. the training rows. Defaults to all the rows
+        :param columns: columns of the inputs, in this order. Defaults to all the columns
+        :param classes: classes of the labels, required if labels is a function
+        :param chunk_rows: number of rows read at once. Defaults to chunk_bytes of rows, in whole HDF5 chunks
+        :param transform: function applied to the inputs of each chunk, e.g. a normalization
+        :param prefetch: number of chunks read in advance by the background thread
+        :param workers: number of threads which read each chunk, see HDF5RowReader
+        """
+        self.reader = HDF5RowReader(dataset, workers=workers)
+        self.rows = np.arange(self.reader.nrows) if rows is None else np.sort(np.asarray(rows))
+        self.labels = labels if callable(labels) else np.asarray(labels)
+        if classes is None:
+            if callable(labels):
+                raise ValueError("classes must be given when labels is a function")
+            classes = np.unique(self.labels[self.rows])
+        self.classes = np.asarray(classes)
+        self.columns = columns
+        self.batch_size = batch_size
+        self.transform = transform
+        self.shuffle = shuffle
+        self.seed = seed
+        self.prefetch = prefetch
+        if chunk_rows is None:
+            row_bytes = self.reader.ncols * dataset.dtype.itemsize
+            blocks = max(1, self.chunk_bytes // (row_bytes * self.reader.block_rows))
+            chunk_rows = blocks * self.reader.block_rows
+        self.chunks = np.split(self.rows, np.flatnonzero(np.diff(self.rows // chunk_rows)) + 1)
+        self.epoch = 0
+
+    @property
+    def shape(self):
+        return len(self.rows), self.reader.ncols if self.columns is None else len(self.columns)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def read_chunk(self, rows):
+        """ Returns the inputs and the labels of the rows """
+        data = self.reader.read(rows)
+        labels = self.labels(data) if callable(self.labels) else self.labels[rows]
+        inputs = data if self.columns is None else data[:, self.columns]
+        if self.transform is not None:
+            inputs = self.transform(inputs)
+        return inputs, np.asarray(labels)
+
+    def __iter__(self):
+        # Each epoch has its own order, which only depends on the seed and on the number of the epoch
+        rng = np.random.RandomState(self.seed + self.epoch)
+        self.epoch += 1
+        order = rng.permutation(len(self.chunks)) if self.shuffle else range(len(self.chunks))
+        chunks = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+
+        def put(item):
+            # Gives up when the epoch is stopped early, e.g. by a break in the loop over the batches
+            while not stop.is_set():
+                try:
+                    chunks.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def read_chunks():
+            try:
+                for i in order:
+                    if not put(self.read_chunk(self.chunks[i])):
+                        return
+                put(None)
+            except Exception as e:
+                put(e)
+
+        reader = threading.Thread(target=read_chunks, daemon=True)
+        reader.start()
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    return
+                if isinstance(chunk, Exception):
+                    raise chunk
+                inputs, labels = chunk
+                rows = rng.permutation(len(labels)) if self.shuffle else np.arange(len(labels))
+                for start in range(0, len(rows), self.batch_size):
+                    batch = rows[start:start + self.batch_size]
+                    yield inputs[batch], labels[batch]
+        finally:
+            stop.set()
+            reader.join()
+
 
 class GeneDataset(Dataset):
     """Gene Expression Dataset."""
@@ -25,25 +263,34 @@ class GeneDataset(Dataset):
 
 
 class TCGADataset(GeneDataset):
-    def __init__(self, nb_examples=None, at_hash="e4081b995625f9fc599ad860138acf7b6eb1cf6f", datastore=""):
+    def __init__(self, nb_examples=None, at_hash="e4081b995625f9fc599ad860138acf7b6eb1cf6f", datastore="", genes=None):
+        """
+        :param genes: if given, only these genes are read from disk, and self.df has their columns in this order
+        """
         self.at_hash = at_hash
         self.datastore = datastore
         self.nb_examples = nb_examples # In case you don't want to load the whole dataset from disk
+        self.selected_genes = genes
         super(TCGADataset, self).__init__()
 
     def load_data(self):
+        import academictorrents as at
         csv_file = at.get(self.at_hash, datastore=self.datastore)
-        hdf_file = csv_file.split(".gz")[0] + ".hdf5"
-        if not os.path.isfile(hdf_file):
-            print("We are converting a CSV dataset of TCGA to HDF5. Please wait a minute, this only happens the first "
-                  "time you use the TCGA dataset.")
-            df = pd.read_csv(csv_file, compression="gzip", sep="\t")
-            df = df.set_index('Sample')
-            df = df.transpose()
-            df.to_hdf(hdf_file, key="data", complevel=5)
-        self.df = pd.read_hdf(hdf_file)
-        self.df.rename(symbol_map(self.df.columns), axis="columns", inplace=True)
-        self.df = self.df - self.df.mean(axis=0)
+        store = csv_file.split(".gz")[0] + ".f32"
+        if not array_store.is_complete(store, EXPRESSION_STORE_VERSION):
+            hdf_file = csv_file.split(".gz")[0] + ".hdf5"
+            if os.path.isfile(hdf_file):
+                df = pd.read_hdf(hdf_file)
+            else:
+                print("We are converting a CSV dataset of TCGA to a binary store. Please wait a minute, this only "
+                      "happens the first time you use the TCGA dataset.")
+                df = pd.read_csv(csv_file, compression="gzip", sep="\t")
+                df = df.set_index('Sample')
+                df = df.transpose()
+            df.rename(symbol_map(df.columns), axis="columns", inplace=True)
+            write_expression_store(store, df)
+        # self.df is centered, self.mean holds the mean of each gene
+        self.df, self.mean = read_expression_store(store, genes=self.selected_genes)
         #self.df = self.df / self.df.variance()
         self.sample_names = self.df.index.values.tolist()
         self.node_names = np.array(self.df.columns.values.tolist()).astype("str")
@@ -186,26 +433,48 @@ class GTexDataset(GeneDataset):
     - https://www.genenames.org/cgi-bin/download/custom?col=gd_app_sym&col=md_ensembl_id&status=Approved&status=Entry
     %20Withdrawn&hgnc_dbtag=on&order_by=gd_app_sym_sort&format=text&submit=submit
     """
-    def __init__(self, nb_examples=None, data_path="data/datastore/GTEx_RNASeq_RPKM_n2921x55993.gctx", normalize=False):
+    def __init__(self, nb_examples=None, data_path="data/datastore/GTEx_RNASeq_RPKM_n2921x55993.gctx", normalize=False,
+                 genes=None):
+        """
+        The gctx file is converted once to an expression store next to it, which later loads memory-map.
+        :param genes: if given, only these genes are read from disk, and self.df has their columns in this order
+        """
         self.data_path = data_path
         self.nb_examples = nb_examples  # In case you don't want to load the whole dataset from disk
         self.normalize = normalize
+        self.selected_genes = genes
         super(GTexDataset, self).__init__()
 
     def load_data(self):
-        from cmapPy.pandasGEXpress.parse import parse
-        self.df = parse(self.data_path).data_df.T
-        # Map gene names
-        eh_map = ensg_to_hugo_map()
-        columns_to_drop = [i for i in self.df.columns if str(i)[str(i).find('ENS'):].split('.')[0] not in eh_map.keys()]
-        self.df = self.df.drop(columns_to_drop, axis=1)  # Drop columns whose gene is not covered by the map
-
-        self.df.columns = [eh_map[str(i)[str(i).find('ENS'):].split('.')[0]] for i in self.df.columns]  # Rename columns
-        self.df = self.df.loc[:, (self.df != self.df.iloc[0]).any()]
-        self.df = self.df - self.df.mean(axis=0)
-
+        store = os.path.splitext(self.data_path)[0] + ".f32"
+        if not array_store.is_complete(store, EXPRESSION_STORE_VERSION):
+            print("We are converting the GTEx gctx file to a binary store. Please wait a minute, this only happens "
+                  "the first time you use the GTEx dataset.")
+            self.convert(self.data_path, store)
+        # self.df is centered
+        self.df, self.mean = read_expression_store(store, genes=self.selected_genes)
+        self.stats = expression_store_stats(store, genes=self.selected_genes)
         if self.normalize:
-            self.df = (self.df - self.df.min()) / (self.df.max() - self.df.min()) * 20 - 10
+            # Each gene is scaled to [-10, 10], in one float32 copy of the data
+            values = self.stats.centered().apply(self.df.values, method="min_max")
+            self.df = pd.DataFrame(values, index=self.df.index, columns=self.df.columns, copy=False)
+
+    @staticmethod
+    def convert(data_path, store):
+        """
+        Writes the gctx file data_path to the expression store store. The columns are renamed from their ENSG id
+        (e.g. ENSG00000223972.4) to their HUGO symbol, and the columns with no symbol or with a constant value are
+        dropped.
+        """
+        from cmapPy.pandasGEXpress.parse import parse
+        df = parse(data_path).data_df.T
+        ensg_ids = pd.Series(np.asarray(df.columns).astype(str)).str.extract(r"(ENS[^.]*)", expand=False)
+        symbols = map_gene_ids(ensg_ids.fillna("").values, "ensg")
+        mapped = pd.notnull(symbols)
+        values = df.values[:, mapped]
+        varying = (values != values[0]).any(axis=0)
+        df = pd.DataFrame(values[:, varying], index=df.index, columns=symbols[mapped][varying], copy=False)
+        write_expression_store(store, df)
 
     def __getitem__(self, idx):
         sample = self.df.iloc[idx, :].values
@@ -216,12 +485,15 @@ class GTexDataset(GeneDataset):
 
 class GEODataset(GeneDataset):
 
-    def __init__(self, file_path, seed=0, load_full=False, nb_examples=1200, normalize=True):
+    def __init__(self, file_path, seed=0, load_full=False, nb_examples=1200, normalize=True, genes=None, workers=1):
         """
         Args:
             file_path: Path to the HDF5 file
             load_full: Load the entire dataset into memory or not
             nb_examples: Number of examples to load if load_full is False.
+            normalize: Center each gene on its mean over the whole file, computed once and stored next to it.
+            genes: If given, only these genes are read, and self.df has their float32 columns in this order.
+            workers: Number of threads which read the blocks of the sampled rows, see HDF5RowReader.
 
         If load_full is False, the object will load only a randomly sampled dataframe
         with the length nb_examples. The randomize_dataset method can be used to generate
@@ -232,44 +504,86 @@ class GEODataset(GeneDataset):
         self.nb_examples = nb_examples
         self.normalize = normalize
         self.seed = seed
+        self.selected_genes = genes
+        self.workers = workers
         super(GEODataset, self).__init__()
 
     def load_data(self):
         self.hdf5 = h5py.File(name=self.file_path, mode='r')
         self.expression_data = self.hdf5['expression_data']
         self.nrows, self.ncols = self.expression_data.shape
+        self.reader = HDF5RowReader(self.expression_data, workers=self.workers)
+        self.stats = hdf5_stats(self.expression_data) if self.normalize else None
 
         # Load all gene names to memory
         self.genes = [x.decode() for x in self.hdf5['gene_names'][()].tolist()]
+        self.columns = None
+        if self.selected_genes is not None:
+            mapping = symbol_map(self.genes)
+            self.columns = gene_positions([mapping.get(gene, gene) for gene in self.genes], self.selected_genes)
+            if self.stats is not None:
+                self.stats = self.stats.select(self.columns)
 
         if self.load_full:
-            self.df = pd.DataFrame(data=self.expression_data[()], columns=self.genes)
+            self.df = self._load_full()
         else:
             self.df = self._load_nb_examples()
-        self.df.rename(symbol_map(self.df.columns), axis="columns", inplace=True)
-        if self.normalize:
-            self.df = self.df - self.df.mean(axis=0)
-
+        if self.columns is None:
+            self.df.rename(symbol_map(self.df.columns), axis="columns", inplace=True)
 
     def randomize_dataset(self, new_seed):
         """
-        Sample a new self.df of the same length, but with a new seed.
+        Sample a new self.df of the same length, but with a new seed. The file is not reopened.
         """
         self.df = self._load_nb_examples(seed=new_seed)
-        self.df.rename(symbol_map(self.df.columns), axis="columns", inplace=True)
-
-        if self.normalize:
-            self.df = self.df - self.df.mean(axis=0)
-
-    def _load_nb_examples(self):
-        np.random.seed(self.seed)
-        indices = np.sort(np.random.choice(self.nrows, size=(self.nb_examples), replace=False))
-
-        # This indexing is very slow
-        data = self.expression_data[indices.tolist()]
-        return pd.DataFrame(data=data, columns=self.genes)
+        if self.columns is None:
+            self.df.rename(symbol_map(self.df.columns), axis="columns", inplace=True)
+
+    def _load_nb_examples(self, seed=None):
+        seed = self.seed if seed is None else seed
+        self.indices, data = self.reader.sample(self.nb_examples, seed=seed, columns=self.columns)
+        return self._to_frame(data)
+
+    def _to_frame(self, data):
+        """ Returns the DataFrame of the data of the selected genes, normalized in place if normalize is set """
+        if self.stats is not None:
+            data = self.stats.apply(data, copy=False)
+        if self.columns is None:
+            return pd.DataFrame(data=data, columns=self.genes)
+        return pd.DataFrame(data=data.astype(np.float32, copy=False), columns=list(self.selected_genes))
+
+    def _load_full(self):
+        """
+        Returns the DataFrame of all the expression data, restricted to self.columns if genes were selected
+        """
+        if self.columns is None:
+            return self._to_frame(self.expression_data[()])
+        # h5py needs distinct increasing column indices, they are put back in the order of the selected genes after
+        columns, inverse = np.unique(self.columns, return_inverse=True)
+        data = self.expression_data[:, columns.tolist()].astype(np.float32, copy=False)[:, inverse]
+        return self._to_frame(data)
+
+    def batch_streams(self, labels, classes=None, train_valid_split=0.8, **kwargs):
+        """
+        Returns the training and the validation HDF5BatchStream over all the rows of the file, which are split at
+        random with self.seed. The inputs are restricted to the selected genes if any, and centered batch by batch
+        if normalize is set.
+        :param labels: see HDF5BatchStream
+        """
+        if self.stats is not None:
+            kwargs.setdefault("transform", self.stats.transform("center"))
+        rows = np.random.RandomState(self.seed).permutation(self.nrows)
+        nb_train = int(train_valid_split * self.nrows)
+        streams = []
+        for stream_rows, shuffle in [(rows[:nb_train], True), (rows[nb_train:], False)]:
+            streams.append(HDF5BatchStream(self.expression_data, labels, rows=stream_rows, columns=self.columns,
+                                           classes=classes, shuffle=shuffle, seed=self.seed, workers=self.workers,
+                                           **kwargs))
+        return streams
 
     def __getitem__(self, idx):
         sample = self.expression_data[idx]
+        if self.columns is not None:
+            sample = sample[self.columns]
         sample = np.expand_dims(sample, axis=-1)
         return sample
@@ -1,8 +1,7 @@
 """ This file contains the wrapper around our gene interaction graph, which is essentially a big adjacency matrix
 
-    The landmark graph is directly implemented in the single_gene_inference.py script. It corresponds to the graph
-     where each gene is connected to the 978 landmark genes identified in the LINCS project
-    see https://clue.io/connectopedia/what_are_landmark_genes for details.
+    The landmark graph, where each gene is connected to the 978 landmark genes identified in the LINCS project,
+    is implemented by LandmarkGraph without storing its edges.
 """
 
 import csv
@@ -10,64 +9,301 @@ import numpy as np
 import pandas as pd
 import h5py
 import networkx as nx
-import academictorrents as at
-from data.utils import symbol_map, ncbi_to_hugo_map, ensp_to_hugo_map, randmap
+from scipy import sparse
+from data.utils import symbol_map, map_gene_ids, gene_id_table, randmap
+from data import graph_store
 import os
-import itertools
+import copy
+from collections import OrderedDict
 
 
 class GeneInteractionGraph(object):
     """ This class manages the data pertaining to the relationships between genes.
-        It has an nx_graph, and some helper functions.
+        The graph is stored as a table of gene names (node_names) and a sparse adjacency matrix (csr) whose rows
+        and columns are the integer ids of the genes. Both are cached on disk in a binary format which is
+        memory-mapped on load. The networkx view of the graph, nx_graph, is only built when it is accessed.
+
+        Subclasses implement load_data, which either calls set_edgelist or assigns a networkx graph to nx_graph.
     """
 
-    def __init__(self, relabel_genes=True, datastore=None, randomize=False):
+    # Number of genes whose breadth-first order is kept, an order takes 4 bytes per node of the graph
+    bfs_cache_size = 64
+
+    def __init__(self, relabel_genes=True, datastore=None, randomize=False, rebuild=False):
+        """
+        :param relabel_genes: rename the genes which have a newer HUGO symbol, see symbol_map. Relabeled and
+                              original graphs are cached separately.
+        :param rebuild: build the graph again even if it is cached, and overwrite the cache. The edge store shared
+                        by the graph types of some graphs is kept, build-graph-caches.py --rebuild removes it.
+        """
         
         if datastore is None:
             self.datastore = os.path.dirname(os.path.abspath(__file__))
         else:
             self.datastore = datastore
-        self.load_data()
-        self.nx_graph = nx.relabel.relabel_nodes(self.nx_graph, symbol_map(self.nx_graph.nodes))
+        self.relabel_genes = relabel_genes
+
+        cache_file = self.cache_file()
+        if cache_file is not None and graph_store.is_cached(cache_file) and not rebuild:
+            print(" loading from cache file " + cache_file)
+            self._set_graph(*graph_store.load(cache_file))
+        else:
+            self.load_data()
+            if relabel_genes:
+                self.relabel(symbol_map(set(self.node_names.tolist())))
+            if cache_file is not None:
+                print(" writing cache file " + cache_file)
+                graph_store.save(cache_file, self.node_names, self.csr)
         
         # Randomize
         self.randomize = randomize
         if self.randomize:
             print("Randomizing the graph")
-            self.nx_graph = nx.relabel.relabel_nodes(self.nx_graph, randmap(self.nx_graph.nodes))
+            self.relabel(randmap(self.node_names.tolist()))
+
+    @property
+    def nx_graph(self):
+        if self._nx_graph is None:
+            self._nx_graph = self.to_networkx()
+        return self._nx_graph
+
+    @nx_graph.setter
+    def nx_graph(self, nx_graph):
+        self._set_graph(*graph_store.from_networkx(nx_graph))
+        self._nx_graph = nx_graph
+
+    def _set_graph(self, node_names, csr):
+        """ Replaces the gene table and adjacency matrix, and resets everything derived from them """
+        self.node_names = node_names
+        self.csr = csr
+        self._nx_graph = None
+        self._node_index = None
+        self._bfs_orders = OrderedDict()
+
+    def set_edgelist(self, sources, targets, weights=None, nodes=None):
+        """
+        Sets the graph from the gene names at both ends of each edge.
+        :param nodes: optional genes to add to the graph even if they have no edges
+        """
+        self._set_graph(*graph_store.from_edgelist(sources, targets, weights, nodes))
+
+    def set_entrez_edgelist(self, sources, targets, weights=None):
+        """
+        Sets the graph from the NCBI (Entrez) gene ids at both ends of each edge. Ids are mapped to HUGO symbols
+        with the gene id table, and the edges of ids which have no symbol are left out.
+        """
+        ends = np.empty(2 * len(sources), dtype=np.int64)
+        ends[0::2], ends[1::2] = sources, targets
+        symbols = map_gene_ids(ends, "entrez", self.datastore)
+        mapped = pd.notnull(symbols)
+        # genes whose edges all go to unmapped ids are kept, like when relabeling the networkx graph
+        nodes = pd.unique(symbols[mapped])
+        kept = mapped[0::2] & mapped[1::2]
+        weights = None if weights is None else np.asarray(weights)[kept]
+        self.set_edgelist(symbols[0::2][kept], symbols[1::2][kept], weights, nodes=nodes)
+
+    def relabel(self, mapping):
+        """ Renames the genes found in mapping, genes which end up with the same name are merged """
+        self._set_graph(*graph_store.relabel(self.node_names, self.csr, mapping))
+
+    def to_networkx(self, nodelist=None):
+        """ Exports the graph, or the subgraph induced by nodelist, to networkx """
+        if nodelist is None:
+            return graph_store.to_networkx(self.node_names, self.adj())
+        ids = self.node_ids(nodelist)
+        ids = ids[ids >= 0]
+        return graph_store.to_networkx(self.node_names[ids], self._select(ids))
+
+    def cache_file(self):
+        """ Path of the binary cache of this graph, or None if the graph should not be cached """
+        if getattr(self, "graph_name", None) is None:
+            return None
+        return self._cache_path(self.graph_name)
+
+    def _cache_path(self, name):
+        """ Path of the cache called name, graphs whose genes are not relabeled are cached as name_raw """
+        if not self.relabel_genes:
+            name += "_raw"
+        return os.path.join(self.datastore, "graphs", name + ".csr")
+
+    def node_ids(self, genes):
+        """ Returns the row of each gene in csr, or -1 for the genes which are not in the graph """
+        if self._node_index is None:
+            self._node_index = pd.Index(self.node_names)
+        return self._node_index.get_indexer(list(genes))
 
     def load_data(self):
         raise NotImplementedError
 
-    def first_degree(self, gene):
+    def _neighbors(self, gene_id):
+        """ Returns the ids of the neighbors of the node gene_id """
+        return self.csr.indices[self.csr.indptr[gene_id]:self.csr.indptr[gene_id + 1]]
+
+    def _select(self, ids):
+        """ Returns the adjacency matrix between the nodes ids, where ids equal to -1 give empty rows and columns """
+        return graph_store.select(self.csr, ids)
+
+    def first_degree(self, gene, neighborhood=True):
+        """
+        Returns the set made of gene and its neighbors, and the dense adjacency matrix between them.
+        :param neighborhood: set to False to skip building the adjacency matrix, None is returned instead
+        """
         neighbors = set([gene])
+        gene_id = self.node_ids([gene])[0]
         # If the node is not in the graph, we will just return that node
-        try:
-            neighbors = neighbors.union(set(self.nx_graph.neighbors(gene)))
-        except Exception as e:
-            # print(e)
-            pass
-        neighborhood = np.asarray(nx.to_numpy_matrix(self.nx_graph.subgraph(neighbors)))
-        return neighbors, neighborhood
+        if gene_id < 0:
+            return neighbors, np.zeros((0, 0)) if neighborhood else None
+        ids = np.union1d(self._neighbors(gene_id), [gene_id])
+        neighbors = neighbors.union(self.node_names[ids].tolist())
+        if not neighborhood:
+            return neighbors, None
+        return neighbors, self._select(ids).toarray().astype(np.float64)
+
+    def first_degree_index(self, genes, columns):
+        """
+        Computes the first degree neighborhoods of many genes at once, as positions in the columns of a dataset.
+        This is equivalent to calling first_degree for each gene and looking its neighbors up in columns,
+        but only takes one sparse row selection.
+        :param genes: genes whose neighborhoods we want
+        :param columns: genes indexing the columns of the dataset, e.g. dataset.df.columns
+        :return: list with, for each gene, the sorted column indices of the gene and its neighbors.
+                 Genes and neighbors which are not in columns are left out.
+        """
+        genes = list(genes)
+        if len(genes) == 0:
+            return []
+        column_of_node, column_of_gene = self._column_positions(genes, columns)
+
+        gene_ids = self.node_ids(genes)
+        present = np.flatnonzero(gene_ids >= 0)
+        rows = self.csr[gene_ids[present]]
+        entry_genes = np.concatenate([np.repeat(present, np.diff(rows.indptr)), np.arange(len(genes))])
+        entry_columns = np.concatenate([column_of_node[rows.indices], column_of_gene])
+        kept = entry_columns >= 0
+        keys = np.unique(entry_genes[kept] * len(columns) + entry_columns[kept])
+        splits = np.searchsorted(keys // len(columns), np.arange(1, len(genes)))
+        return np.split(keys % len(columns), splits)
+
+    def _column_positions(self, genes, columns):
+        """ Returns the position in columns of each node of the graph and of each gene, or -1 if it is not there """
+        column_ids = pd.Series(np.arange(len(columns)), index=list(columns))
+        column_ids = column_ids[~column_ids.index.duplicated(keep="first")]
+        column_of_node = column_ids.reindex(self.node_names).fillna(-1).values.astype(np.int64)
+        column_of_gene = column_ids.reindex(genes).fillna(-1).values.astype(np.int64)
+        return column_of_node, column_of_gene
+
+    def bfs_order(self, gene):
+        """
+        Returns the ids of all the nodes reachable from gene, in breadth-first order and starting with gene.
+        The order is computed once per gene and cached, so that the neighborhoods of all sizes around a gene are
+        prefixes of the same array. Only the orders of the bfs_cache_size genes used last are kept.
+        """
+        if gene in self._bfs_orders:
+            self._bfs_orders.move_to_end(gene)
+            return self._bfs_orders[gene]
+        gene_id = self.node_ids([gene])[0]
+        if gene_id < 0:
+            raise KeyError("The gene {} is not in the graph".format(gene))
+        order = self._bfs_order(gene_id).astype(np.int32)
+        self._bfs_orders[gene] = order
+        while len(self._bfs_orders) > self.bfs_cache_size:
+            self._bfs_orders.popitem(last=False)
+        return order
+
+    def _bfs_order(self, gene_id):
+        return graph_store.bfs_order(self.csr, gene_id)
+
+    def clear_bfs_orders(self):
+        """ Drops the cached breadth-first orders, e.g. once the genes of an experiment are done """
+        self._bfs_orders.clear()
+
+    def bfs_neighborhood(self, gene, num_neighbors, include_self=True):
+        """
+        Returns the num_neighbors genes closest to gene in breadth-first order, and their sparse adjacency matrix.
+        :return: node_names, csr adjacency matrix with rows and columns in the order of node_names
+        """
+        ids = self.bfs_order(gene)
+        ids = ids[:num_neighbors] if include_self else ids[1:num_neighbors + 1]
+        return self.node_names[ids], self._select(ids)
 
     def bfs_sample_neighbors(self, gene, num_neighbors, include_self=True):
-        neighbors = nx.OrderedGraph()
-        if include_self:
-            neighbors.add_node(gene)
-        bfs = nx.bfs_edges(self.nx_graph, gene)
-        for u, v in bfs:
-            if neighbors.number_of_nodes() == num_neighbors:
-                break
-            neighbors.add_node(v)
+        return graph_store.to_networkx(*self.bfs_neighborhood(gene, num_neighbors, include_self))
 
-        for node in neighbors.nodes():
-            for u, v, d in self.nx_graph.edges(node, data="weight"):
-                if neighbors.has_node(u) and neighbors.has_node(v):
-                    neighbors.add_weighted_edges_from([(u, v, d)])
-        return neighbors
+    def adj(self, nodelist=None, dtype=np.float32, weighted=True):
+        """
+        Returns the adjacency matrix of the graph as a scipy.sparse csr matrix.
+        :param nodelist: genes to use as rows and columns, in this order (e.g. the columns of a dataset).
+                         Genes which are not in the graph get empty rows and columns. Defaults to node_names.
+        :param dtype: dtype of the returned matrix
+        :param weighted: set to False to get 1 for every edge instead of its weight
+        """
+        if nodelist is None:
+            adj = self.csr.astype(dtype)
+        else:
+            adj = self._select(self.node_ids(nodelist)).astype(dtype)
+        if not weighted:
+            adj.data[:] = 1
+        return adj
 
-    def adj(self):
-        return nx.to_numpy_matrix(self.nx_graph)
+    def threshold(self, min_weight):
+        """ Returns a copy of the graph without the edges whose weight is lower than min_weight """
+        return self._copy_with(self.node_names, graph_store.threshold(self.csr, min_weight))
+
+    def top_k(self, k):
+        """
+        Returns a copy of the graph where each gene keeps its k heaviest edges. An edge is kept if it is
+        among the k heaviest edges of either of its genes.
+        """
+        return self._copy_with(self.node_names, graph_store.top_k(self.csr, k))
+
+    def random_graphs(self, seeds, mode="permutation", num_swaps=None):
+        """
+        Generates randomized copies of the graph for null models, one per seed. They are built in memory from
+        the loaded graph, one at a time as the generator is consumed.
+        :param seeds: random seeds, e.g. range(100)
+        :param mode: "permutation" shuffles the gene names over the nodes and keeps the edges between nodes.
+                     "edge_swap" keeps the gene names and rewires the edges with double edge swaps,
+                     which preserve the degree of every gene.
+        :param num_swaps: number of edge swaps, defaults to 10 times the number of edges
+        """
+        assert mode in ["permutation", "edge_swap"]
+        for seed in seeds:
+            if mode == "permutation":
+                permutation = np.random.RandomState(seed).permutation(len(self.node_names))
+                yield self._copy_with(self.node_names[permutation], self.csr)
+            else:
+                yield self._copy_with(self.node_names, graph_store.edge_swap(self.csr, num_swaps, seed))
+
+    def _copy_with(self, node_names, csr):
+        """ Returns a shallow copy of the graph with the genes node_names and the adjacency matrix csr """
+        graph = copy.copy(self)
+        graph._set_graph(node_names, csr)
+        return graph
+
+    def degree(self, nodelist=None):
+        """ Returns the number of neighbors of each gene of nodelist (self loops count once) """
+        csr = self.csr if nodelist is None else self._select(self.node_ids(nodelist))
+        return np.diff(csr.indptr)
+
+    def adj_matmul(self, x, nodelist=None, normalize=False):
+        """
+        Returns the product adj(nodelist) @ x.
+        :param normalize: multiply by D^-1/2 adj D^-1/2 instead, the normalization of models.utils.norm_laplacian
+        """
+        adj = self.adj(nodelist)
+        if not normalize:
+            return adj.dot(x)
+        d_inv = _inv_sqrt(np.diff(adj.indptr))
+        return _scale_rows(d_inv, adj.dot(_scale_rows(d_inv, np.asarray(x))))
+
+
+def _inv_sqrt(degree):
+    degree = np.asarray(degree, dtype=np.float64)
+    return np.divide(1., np.sqrt(degree), out=np.zeros_like(degree), where=degree != 0.)
+
+
+def _scale_rows(scale, x):
+    return scale * x if x.ndim == 1 else scale[:, None] * x
 
 
 class RegNetGraph(GeneInteractionGraph):
@@ -75,22 +311,19 @@ class RegNetGraph(GeneInteractionGraph):
     def __init__(self, graph_name="regnet", at_hash="e109e087a8fc8aec45bae3a74a193922ce27fc58", randomize=False, **kwargs):
         self.graph_name = graph_name
         self.at_hash = at_hash
-        super(RegNetGraph, self).__init__(**kwargs)
+        super(RegNetGraph, self).__init__(randomize=randomize, **kwargs)
 
     def load_data(self):
         
         savefile = os.path.join(self.datastore,"graphs", self.graph_name + ".adjlist.gz")
         
         if os.path.isfile(savefile):
-            print(" loading from cache file" + savefile)
-            self.nx_graph = nx.read_adjlist(savefile)
+            print(" loading from adjlist file " + savefile)
+            self._set_graph(*graph_store.read_adjlist(savefile))
         else:
-        
+            import academictorrents as at
             self.nx_graph = nx.OrderedGraph(
                 nx.readwrite.gpickle.read_gpickle(at.get(self.at_hash, datastore=self.datastore)))
-            
-            print(" writing graph")
-            nx.write_adjlist(self.nx_graph, savefile)
 
 class GeneManiaGraph(GeneInteractionGraph):
 
@@ -105,21 +338,26 @@ class GeneManiaGraph(GeneInteractionGraph):
         savefile = os.path.join(self.datastore,"graphs", self.graph_name + ".adjlist.gz")
         
         if os.path.isfile(savefile):
-            print(" loading from cache file" + savefile)
-            self.nx_graph = nx.read_adjlist(savefile)
+            print(" loading from adjlist file " + savefile)
+            self._set_graph(*graph_store.read_adjlist(savefile))
         else:
-        
+            import academictorrents as at
             self.nx_graph = nx.OrderedGraph(
                 nx.readwrite.gpickle.read_gpickle(at.get(self.at_hash, datastore=self.datastore)))
-            
-            print(" writing graph")
-            nx.write_adjlist(self.nx_graph, savefile)
 
 
 class EcoliEcocycGraph(GeneInteractionGraph):
-    def __init__(self, path):  # data/ecocyc-21.5-pathways.col
+    """
+    Graph of the E. coli genes where two genes are connected if they are part of the same EcoCyc pathway.
+    The pathways are stored as a sparse gene x pathway incidence matrix, from which the adjacency matrix of the
+    graph (incidence @ incidence.T, clipped to 1) and the adjacency of each pathway are derived.
+    """
+
+    def __init__(self, path, **kwargs):  # data/ecocyc-21.5-pathways.col
         self.path = path
-        super(EcoliEcocycGraph, self).__init__()
+        # The genes are E. coli genes, they are not renamed with the human gene symbols
+        kwargs.setdefault("relabel_genes", False)
+        super(EcoliEcocycGraph, self).__init__(**kwargs)
 
     def load_data(self):
         d = pd.read_csv(self.path, sep="\t", skiprows=40, header=None)
@@ -128,30 +366,41 @@ class EcoliEcocycGraph(GeneInteractionGraph):
         d = d.loc[:, :110]  # filter gene ids
 
         # collect global names for nodes so all adj are aligned
-        node_names = d.as_matrix().reshape(-1).astype(str)
-        node_names = np.unique(node_names[node_names != "nan"])  # nan removal
-
-        # stores all subgraphs and their pathway names
-        adjs = []
-        adjs_name = []
-        # for each pathway create a graph, add the edges and create a matrix
-        for i, name in enumerate(d.index):
-            G = nx.Graph()
-            G.add_nodes_from(node_names)
-            pathway_genes = np.unique(d.iloc[i].dropna().astype(str).as_matrix())
-            for e1, e2 in itertools.product(pathway_genes, pathway_genes):
-                G.add_edge(e1, e2)
-            adj = nx.to_numpy_matrix(G)
-            adjs.append(adj)
-            adjs_name.append(name)
-
-        # collapse all graphs to one graph
-        adj = np.sum(adjs, axis=0)
-        adj = np.clip(adj, 0, 1)
-
-        self.adj = adj
-        self.adjs = adjs
-        self.adjs_name = adjs_name
+        values = d.values
+        pathway_ids, columns = np.nonzero(pd.notnull(values))
+        node_names, gene_ids = np.unique(values[pathway_ids, columns].astype(str), return_inverse=True)
+
+        self.pathway_names = d.index.values
+        self._set_incidence(node_names, sparse.csr_matrix(
+            (np.ones(len(gene_ids), dtype=np.float32), (gene_ids, pathway_ids)),
+            shape=(len(node_names), len(self.pathway_names))))
+
+    def _set_incidence(self, node_names, incidence):
+        """ Sets the gene x pathway incidence matrix, and the graph which collapses all the pathways """
+        incidence = sparse.csr_matrix(incidence, dtype=np.float32)
+        incidence.data[:] = 1.  # genes listed twice in a pathway
+        adj = (incidence.dot(incidence.T) > 0).astype(np.float32)
+        self._set_graph(graph_store.name_array(node_names), graph_store.to_csr(*sparse.find(sparse.triu(adj)),
+                                                                               num_nodes=len(node_names)))
+        self.incidence = incidence
+
+    def relabel(self, mapping):
+        names = pd.Series(np.asarray(self.node_names, dtype=object))
+        new_names = names.map(mapping)
+        ids, uniques = pd.factorize(new_names.where(new_names.notnull(), names))
+        # genes which end up with the same name are part of the pathways of all the merged genes
+        merge = sparse.csr_matrix((np.ones(len(ids)), (ids, np.arange(len(ids)))), shape=(len(uniques), len(ids)))
+        self._set_incidence(uniques, merge.dot(self.incidence))
+
+    def pathway_adj(self, pathway):
+        """
+        Returns the sparse adjacency matrix of a single pathway, where its genes are all connected to each other.
+        :param pathway: name of the pathway, or its position in pathway_names
+        """
+        if not isinstance(pathway, (int, np.integer)):
+            pathway = list(self.pathway_names).index(pathway)
+        genes = self.incidence[:, pathway]
+        return sparse.csr_matrix(genes.dot(genes.T))
 
 
 class EvolvedGraph(GeneInteractionGraph):
@@ -164,7 +413,8 @@ class EvolvedGraph(GeneInteractionGraph):
         super(EvolvedGraph, self).__init__()
 
     def load_data(self):
-        self.nx_graph = nx.OrderedGraph(nx.from_numpy_matrix(np.load(self.adjacency_path)))
+        adj = sparse.triu(np.load(self.adjacency_path), format="coo")
+        self._set_graph(np.arange(adj.shape[0]), graph_store.to_csr(adj.row, adj.col, adj.data, adj.shape[0]))
 
 
 class HumanNetV1Graph(GeneInteractionGraph):
@@ -172,19 +422,14 @@ class HumanNetV1Graph(GeneInteractionGraph):
     More info on HumanNet V1 : http://www.functionalnet.org/humannet/about.html
     """
 
-    def __init__(self, **kwargs):
-        self.benchmark = self.datastore + "/graphs/HumanNet.v1.benchmark.txt"
-        super(HumanNetV1Graph, self).__init__(**kwargs)
+    def __init__(self, graph_name="humannetv1", randomize=False, **kwargs):
+        self.graph_name = graph_name
+        super(HumanNetV1Graph, self).__init__(randomize=randomize, **kwargs)
 
     def load_data(self):
-        edgelist = pd.read_csv(self.benchmark, header=None, sep="\t").values.tolist()
-        self.nx_graph = nx.OrderedGraph(edgelist)
-        # Map nodes from ncbi to hugo names
-        self.nx_graph = nx.relabel.relabel_nodes(self.nx_graph, ncbi_to_hugo_map(self.nx_graph.nodes, datastore=self.datastore))
-        # Remove nodes which are not covered by the map
-        for node in list(self.nx_graph.nodes):
-            if isinstance(node, int):
-                self.nx_graph.remove_node(node)
+        self.benchmark = self.datastore + "/graphs/HumanNet.v1.benchmark.txt"
+        edgelist = pd.read_csv(self.benchmark, header=None, sep="\t", usecols=[0, 1], dtype=np.int64)
+        self.set_entrez_edgelist(edgelist[0].values, edgelist[1].values)
 
 
 class HumanNetV2Graph(GeneInteractionGraph):
@@ -192,53 +437,58 @@ class HumanNetV2Graph(GeneInteractionGraph):
     More info on HumanNet V1 : http://www.functionalnet.org/humannet/about.html
     """
 
-    def __init__(self, randomize=False, **kwargs):
-        super(HumanNetV2Graph, self).__init__(**kwargs)
+    def __init__(self, graph_name="humannetv2", randomize=False, **kwargs):
+        self.graph_name = graph_name
+        super(HumanNetV2Graph, self).__init__(randomize=randomize, **kwargs)
 
     def load_data(self):
         self.benchmark = self.datastore + "/graphs/HumanNet-XN.tsv"
-        edgelist = pd.read_csv(self.benchmark, header=None, sep="\t", skiprows=1).values[:, :2].tolist()
-        self.nx_graph = nx.OrderedGraph(edgelist)
-        # Map nodes from ncbi to hugo names
-        self.nx_graph = nx.relabel.relabel_nodes(self.nx_graph, ncbi_to_hugo_map(self.nx_graph.nodes, datastore=self.datastore))
-        # Remove nodes which are not covered by the map
-        for node in list(self.nx_graph.nodes):
-            if isinstance(node, float):
-                self.nx_graph.remove_node(node)
+        edgelist = pd.read_csv(self.benchmark, header=None, sep="\t", skiprows=1).dropna()
+        # edges are weighted by their log likelihood score
+        self.set_entrez_edgelist(edgelist[0].values.astype(np.int64), edgelist[1].values.astype(np.int64),
+                                 edgelist[2].values)
 
 
 class FunCoupGraph(GeneInteractionGraph):
     """
-    Class for loading and processing FunCoup into a NetworkX object
+    Class for loading and processing FunCoup into a GeneInteractionGraph
     Please download the data file - 'FC4.0_H.sapiens_full.gz' from
     http://funcoup.sbc.su.se/downloads/ and place it in the 
     graphs folder before instantiating this class
     """
 
-    def __init__(self, graph_name='funcoup', randomize=False, **kwargs):
+    def __init__(self, graph_name='funcoup', weight='PFC', randomize=False, **kwargs):
+        """
+        :param weight: score used as edge weight, either 'PFC' (probabilistic confidence)
+                       or 'FBS_max' (maximum final Bayesian score)
+        """
+        assert weight in ['PFC', 'FBS_max']
         self.graph_name = graph_name
-        super(FunCoupGraph, self).__init__(**kwargs)
+        self.weight = weight
+        super(FunCoupGraph, self).__init__(randomize=randomize, **kwargs)
+
+    def cache_file(self):
+        name = self.graph_name if self.weight == 'PFC' else self.graph_name + "_" + self.weight
+        return self._cache_path(name)
 
     def load_data(self):
         
         savefile = os.path.join(self.datastore,"graphs", self.graph_name + ".adjlist.gz")
         
-        if os.path.isfile(savefile):
-            print(" loading from cache file" + savefile)
-            self.nx_graph = nx.read_adjlist(savefile)
+        # The adjlist file is unweighted, it is only used for the default weight when the data file is missing
+        if not os.path.isfile(self._data_file()) and os.path.isfile(savefile) and self.weight == 'PFC':
+            print(" loading from adjlist file " + savefile)
+            self._set_graph(*graph_store.read_adjlist(savefile))
         else:
-            pkl_file = os.path.join(self.datastore,"graphs", self.graph_name + ".pkl")
-            if not os.path.isfile(pkl_file):
-                print(" creating graph")
-                self._preprocess_and_pickle(save_name=pkl_file)
-            self.nx_graph = nx.OrderedGraph(nx.read_gpickle(pkl_file))
-                                
-            print(" writing graph")
-            nx.write_adjlist(self.nx_graph, savefile)
-
-    def _preprocess_and_pickle(self, save_name):
+            print(" creating graph")
+            self._preprocess()
+
+    def _data_file(self):
+        return os.path.join(self.datastore,"graphs", 'FC4.0_H.sapiens_full.gz')
+
+    def _preprocess(self):
         names_map_file = os.path.join(self.datastore,"graphs", 'ensembl_to_hugo.tsv')
-        data_file = os.path.join(self.datastore,"graphs", 'FC4.0_H.sapiens_full.gz')
+        data_file = self._data_file()
 
         names = pd.read_csv(names_map_file, sep='\t')
         names.columns = ['symbol', 'ensembl']
@@ -251,10 +501,8 @@ class FunCoupGraph(GeneInteractionGraph):
         data['3:Gene2'] = data['3:Gene2'].map(names)
         data = data.dropna(subset=['2:Gene1', '3:Gene2'])
 
-        graph = nx.from_pandas_edgelist(data, source='2:Gene1', target='3:Gene2',
-                                        # edge_attr=['#0:PFC', '1:FBS_max'], # Uncomment to include edge attributes
-                                        create_using=nx.OrderedGraph)
-        nx.write_gpickle(graph, save_name)
+        weights = data['#0:PFC'] if self.weight == 'PFC' else data['1:FBS_max']
+        self.set_edgelist(data['2:Gene1'].values, data['3:Gene2'].values, weights.values)
 
 
 class HetIOGraph(GeneInteractionGraph):
@@ -262,40 +510,50 @@ class HetIOGraph(GeneInteractionGraph):
     Class for the HetIO graph. More information about HetIO can be found on - 
     github.com/hetio/hetionet
     het.io
+
+    The gene to gene edges of every type are read in a single pass into an edge store (graphs/hetio.edges),
+    from which the graph of each graph_type is built.
     """
 
+    name_to_edge = {'interaction': ['GiG'], 'regulation': ['Gr>G'], 'covariation': ['GcG'],
+                    'all': ['GiG', 'Gr>G', 'GcG']}
+    edge_store_name = "hetio.edges"
+
     def __init__(self, graph_name="hetio", graph_type='interaction', randomize=False, **kwargs):
         self.graph_name = graph_name
-        name_to_edge = {'interaction': 'GiG', 'regulation': 'Gr>G', 'covariation': 'GcG',
-                        'all': 'GiG|Gr>G|GcG'}
-        assert graph_type in name_to_edge.keys()
+        assert graph_type in self.name_to_edge.keys()
         self.graph_type = graph_type
-        self.edge = name_to_edge[graph_type]
-        self.filename = 'hetio_{}_graph.pkl'.format(graph_type)
-        super(HetIOGraph, self).__init__(**kwargs)
+        self.edge = self.name_to_edge[graph_type]
+        super(HetIOGraph, self).__init__(randomize=randomize, **kwargs)
         
     def load_data(self):
         
         savefile = os.path.join(self.datastore,"graphs", 'hetio_{}'.format(self.graph_type) + ".adjlist.gz")
         
         if os.path.isfile(savefile):
-            print(" loading from cache file" + savefile)
-            self.nx_graph = nx.read_adjlist(savefile)
+            print(" loading from adjlist file " + savefile)
+            self._set_graph(*graph_store.read_adjlist(savefile))
         else:
-            pkl_file = os.path.join(self.datastore,"graphs", 'hetio_{}_graph'.format(self.graph_type) + ".pkl")
-        
-            if not os.path.isfile(pkl_file):
-                self._process_and_pickle(save_name=pkl_file)
-            self.nx_graph = nx.OrderedGraph(nx.read_gpickle(pkl_file))
-            
-            print(" writing graph")
-            nx.write_adjlist(self.nx_graph, savefile)
-            
-
-    def _process_and_pickle(self, save_name):
+            edge_store = os.path.join(self.datastore, "graphs", self.edge_store_name)
+            if not graph_store.is_cached(edge_store):
+                self.build_edge_store(edge_store)
+            edges = graph_store.load_arrays(edge_store)
+            metaedges = graph_store.load_meta(edge_store)["metaedges"]
+            selected_edges = np.isin(edges["metaedge"], [metaedges.index(edge) for edge in self.edge])
+            self._set_graph(*graph_store.from_ids(edges["genes"], edges["rows"][selected_edges],
+                                                  edges["cols"][selected_edges]))
+
+    def cache_file(self):
+        return self._cache_path('hetio_{}'.format(self.graph_type))
+
+    def build_edge_store(self, edge_store):
+        """
+        Writes the edges between genes of every metaedge type to edge_store, where each edge is stored once per
+        type with the position of its type in the metaedges list of the meta data.
+        """
         names_map_file = os.path.join(self.datastore,"graphs", 'hetionet-v1.0-nodes.tsv')
         data_file = os.path.join(self.datastore,"graphs", 'hetionet-v1.0-edges.sif.gz')
-        if not (os.path.isfile(names_map_file) or os.path.isfile(data_file)):
+        if not (os.path.isfile(names_map_file) and os.path.isfile(data_file)):
             print(""" Please download the files from https://github.com/hetio/hetionet/tree/master/hetnet/tsv:
             
             -- hetionet-v1.0-nodes.tsv
@@ -304,18 +562,34 @@ class HetIOGraph(GeneInteractionGraph):
             sys.exit()
 
         node_ids = pd.read_csv(names_map_file, sep='\t')
-        node_ids = node_ids.loc[node_ids.kind == 'Gene'].drop(columns='kind')
-        node_ids = node_ids.set_index('id').squeeze()
-
-        edges = pd.read_csv(data_file, sep='\t', compression='gzip')
-        edges = edges.loc[edges.metaedge.str.contains(self.edge)].drop(columns='metaedge')
-
-        # Convert the HetIO Entrez IDs into gene symbols
-        edges = edges.stack().map(node_ids).unstack()
-        edges = edges.dropna().drop_duplicates()
-
-        graph = nx.from_pandas_edgelist(edges, create_using=nx.OrderedGraph)
-        nx.write_gpickle(graph, save_name)
+        node_ids = node_ids.loc[node_ids.kind == 'Gene']
+        gene_of_node, genes = pd.factorize(node_ids['name'].values)
+        node_index = pd.Index(node_ids['id'].values)
+
+        metaedges = self.name_to_edge['all']
+        edges = pd.read_csv(data_file, sep='\t', compression='gzip', dtype="category")
+        edges = edges.loc[edges.metaedge.isin(metaedges)]
+
+        # Convert the HetIO Entrez IDs into gene symbols, dropping the edges whose ends are not genes
+        ends = []
+        for column in ['source', 'target']:
+            positions = node_index.get_indexer(edges[column].cat.categories)
+            gene_ids = np.where(positions >= 0, gene_of_node[positions], -1)
+            ends.append(gene_ids[edges[column].cat.codes.values])
+        metaedge = pd.Index(metaedges).get_indexer(edges.metaedge.astype(str))
+        genes_only = (ends[0] >= 0) & (ends[1] >= 0)
+        rows = np.minimum(ends[0], ends[1])[genes_only]
+        cols = np.maximum(ends[0], ends[1])[genes_only]
+        metaedge = metaedge[genes_only]
+
+        # Keep each edge once per metaedge type
+        num_genes = len(genes)
+        _, first = np.unique((metaedge * num_genes + rows) * num_genes + cols, return_index=True)
+        first = np.sort(first)
+        arrays = {"genes": graph_store.name_array(genes).astype(str), "rows": rows[first].astype(np.int32),
+                  "cols": cols[first].astype(np.int32), "metaedge": metaedge[first].astype(np.uint8)}
+        print(" writing edge store " + edge_store)
+        graph_store.save_arrays(edge_store, arrays, metaedges=metaedges, num_nodes=num_genes, num_edges=len(first))
 
 
 class StringDBGraph(GeneInteractionGraph):
@@ -323,49 +597,121 @@ class StringDBGraph(GeneInteractionGraph):
     String DB graph. Note that there are several types of interactions.
     One can select the desired interactions among name_to_edge keys
 
+    The links file is read once, in chunks, into an edge store (graphs/stringdb.edges) which keeps the scores of
+    every channel. The graph of each graph_type is then built from this store without reading the links file again.
+    When several pairs of proteins map to the same pair of genes, the edge gets the highest score of these pairs in
+    each channel, independently of their order in the links file.
+
     Download link : https://string-db.org/cgi/download.pl?sessionId=qJO5wpaPqJC7&species_text=Homo+sapiens
     """
 
-    def __init__(self, graph_type='all', randomize=False, **kwargs):
+    name_to_edge = {"neighborhood": "neighborhood",
+                    "fusion": "fusion",
+                    "cooccurence": "cooccurence",
+                    "coexpression": "coexpression",
+                    "experimental": "experimental",
+                    "database": "database",
+                    "textmining": "textmining",
+                    "all": "combined_score"}
+    edge_store_name = "stringdb.edges"
+
+    def __init__(self, graph_type='all', min_score=1, chunksize=1000000, randomize=False, **kwargs):
+        """
+        :param graph_type: one of the name_to_edge keys
+        :param min_score: edges whose score in the selected channel (between 0 and 1000) is lower are left out
+        :param chunksize: number of lines of the links file read at once when building the edge store
+        """
         self.proteinlinks = "data/graphs/9606.protein.links.detailed.v11.0.txt"
-        self.name_to_edge = {"neighborhood": "neighborhood",
-                             "fusion": "fusion",
-                             "cooccurence": "cooccurence",
-                             "coexpression": "coexpression",
-                             "experimental": "experimental",
-                             "database": "database",
-                             "textmining": "textmining",
-                             "all": "combined_score"}
         assert graph_type in self.name_to_edge.keys()
         self.graph_type = graph_type
-        super(StringDBGraph, self).__init__(**kwargs)
+        self.min_score = min_score
+        self.chunksize = chunksize
+        super(StringDBGraph, self).__init__(randomize=randomize, **kwargs)
 
     def load_data(self):
         
         savefile = self.datastore + "/graphs/stringdb_graph_" + self.graph_type + "_edges.adjlist"
+        edge_store = os.path.join(self.datastore, "graphs", self.edge_store_name)
+        self.proteinlinks = self.datastore + "/graphs/9606.protein.links.detailed.v11.0.txt"
         
-        if os.path.isfile(savefile):
-            print(" loading from cache file" + savefile)
-            self.nx_graph = nx.read_adjlist(savefile)
+        # The adjlist file is unweighted, it is only used when neither the edge store nor the links file exist
+        weighted_sources = graph_store.is_cached(edge_store) or os.path.isfile(self.proteinlinks)
+        if not weighted_sources and os.path.isfile(savefile) and self.min_score == 1:
+            print(" loading from adjlist file " + savefile)
+            self._set_graph(*graph_store.read_adjlist(savefile))
         else:
-            print("Building StringDB Graph. It can take a while the first time...")
-            self.proteinlinks = self.datastore + "/graphs/9606.protein.links.detailed.v11.0.txt"
-            print(" ensp_to_hugo_map")
-            ensmap = ensp_to_hugo_map(self.datastore)
-            print(" reading self.proteinlinks")
-            edges = pd.read_csv(self.proteinlinks, sep=' ')
-            selected_edges = edges[self.name_to_edge[self.graph_type]] != 0
-            edgelist = edges[selected_edges][["protein1", "protein2"]].values.tolist()
-            edgelist = [[ensmap[edge[0][5:]], ensmap[edge[1][5:]]] for edge in edgelist
-                        if edge[0][5:] in ensmap.keys() and edge[1][5:] in ensmap.keys()]
-            print(" creating OrderedGraph")
-            self.nx_graph = nx.OrderedGraph(edgelist)
-            print(" writing graph")
-            nx.write_adjlist(self.nx_graph, savefile)
+            if not graph_store.is_cached(edge_store):
+                self.build_edge_store(edge_store)
+            edges = graph_store.load_arrays(edge_store)
+            scores = edges[self.name_to_edge[self.graph_type]]
+            selected_edges = scores >= self.min_score
+            print(" creating graph")
+            # edges are weighted by their score, scaled to [0, 1]
+            self._set_graph(*graph_store.from_ids(edges["genes"], edges["rows"][selected_edges],
+                                                  edges["cols"][selected_edges], scores[selected_edges] / 1000.))
             print("Graph built !")
 
+    def build_edge_store(self, edge_store):
+        """
+        Reads the links file in chunks and writes the edges between genes, with the score of every channel,
+        to edge_store. The proteins of each chunk are mapped to genes through their categorical codes, so that
+        each distinct protein is only looked up once per chunk.
+        """
+        print("Building StringDB edge store. It can take a while the first time...")
+        table = gene_id_table(self.datastore, "ensp")
+        proteins = pd.Index(table["ensp_keys"])
+        gene_of_protein, genes = pd.factorize(table["ensp_symbols"])
+
+        channels = list(self.name_to_edge.values())
+        rows, cols, scores = [], [], {channel: [] for channel in channels}
+        print(" reading self.proteinlinks")
+        reader = pd.read_csv(self.proteinlinks, sep=' ', chunksize=self.chunksize,
+                             dtype=dict({"protein1": "category", "protein2": "category"},
+                                        **{channel: np.uint16 for channel in channels}))
+        for chunk in reader:
+            ends = []
+            for column in ["protein1", "protein2"]:
+                # the ids look like 9606.ENSP00000000233
+                protein_ids = proteins.get_indexer(chunk[column].cat.categories.str[5:])
+                gene_ids = np.where(protein_ids >= 0, gene_of_protein[protein_ids], -1)
+                ends.append(gene_ids[chunk[column].cat.codes.values])
+            mapped = (ends[0] >= 0) & (ends[1] >= 0)
+            rows.append(np.minimum(ends[0], ends[1])[mapped])
+            cols.append(np.maximum(ends[0], ends[1])[mapped])
+            for channel in channels:
+                scores[channel].append(chunk[channel].values[mapped])
+
+        # Each interaction is listed in both directions, and several pairs of proteins can map to the same pair of
+        # genes: each pair of genes is kept once, with the highest score of its protein pairs in each channel
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        keys = rows.astype(np.int64) * len(genes) + cols
+        order = np.argsort(keys, kind="stable")
+        starts = np.flatnonzero(np.diff(keys[order], prepend=-1))
+        first = order[starts]
+        arrays = {"genes": graph_store.name_array(genes).astype(str),
+                  "rows": rows[first].astype(np.int32), "cols": cols[first].astype(np.int32)}
+        for channel in channels:
+            channel_scores = np.concatenate(scores[channel])[order]
+            arrays[channel] = np.maximum.reduceat(channel_scores, starts) if len(starts) else channel_scores
+        print(" writing edge store " + edge_store)
+        graph_store.save_arrays(edge_store, arrays, num_nodes=len(genes), num_edges=len(first))
+
+    def cache_file(self):
+        name = "stringdb_graph_" + self.graph_type
+        if self.min_score != 1:
+            name += "_min" + str(self.min_score)
+        return self._cache_path(name)
+
             
 class LandmarkGraph(GeneInteractionGraph):
+    """
+    Graph where each gene is connected to the 978 landmark genes identified in the LINCS project,
+    see https://clue.io/connectopedia/what_are_landmark_genes for details.
+
+    The N x 978 edges are never stored. The graph is described by is_landmark, a boolean mask over node_names,
+    from which neighborhoods, adjacency products and degrees are computed analytically. Adjacency matrices are
+    only built, in a vectorized way, for the genes passed to adj.
+    """
     
     def __init__(self, gene_names, graph_name="landmark", **kwargs):
         self.graph_name = graph_name
@@ -373,19 +719,101 @@ class LandmarkGraph(GeneInteractionGraph):
         super(LandmarkGraph, self).__init__(**kwargs)
 
     def load_data(self):
-        from tqdm import tqdm
-        self.nx_graph = nx.Graph()
-        
         landmark_genes = list(np.load(self.datastore + "/datastore/landmarkgenes.npy"))
-        self.nx_graph.add_nodes_from(landmark_genes)
-        print(" loaded landmark genes. nodes="+str(len(self.nx_graph.nodes)))
-        
-        self.nx_graph.add_nodes_from(self.gene_names)
-        print(" merged gene_names to graph. nodes="+str(len(self.nx_graph.nodes)))
-
-        print(" attaching edges to landmark genes...")
-        to_add = itertools.product(self.nx_graph.nodes, landmark_genes)
-        self.nx_graph.add_edges_from(tqdm(to_add, total=(len(self.nx_graph.nodes)*len(landmark_genes))))
-        
-        
-        
\ No newline at end of file
+        node_names = pd.unique(np.array(landmark_genes + list(self.gene_names), dtype=object))
+        print(" merged gene_names to landmark genes. nodes="+str(len(node_names)))
+        self._set_graph(graph_store.name_array(node_names), None)
+        self.is_landmark = np.isin(node_names, landmark_genes)
+
+    def cache_file(self):
+        # The graph depends on gene_names, so it is not cached
+        return None
+
+    def relabel(self, mapping):
+        names = pd.Series(np.asarray(self.node_names, dtype=object))
+        new_names = names.map(mapping)
+        ids, uniques = pd.factorize(new_names.where(new_names.notnull(), names))
+        # a merged gene is a landmark if any of the genes it was made of is
+        is_landmark = np.zeros(len(uniques), dtype=bool)
+        np.logical_or.at(is_landmark, ids, self.is_landmark)
+        self._set_graph(graph_store.name_array(uniques), None)
+        self.is_landmark = is_landmark
+
+    def _masks(self, ids):
+        """ Returns which of ids are in the graph, and which are landmarks """
+        ids = np.asarray(ids)
+        present = ids >= 0
+        return present, present & self.is_landmark[np.where(present, ids, 0)]
+
+    def _neighbors(self, gene_id):
+        if self.is_landmark[gene_id]:
+            return np.arange(len(self.node_names))
+        return np.flatnonzero(self.is_landmark)
+
+    def _select(self, ids):
+        # Every present gene is connected to the landmarks, i.e. adj = M + M.T with M = present * landmark.T
+        present, landmark = self._masks(ids)
+        landmark_columns = np.flatnonzero(landmark)
+        indptr = np.zeros(len(present) + 1, dtype=np.int64)
+        np.cumsum(present * len(landmark_columns), out=indptr[1:])
+        indices = np.tile(landmark_columns, present.sum())
+        to_landmarks = sparse.csr_matrix((np.ones(len(indices), dtype=np.float32), indices, indptr),
+                                         shape=(len(present), len(present)))
+        adj = (to_landmarks + to_landmarks.T).tocsr()
+        adj.data[:] = 1.
+        return adj
+
+    def adj(self, nodelist=None, dtype=np.float32, weighted=True):
+        # every edge has a weight of 1
+        ids = np.arange(len(self.node_names)) if nodelist is None else self.node_ids(nodelist)
+        return self._select(ids).astype(dtype)
+
+    def degree(self, nodelist=None):
+        ids = np.arange(len(self.node_names)) if nodelist is None else self.node_ids(nodelist)
+        present, landmark = self._masks(ids)
+        # a landmark is connected to every gene, other genes to every landmark
+        return present * landmark.sum() + landmark * (present & ~landmark).sum()
+
+    def adj_matmul(self, x, nodelist=None, normalize=False):
+        ids = np.arange(len(self.node_names)) if nodelist is None else self.node_ids(nodelist)
+        present, landmark = self._masks(ids)
+        x = np.asarray(x, dtype=np.float64)
+        if normalize:
+            d_inv = _inv_sqrt(self.degree(nodelist))
+            x = _scale_rows(d_inv, x)
+        # every row sums the landmarks, landmark rows also sum the other genes
+        res = np.multiply.outer(present, landmark.dot(x)) + np.multiply.outer(landmark, (present & ~landmark).dot(x))
+        if normalize:
+            res = _scale_rows(d_inv, res)
+        return res
+
+    def first_degree_index(self, genes, columns):
+        genes = list(genes)
+        column_of_node, column_of_gene = self._column_positions(genes, columns)
+        all_columns = np.unique(column_of_node[column_of_node >= 0])
+        landmark_columns = np.unique(column_of_node[self.is_landmark & (column_of_node >= 0)])
+        present, landmark = self._masks(self.node_ids(genes))
+        index = []
+        for gene_present, gene_landmark, column in zip(present, landmark, column_of_gene):
+            if gene_landmark:
+                # the neighborhood of a landmark is the whole graph, the same array is shared between them
+                index.append(all_columns)
+            elif not gene_present:
+                index.append(np.array([column] if column >= 0 else [], dtype=np.int64))
+            else:
+                index.append(np.union1d(landmark_columns, [column]) if column >= 0 else landmark_columns)
+        return index
+
+    def _bfs_order(self, gene_id):
+        # the landmarks are visited first, then all the other genes
+        others = np.arange(len(self.node_names)) != gene_id
+        order = [[gene_id], np.flatnonzero(others & self.is_landmark), np.flatnonzero(others & ~self.is_landmark)]
+        if self.is_landmark[gene_id]:
+            order = [[gene_id], np.flatnonzero(others)]
+        return np.concatenate(order)
+
+
+# Graphs used in the experiments, by name. The landmark graph depends on the genes of the dataset.
+graph_dict = {"regnet": RegNetGraph, "genemania": GeneManiaGraph, "humannetv1": HumanNetV1Graph,
+              "humannetv2": HumanNetV2Graph, "funcoup": FunCoupGraph,
+              "hetio": HetIOGraph, "stringdb": StringDBGraph, "landmark": None}
@@ -0,0 +1,92 @@
+""" This file contains GraphBundle, which puts several gene interaction graphs on one shared gene vocabulary.
+
+    Graphs loaded from their binary cache are memory-mapped, so a bundle which is only used for its gene sets
+    (e.g. to find the genes of a dataset covered by every graph) only reads the gene tables of the graphs.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from data.gene_graphs import graph_dict
+
+
+class GraphBundle(object):
+    """
+    Several graphs over one vocabulary of genes, genes, which is the union of the genes of the graphs in order of
+    first appearance. membership is a genes x graphs boolean matrix, and ids[name] gives the position in genes of
+    each node of the graph name.
+    """
+
+    def __init__(self, graphs, **kwargs):
+        """
+        :param graphs: dictionary from name to graph. Graphs can also be given as a graph class, or as the name of
+                       a graph of graph_dict, in which case they are instantiated with kwargs (e.g. datastore)
+        """
+        self.graphs = {}
+        for name, graph in graphs.items():
+            if isinstance(graph, str):
+                graph = graph_dict[graph]
+            if isinstance(graph, type):
+                graph = graph(**kwargs)
+            self.graphs[name] = graph
+        self.names = list(self.graphs.keys())
+
+        node_names = [np.asarray(graph.node_names) for graph in self.graphs.values()]
+        self.genes = pd.Index(pd.unique(np.concatenate(node_names).astype(object)))
+        self.ids = {name: self.genes.get_indexer(names) for name, names in zip(self.names, node_names)}
+        self.membership = np.zeros((len(self.genes), len(self.names)), dtype=bool)
+        for i, name in enumerate(self.names):
+            self.membership[self.ids[name], i] = True
+
+    @classmethod
+    def from_names(cls, names, **kwargs):
+        """ Returns the bundle of the graphs of graph_dict called names """
+        return cls({name: graph_dict[name] for name in names}, **kwargs)
+
+    def _columns(self, names):
+        names = self.names if names is None else list(names)
+        return [self.names.index(name) for name in names]
+
+    def intersection(self, names=None):
+        """ Returns the genes which are in all the graphs names (defaults to all the graphs of the bundle) """
+        return self.genes.values[self.membership[:, self._columns(names)].all(axis=1)]
+
+    def union(self, names=None):
+        """ Returns the genes which are in at least one of the graphs names """
+        return self.genes.values[self.membership[:, self._columns(names)].any(axis=1)]
+
+    def covered_genes(self, genes, names=None):
+        """
+        Returns the genes, e.g. the columns of a dataset, which are in all the graphs names, in the order of genes
+        """
+        genes = np.asarray(list(genes), dtype=object)
+        ids = self.genes.get_indexer(genes)
+        covered = (ids >= 0) & self.membership[ids, :][:, self._columns(names)].all(axis=1)
+        return genes[covered]
+
+    def vocabulary_adj(self, name):
+        """ Returns the binary adjacency matrix of the graph name, with the rows and columns of genes """
+        adj = self.graphs[name].adj(weighted=False).tocoo()
+        ids = self.ids[name]
+        return sparse.csr_matrix((adj.data, (ids[adj.row], ids[adj.col])), shape=(len(self.genes),) * 2)
+
+    def edge_intersection(self, names=None):
+        """ Returns the binary adjacency matrix over genes of the edges which are in all the graphs names """
+        names = self.names if names is None else list(names)
+        counts = sum(self.vocabulary_adj(name) for name in names)
+        return (counts >= len(names)).astype(np.float32).tocsr()
+
+    def edge_union(self, names=None):
+        """ Returns the binary adjacency matrix over genes of the edges which are in at least one of the graphs """
+        names = self.names if names is None else list(names)
+        counts = sum(self.vocabulary_adj(name) for name in names)
+        return (counts > 0).astype(np.float32).tocsr()
+
+    def adj(self, name, nodelist, **kwargs):
+        """ Returns the adjacency matrix of the graph name with the rows and columns of nodelist, see adj """
+        return self.graphs[name].adj(nodelist=nodelist, **kwargs)
+
+    def adjs(self, nodelist, names=None, **kwargs):
+        """ Returns the adjacency matrices of the graphs names aligned to nodelist, e.g. the columns of a dataset """
+        names = self.names if names is None else list(names)
+        return {name: self.adj(name, nodelist, **kwargs) for name in names}
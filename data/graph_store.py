@@ -0,0 +1,290 @@
+""" This file contains the compact storage used by our gene interaction graphs.
+
+    A graph is kept as a table of gene names and a symmetric adjacency matrix in CSR format
+    (int32 indptr/indices, float32 weights). On disk, each array is saved as its own .npy file inside
+    a cache directory (see array_store) so that it can be memory-mapped on load: opening a cached graph costs
+    milliseconds and several processes on the same machine share the same pages.
+"""
+
+import gzip
+import numpy as np
+import pandas as pd
+import networkx as nx
+from scipy import sparse
+from data import array_store
+from data.array_store import load_arrays, load_meta
+
+# Bump this whenever the layout of the cache directory changes, older caches will then be rebuilt
+CACHE_VERSION = 3
+
+
+def is_cached(path):
+    """ Returns True if path contains a complete graph cache written with the current CACHE_VERSION """
+    return array_store.is_complete(path, CACHE_VERSION)
+
+
+def save(path, node_names, csr):
+    """
+    Writes a graph to the cache directory path. The directory is written under a temporary name and
+    renamed once complete, so concurrent readers never see a partial cache.
+    :param node_names: array of gene names, one per row of csr
+    :param csr: symmetric scipy.sparse adjacency matrix
+    """
+    csr = sparse.csr_matrix(csr)
+    save_arrays(path, {"indptr": csr.indptr.astype(np.int32),
+                       "indices": csr.indices.astype(np.int32),
+                       "weights": csr.data.astype(np.float32),
+                       "genes": np.asarray(node_names).astype(str)},
+                num_nodes=csr.shape[0], num_edges=int(csr.nnz))
+
+
+def load(path, mmap=True):
+    """
+    Reads a graph from the cache directory path.
+    :return: node_names, csr. With mmap=True the arrays are read-only views on the files.
+    """
+    arrays = load_arrays(path, ["indptr", "indices", "weights", "genes"], mmap)
+    num_nodes = len(arrays["genes"])
+    csr = sparse.csr_matrix((arrays["weights"], arrays["indices"], arrays["indptr"]),
+                            shape=(num_nodes, num_nodes), copy=False)
+    return arrays["genes"], csr
+
+
+def save_arrays(path, arrays, **meta):
+    """ Writes named arrays to the cache directory path with the current CACHE_VERSION, see array_store """
+    array_store.save_arrays(path, arrays, CACHE_VERSION, **meta)
+
+
+def to_csr(rows, cols, weights, num_nodes):
+    """
+    Builds the symmetric adjacency matrix of an undirected graph from its edge list.
+    Each edge only needs to be given in one direction. Duplicated edges are merged, keeping the first weight.
+    :param rows, cols: integer node ids of both ends of each edge
+    :param weights: weight of each edge, or None for an unweighted graph
+    :return: csr matrix with sorted int32 indices and float32 weights
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    if weights is None:
+        weights = np.ones(len(rows), dtype=np.float32)
+    weights = np.asarray(weights, dtype=np.float32)
+
+    # Merge duplicated edges on their (lowest id, highest id) key, then mirror them
+    low, high = np.minimum(rows, cols), np.maximum(rows, cols)
+    keys, first = np.unique(low * num_nodes + high, return_index=True)
+    weights = weights[first]
+    low, high = keys // num_nodes, keys % num_nodes
+    off_diagonal = low != high
+    keys = np.concatenate([keys, high[off_diagonal] * num_nodes + low[off_diagonal]])
+    weights = np.concatenate([weights, weights[off_diagonal]])
+    order = np.argsort(keys, kind="stable")
+    keys, data = keys[order], weights[order]
+
+    indptr = np.zeros(num_nodes + 1, dtype=np.int32)
+    np.cumsum(np.bincount(keys // num_nodes, minlength=num_nodes), out=indptr[1:])
+    indices = (keys % num_nodes).astype(np.int32)
+    return sparse.csr_matrix((data, indices, indptr), shape=(num_nodes, num_nodes), copy=False)
+
+
+def from_edgelist(sources, targets, weights=None, nodes=None):
+    """
+    Builds node_names, csr from the names of both ends of each edge.
+    Nodes are numbered in order of first appearance, starting with the optional isolated nodes.
+    """
+    sources = np.asarray(sources, dtype=object)
+    targets = np.asarray(targets, dtype=object)
+    nodes = np.asarray([] if nodes is None else nodes, dtype=object)
+    # interleave sources and targets so that nodes are numbered as if edges were added one by one
+    ends = np.empty(2 * len(sources), dtype=object)
+    ends[0::2], ends[1::2] = sources, targets
+    ids, node_names = pd.factorize(np.concatenate([nodes, ends]))
+    ids = ids[len(nodes):]
+    return name_array(node_names), to_csr(ids[0::2], ids[1::2], weights, len(node_names))
+
+
+def from_ids(node_names, rows, cols, weights=None):
+    """
+    Builds node_names, csr from integer edge ends into node_names. Only the nodes which have edges are kept,
+    numbered in order of first appearance like from_edgelist does.
+    """
+    ends = np.empty(2 * len(rows), dtype=np.int64)
+    ends[0::2], ends[1::2] = rows, cols
+    ids, nodes = pd.factorize(ends)
+    return name_array(np.asarray(node_names)[nodes]), to_csr(ids[0::2], ids[1::2], weights, len(nodes))
+
+
+def read_adjlist(path):
+    """ Reads a networkx adjacency list file (optionally gzipped) into node_names, csr """
+    open_file = gzip.open if path.endswith(".gz") else open
+    sources, targets, nodes = [], [], []
+    with open_file(path, "rt") as f:
+        for line in f:
+            tokens = line.split("#")[0].split()
+            if not tokens:
+                continue
+            nodes.extend(tokens)
+            sources.extend([tokens[0]] * (len(tokens) - 1))
+            targets.extend(tokens[1:])
+    # nodes are numbered in order of appearance in the file, like networkx does
+    return from_edgelist(sources, targets, nodes=pd.unique(np.asarray(nodes, dtype=object)))
+
+
+def relabel(node_names, csr, mapping):
+    """
+    Renames the nodes found in mapping. Nodes which end up with the same name are merged, like
+    networkx.relabel_nodes does.
+    """
+    names = pd.Series(np.asarray(node_names, dtype=object))
+    new_names = names.map(mapping)
+    new_names = new_names.where(new_names.notnull(), names)
+    ids, uniques = pd.factorize(new_names)
+    if len(uniques) == len(names):
+        return name_array(new_names.values), csr
+    upper = sparse.triu(csr, format="coo")
+    return name_array(uniques), to_csr(ids[upper.row], ids[upper.col], upper.data, len(uniques))
+
+
+def bfs_order(csr, source, max_nodes=None):
+    """
+    Returns the ids of the nodes reachable from source in breadth-first order, starting with source.
+    The graph is traversed one level at a time, in the same order as a queue based search.
+    :param max_nodes: stop the traversal once this many nodes have been visited
+    """
+    visited = np.zeros(csr.shape[0], dtype=bool)
+    visited[source] = True
+    frontier = np.array([source])
+    order = [frontier]
+    num_visited = 1
+    while len(frontier) > 0 and (max_nodes is None or num_visited < max_nodes):
+        # neighbors of the frontier in the order in which they would be popped from the queue
+        neighbors = csr[frontier].indices
+        neighbors = neighbors[~visited[neighbors]]
+        _, first = np.unique(neighbors, return_index=True)
+        frontier = neighbors[np.sort(first)]
+        visited[frontier] = True
+        order.append(frontier)
+        num_visited += len(frontier)
+    order = np.concatenate(order)
+    return order if max_nodes is None else order[:max_nodes]
+
+
+def threshold(csr, min_weight):
+    """ Returns csr without the edges whose weight is lower than min_weight """
+    return _keep_entries(csr, csr.data >= min_weight)
+
+
+def top_k(csr, k):
+    """
+    Returns csr restricted to the k heaviest edges of each node. An edge is kept if it is among the k heaviest
+    edges of either of its ends, so that the graph stays symmetric. Ties are broken by lowest node id.
+    """
+    row_of_entry = np.repeat(np.arange(csr.shape[0]), np.diff(csr.indptr))
+    # entries sorted by row, then by decreasing weight
+    order = np.lexsort((-csr.data, row_of_entry))
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order)) - csr.indptr[row_of_entry[order]]
+    kept = _keep_entries(csr, rank < k)
+    kept = kept.maximum(kept.T).tocsr()
+    kept.sort_indices()
+    return kept
+
+
+def edge_swap(csr, num_swaps=None, seed=0, max_tries=100):
+    """
+    Returns a random graph where each node has the same degree as in csr. Pairs of edges a - b, c - d are
+    replaced by a - d, c - b, unless this would create a self loop or an edge which already exists. Each round
+    proposes swaps for disjoint pairs of edges at once. Edges keep their weight, self loops are left in place.
+    :param num_swaps: number of successful swaps, defaults to 10 times the number of edges
+    :param max_tries: stop after max_tries * num_swaps proposed swaps, even if num_swaps is not reached
+    """
+    rng = np.random.RandomState(seed)
+    num_nodes = csr.shape[0]
+    upper = sparse.triu(csr, k=1, format="coo")
+    loops = sparse.triu(sparse.tril(csr), format="coo")
+    rows, cols, weights = upper.row.astype(np.int64), upper.col.astype(np.int64), upper.data
+    num_edges = len(rows)
+    if num_swaps is None:
+        num_swaps = 10 * num_edges
+
+    num_done, num_tries = 0, 0
+    while num_done < num_swaps and num_edges >= 2 and num_tries < max_tries * num_swaps:
+        num_pairs = min(num_edges // 2, num_swaps - num_done)
+        pairs = rng.permutation(num_edges)[:2 * num_pairs]
+        first, second = pairs[0::2], pairs[1::2]
+        # flipping the second edge also draws the a - c, b - d swaps
+        flip = rng.rand(num_pairs) < .5
+        a, b = rows[first], cols[first]
+        c, d = np.where(flip, cols[second], rows[second]), np.where(flip, rows[second], cols[second])
+        new_first = np.minimum(a, d) * num_nodes + np.maximum(a, d)
+        new_second = np.minimum(c, b) * num_nodes + np.maximum(c, b)
+        existing = np.sort(rows * num_nodes + cols)
+        accepted = (a != d) & (c != b) & ~_contains(existing, new_first) & ~_contains(existing, new_second)
+        # two swaps of the same round must not create the same edge
+        proposed = np.sort(np.concatenate([new_first[accepted], new_second[accepted]]))
+        duplicated = proposed[1:][proposed[1:] == proposed[:-1]]
+        accepted &= ~_contains(duplicated, new_first) & ~_contains(duplicated, new_second)
+
+        rows[first[accepted]], cols[first[accepted]] = np.divmod(new_first[accepted], num_nodes)
+        rows[second[accepted]], cols[second[accepted]] = np.divmod(new_second[accepted], num_nodes)
+        num_done += accepted.sum()
+        num_tries += num_pairs
+
+    return to_csr(np.concatenate([rows, loops.row]), np.concatenate([cols, loops.col]),
+                  np.concatenate([weights, loops.data]), num_nodes)
+
+
+def _contains(sorted_keys, keys):
+    """ Returns which of keys are in the sorted array sorted_keys """
+    positions = np.minimum(np.searchsorted(sorted_keys, keys), max(len(sorted_keys) - 1, 0))
+    return (sorted_keys[positions] == keys) if len(sorted_keys) > 0 else np.zeros(len(keys), dtype=bool)
+
+
+def _keep_entries(csr, keep):
+    """ Returns csr with only the stored entries where keep is True """
+    row_of_entry = np.repeat(np.arange(csr.shape[0]), np.diff(csr.indptr))
+    indptr = np.zeros(csr.shape[0] + 1, dtype=csr.indptr.dtype)
+    np.cumsum(np.bincount(row_of_entry[keep], minlength=csr.shape[0]), out=indptr[1:])
+    return sparse.csr_matrix((csr.data[keep], csr.indices[keep], indptr), shape=csr.shape)
+
+
+def select(csr, ids):
+    """
+    Returns csr[ids][:, ids] as a csr matrix, where ids equal to -1 give empty rows and columns
+    :param ids: node ids, e.g. from GeneInteractionGraph.node_ids
+    """
+    ids = np.asarray(ids)
+    present = np.flatnonzero(ids >= 0)
+    sub = csr[ids[present]][:, ids[present]].tocoo()
+    return sparse.csr_matrix((sub.data, (present[sub.row], present[sub.col])), shape=(len(ids), len(ids)))
+
+
+def from_networkx(nx_graph, weight="weight"):
+    """ Converts a networkx graph to node_names, csr. Edges without weight get a weight of 1 """
+    node_names = list(nx_graph.nodes)
+    node_ids = {node: i for i, node in enumerate(node_names)}
+    edges = list(nx_graph.edges(data=weight, default=1.))
+    rows = np.fromiter((node_ids[u] for u, _, _ in edges), dtype=np.int64, count=len(edges))
+    cols = np.fromiter((node_ids[v] for _, v, _ in edges), dtype=np.int64, count=len(edges))
+    weights = np.fromiter((w for _, _, w in edges), dtype=np.float32, count=len(edges))
+    return name_array(node_names), to_csr(rows, cols, weights, len(node_names))
+
+
+def name_array(node_names):
+    """ Returns node_names as a numpy array, without casting non-string names (e.g. unmapped ids) to strings """
+    names = np.empty(len(node_names), dtype=object)
+    names[:] = list(node_names)
+    if all(isinstance(name, str) for name in names):
+        names = names.astype(str)
+    return names
+
+
+def to_networkx(node_names, csr):
+    """ Converts node_names, csr to a weighted networkx graph """
+    graph = nx.Graph()
+    node_names = np.asarray(node_names).tolist()
+    graph.add_nodes_from(node_names)
+    upper = sparse.triu(csr, format="coo")
+    graph.add_weighted_edges_from(zip([node_names[i] for i in upper.row],
+                                      [node_names[i] for i in upper.col],
+                                      upper.data.tolist()))
+    return graph
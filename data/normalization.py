@@ -0,0 +1,146 @@
+""" This file contains ExpressionStats, the per-gene statistics used to normalize expression data.
+
+    The statistics are computed in one streaming pass over chunks of samples, merging the count, mean and sum of
+    squared deviations of each chunk into the running ones (Welford's update, in the pairwise form of Chan et al.),
+    so the data never has to fit in memory. They are then applied batch by batch, or in place on a loaded array.
+"""
+
+import os
+import numpy as np
+from data import array_store
+
+# Bump this whenever the statistics stored on disk change, older statistics will then be computed again
+STATS_VERSION = 1
+
+
+class ExpressionStats(object):
+    """
+    Count, mean, variance, min and max of each gene of samples x genes expression data
+    """
+
+    def __init__(self, nb_genes):
+        self.count = 0
+        self.mean = np.zeros(nb_genes, dtype=np.float64)
+        self.m2 = np.zeros(nb_genes, dtype=np.float64)
+        self.min = np.full(nb_genes, np.inf)
+        self.max = np.full(nb_genes, -np.inf)
+
+    def update(self, chunk):
+        """ Adds the samples of chunk, a samples x genes array, to the statistics """
+        chunk = np.asarray(chunk)
+        nb_samples = chunk.shape[0]
+        if nb_samples == 0:
+            return self
+        chunk_mean = chunk.mean(axis=0, dtype=np.float64)
+        chunk_m2 = np.square(chunk - chunk_mean).sum(axis=0)
+        count = self.count + nb_samples
+        delta = chunk_mean - self.mean
+        self.mean += delta * nb_samples / count
+        self.m2 += chunk_m2 + np.square(delta) * self.count * nb_samples / count
+        self.count = count
+        np.minimum(self.min, chunk.min(axis=0), out=self.min)
+        np.maximum(self.max, chunk.max(axis=0), out=self.max)
+        return self
+
+    @property
+    def variance(self):
+        return self.m2 / max(self.count, 1)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    @classmethod
+    def from_chunks(cls, chunks, nb_genes):
+        """ Returns the statistics of the samples of an iterable of samples x genes chunks """
+        stats = cls(nb_genes)
+        for chunk in chunks:
+            stats.update(chunk)
+        return stats
+
+    @classmethod
+    def from_array(cls, array, chunk_rows=4096):
+        """ Returns the statistics of a samples x genes array (or h5py dataset), read chunk_rows samples at a time """
+        return cls.from_chunks((array[start:start + chunk_rows] for start in range(0, array.shape[0], chunk_rows)),
+                               array.shape[1])
+
+    def select(self, columns):
+        """ Returns the statistics of the genes columns, in this order """
+        stats = ExpressionStats(len(columns))
+        stats.count = self.count
+        stats.mean, stats.m2 = self.mean[columns], self.m2[columns]
+        stats.min, stats.max = self.min[columns], self.max[columns]
+        return stats
+
+    def centered(self):
+        """ Returns the statistics of the data once centered, e.g. to scale the centered data of an expression store """
+        stats = self.select(np.arange(len(self.mean)))
+        stats.mean = np.zeros_like(self.mean)
+        stats.min, stats.max = self.min - self.mean, self.max - self.mean
+        return stats
+
+    def apply(self, x, method="center", copy=True, low=-10., high=10.):
+        """
+        Returns x, a samples x genes array, normalized with the statistics:
+        - center: x - mean
+        - standardize: (x - mean) / std, genes without variance are only centered
+        - min_max: each gene is scaled linearly from [min, max] to [low, high]
+        :param copy: if False, float32 arrays are normalized in place
+        """
+        x = np.array(x, dtype=np.float32, copy=True) if copy else np.asarray(x, dtype=np.float32)
+        if method == "center":
+            x -= self.mean.astype(np.float32)
+        elif method == "standardize":
+            std = self.std
+            x -= self.mean.astype(np.float32)
+            x /= np.where(std > 0, std, 1.).astype(np.float32)
+        elif method == "min_max":
+            value_range = self.max - self.min
+            scale = (high - low) / np.where(value_range > 0, value_range, 1.)
+            x -= self.min.astype(np.float32)
+            x *= scale.astype(np.float32)
+            x += np.float32(low)
+        else:
+            raise ValueError("Unknown normalization " + str(method))
+        return x
+
+    def transform(self, method="center", **kwargs):
+        """ Returns the function which normalizes a batch with method, e.g. for HDF5BatchStream """
+        return lambda x: self.apply(x, method=method, **kwargs)
+
+    def save(self, path, **meta):
+        array_store.save_arrays(path, {"mean": self.mean, "m2": self.m2, "min": self.min, "max": self.max},
+                                STATS_VERSION, count=self.count, **meta)
+
+    @classmethod
+    def load(cls, path):
+        arrays = array_store.load_arrays(path, mmap=False)
+        stats = cls(len(arrays["mean"]))
+        stats.count = array_store.load_meta(path)["count"]
+        stats.mean, stats.m2, stats.min, stats.max = arrays["mean"], arrays["m2"], arrays["min"], arrays["max"]
+        return stats
+
+
+def hdf5_stats(dataset, path=None, chunk_rows=4096):
+    """
+    Returns the statistics of the 2d h5py dataset, which are computed in one pass the first time and stored next to
+    the HDF5 file. They are computed again when the file changes.
+    :param path: where to store the statistics, defaults to <file>.<dataset>.stats
+    """
+    filename = dataset.file.filename
+    if path is None:
+        path = "{}.{}.stats".format(filename, dataset.name.strip("/").replace("/", "_"))
+    source = os.stat(filename)
+    source = {"source_size": source.st_size, "source_mtime": source.st_mtime}
+    if array_store.is_complete(path, STATS_VERSION):
+        meta = array_store.load_meta(path)
+        if all(meta.get(key) == value for key, value in source.items()):
+            return ExpressionStats.load(path)
+
+    print("Computing the statistics of " + filename + ", this only happens the first time it is used.")
+    stats = ExpressionStats.from_array(dataset, chunk_rows=chunk_rows)
+    try:
+        stats.save(path, **source)
+    except OSError:
+        print("The statistics could not be saved to " + path)
+    return stats
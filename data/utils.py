@@ -1,8 +1,9 @@
 import os
 import csv
 import pickle
-from gtfparse import read_gtf
 import random
+import numpy as np
+import pandas as pd
 
 
 def record_result(results, experiment, filename):
@@ -14,47 +15,98 @@ def record_result(results, experiment, filename):
     pickle.dump(results, open(filename, "wb"))
     return results
 
-def symbol_map(gene_symbols):
-    """
-    This gene code map was generated on February 18th, 2019
-    at this URL: https://www.genenames.org/cgi-bin/download/custom?col=gd_app_sym&col=gd_prev_sym&status=Approved&status=Entry%20Withdrawn&hgnc_dbtag=on&order_by=gd_app_sym_sort&format=text&submit=submit
-    it enables us to map the gene names to the newest version of the gene labels
-    """
-    filename = os.path.join(os.path.dirname(__file__), 'genenames_code_map_Feb2019.txt')
-    with open(filename) as csv_file:
-        csv_reader = csv.reader(csv_file, delimiter='\t')
-        x = {row[0]: row[1] for row in csv_reader}
+# Identifier namespaces of the gene id table, each mapped to HUGO symbols
+GENE_ID_NAMESPACES = ["previous", "entrez", "ensg", "ensp"]
 
-        map = {}
-        for key, val in x.items():
-            for v in val.split(", "):
-                if key not in gene_symbols:
-                    map[v] = key
-    return map
+# Bump this whenever the layout of the gene id table changes, older tables will then be compiled again
+GENE_ID_TABLE_VERSION = 1
 
+# Tables already loaded in this process, by path
+_gene_id_tables = {}
 
-def ncbi_to_hugo_map(gene_symbols, datastore="./data"):
-    with open(datastore + '/graphs/enterez_NCBI_to_hugo_gene_symbol_march_2019.txt') as csv_file:
-        next(csv_file)  # Skip first line
-        csv_reader = csv.reader(csv_file, delimiter='\t')
-        x = {int(row[1]): row[0] for row in csv_reader if row[1] != ""}
 
-        map = {}
-        for key, val in x.items():
-            map[key] = val
-    return map
+def gene_id_table(datastore="./data", namespace=None, rebuild=False):
+    """
+    Returns the compiled gene identifier table of datastore, as a dictionary of memory-mapped arrays where
+    <namespace>_keys holds the identifiers of a namespace and <namespace>_symbols their HUGO symbol:
 
+    - previous: previous symbols of the approved HUGO symbols, in the order of genenames_code_map_Feb2019.txt
+    - entrez: NCBI (Entrez) gene ids, from graphs/enterez_NCBI_to_hugo_gene_symbol_march_2019.txt
+    - ensg: Ensembl gene ids, from datastore/ensembl_map.txt
+    - ensp: Ensembl protein ids, from the GTF file (see ensp_to_hugo_map) and datastore/ensembl_map.txt
 
-def ensg_to_hugo_map(datastore="./data"):
-    with open(datastore + "/datastore/ensembl_map.txt") as csv_file:
-        next(csv_file)  # Skip first line
-        csv_reader = csv.reader(csv_file, delimiter='\t')
-        ensmap = {row[1]: row[0] for row in csv_reader if row[0] != ""}
+    Each namespace is compiled from these text files into datastore/gene_ids.map the first time it is needed.
+    :param namespace: namespace which has to be in the table. Defaults to every namespace whose files exist.
+    :param rebuild: compile the namespaces again even if they are in the table
+    """
+    path = os.path.join(datastore, "datastore", "gene_ids.map")
+    table = None if rebuild else _gene_id_tables.get(os.path.abspath(path))
+    if table is None or namespace is None or namespace + "_keys" not in table:
+        from data import array_store
+        namespaces = GENE_ID_NAMESPACES if namespace is None else [namespace]
+        compiled = []
+        if array_store.is_complete(path, GENE_ID_TABLE_VERSION) and not rebuild:
+            compiled = array_store.load_meta(path)["namespaces"]
+        if any(name not in compiled for name in namespaces):
+            _compile_gene_id_table(datastore, path, [name for name in namespaces if name not in compiled],
+                                   required=namespace is not None)
+        table = array_store.load_arrays(path)
+        _gene_id_tables[os.path.abspath(path)] = table
+    return table
+
+
+def _compile_gene_id_table(datastore, path, namespaces, required=True):
+    """
+    Adds namespaces to the table stored in path, which keeps the namespaces it already has.
+    :param required: raise an IOError when the files of a namespace are missing, instead of leaving it out
+    """
+    from data import array_store
+    print(" compiling the gene id table " + path)
+    readers = {"previous": _read_previous_symbols, "entrez": _read_entrez_ids,
+               "ensg": _read_ensg_ids, "ensp": _read_ensp_ids}
+    arrays, compiled = {}, []
+    if array_store.is_complete(path, GENE_ID_TABLE_VERSION):
+        compiled = [name for name in array_store.load_meta(path)["namespaces"] if name not in namespaces]
+        arrays = array_store.load_arrays(path, [name + suffix for name in compiled
+                                                for suffix in ["_keys", "_symbols"]], mmap=False)
+    for namespace in namespaces:
+        try:
+            keys, symbols = readers[namespace](datastore)
+        except IOError:
+            if required:
+                raise
+            continue
+        keys = np.asarray(keys)
+        arrays[namespace + "_keys"] = keys if keys.dtype.kind == "i" else keys.astype(str)
+        arrays[namespace + "_symbols"] = np.asarray(symbols).astype(str)
+        compiled.append(namespace)
+    array_store.save_arrays(path, arrays, GENE_ID_TABLE_VERSION, namespaces=compiled)
+
+
+def _read_previous_symbols(datastore):
+    filename = os.path.join(os.path.dirname(__file__), 'genenames_code_map_Feb2019.txt')
+    df = pd.read_csv(filename, sep='\t', dtype=str, keep_default_na=False)
+    df = df.drop_duplicates(df.columns[0], keep="last")
+    previous = df[df.columns[1]].str.split(", ")
+    symbols = np.repeat(df[df.columns[0]].values, previous.str.len().values)
+    keys = np.concatenate(previous.values.tolist()).astype(str)
+    return keys[keys != ""], symbols[keys != ""]
 
-    return ensmap
 
+def _read_entrez_ids(datastore):
+    df = pd.read_csv(datastore + '/graphs/enterez_NCBI_to_hugo_gene_symbol_march_2019.txt', sep='\t', dtype=str,
+                     keep_default_na=False)
+    df = df[df[df.columns[1]] != ""].drop_duplicates(df.columns[1], keep="last")
+    return df[df.columns[1]].values.astype(np.int64), df[df.columns[0]].values
 
-def ensp_to_hugo_map(datastore="./data"):
+
+def _read_ensg_ids(datastore):
+    df = pd.read_csv(datastore + "/datastore/ensembl_map.txt", sep='\t', dtype=str, keep_default_na=False)
+    df = df[df[df.columns[0]] != ""].drop_duplicates(df.columns[1], keep="last")
+    return df[df.columns[1]].values, df[df.columns[0]].values
+
+
+def _read_ensp_ids(datastore):
     """
     You should download the file Homo_sapiens.GRCh38.95.gtf from :
     ftp://ftp.ensembl.org/pub/release-95/gtf/homo_sapiens/Homo_sapiens.GRCh38.95.gtf.gz
@@ -63,29 +115,80 @@ def ensp_to_hugo_map(datastore="./data"):
     """
     savefile = datastore + "/datastore/ensp_ensg_df.pkl"
 
-    # If df is already stored, return the corresponding dictionary
+    # If df is already stored, use it
     if os.path.isfile(savefile):
         f = open(savefile, 'rb')
         df = pickle.load(f)
         f.close()
     else:
+        if not os.path.isfile(datastore + "/datastore/Homo_sapiens.GRCh38.95.gtf"):
+            raise IOError("Homo_sapiens.GRCh38.95.gtf is missing from " + datastore + "/datastore")
+        from gtfparse import read_gtf
         df = read_gtf(datastore + "/datastore/Homo_sapiens.GRCh38.95.gtf")
         df = df[df['protein_id'] != ''][['gene_id', 'protein_id']].drop_duplicates()
         df.to_pickle(savefile)
 
-    # ENSG to hugo map
-    with open(datastore + "/datastore/ensembl_map.txt") as csv_file:
-        next(csv_file)  # Skip first line
-        csv_reader = csv.reader(csv_file, delimiter='\t')
-        ensg_map = {row[1]: row[0] for row in csv_reader if row[0] != ""}
+    ensg_keys, ensg_symbols = _read_ensg_ids(datastore)
+    symbols = pd.Series(df['gene_id'].values).map(pd.Series(ensg_symbols, index=ensg_keys))
+    proteins = pd.Series(df['protein_id'].values)[symbols.notnull().values]
+    kept = ~proteins.duplicated(keep="last").values
+    return proteins.values[kept], symbols.dropna().values[kept]
+
+
+def map_gene_ids(ids, namespace, datastore="./data"):
+    """
+    Returns the HUGO symbol of each of ids, or None for the ids which are not in the gene id table.
+    :param namespace: one of "entrez", "ensg" and "ensp", see gene_id_table
+    """
+    table = gene_id_table(datastore, namespace)
+    keys = table[namespace + "_keys"]
+    index_name = "_" + namespace + "_index"
+    if index_name not in table:
+        # string ids are looked up as objects, a fixed-width cast would truncate the longer ids
+        table[index_name] = pd.Index(keys if keys.dtype.kind == "i" else keys.astype(object))
+    ids = np.asarray(ids)
+    if keys.dtype.kind == "i":
+        ids = ids.astype(keys.dtype)
+    positions = table[index_name].get_indexer(ids.astype(object) if ids.dtype.kind == "U" else ids)
+    symbols = np.asarray(table[namespace + "_symbols"], dtype=object)[positions]
+    symbols[positions < 0] = None
+    return symbols
+
+
+def _id_map(namespace, datastore):
+    table = gene_id_table(datastore, namespace)
+    return dict(zip(table[namespace + "_keys"].tolist(), table[namespace + "_symbols"].tolist()))
 
-    # ENSP to hugo map
-    ensmap = {}
-    for index, row in df.iterrows():
-        if row['gene_id'] in ensg_map.keys():
-            ensmap[row['protein_id']] = ensg_map[row['gene_id']]
 
-    return ensmap
+def symbol_map(gene_symbols):
+    """
+    This gene code map was generated on February 18th, 2019
+    at this URL: https://www.genenames.org/cgi-bin/download/custom?col=gd_app_sym&col=gd_prev_sym&status=Approved&status=Entry%20Withdrawn&hgnc_dbtag=on&order_by=gd_app_sym_sort&format=text&submit=submit
+    it enables us to map the gene names to the newest version of the gene labels
+    """
+    table = gene_id_table(os.path.dirname(__file__), "previous")
+    symbols = table["previous_symbols"]
+    # The previous symbols of genes which are already in gene_symbols are not mapped
+    kept = ~pd.Series(symbols).isin(list(gene_symbols)).values
+    return dict(zip(table["previous_keys"][kept].tolist(), symbols[kept].tolist()))
+
+
+def ncbi_to_hugo_map(gene_symbols, datastore="./data"):
+    return _id_map("entrez", datastore)
+
+
+def ensg_to_hugo_map(datastore="./data"):
+    return _id_map("ensg", datastore)
+
+
+def ensp_to_hugo_map(datastore="./data"):
+    """
+    You should download the file Homo_sapiens.GRCh38.95.gtf from :
+    ftp://ftp.ensembl.org/pub/release-95/gtf/homo_sapiens/Homo_sapiens.GRCh38.95.gtf.gz
+
+    Store the file in datastore
+    """
+    return _id_map("ensp", datastore)
 
 
 def randmap(nodelist, seed=0):
@@ -1,10 +1,15 @@
 from torch.utils.data import Dataset, DataLoader
 import sys
 import os
+import copy
 import numpy as np
 import pandas as pd
 import h5py
-from collections import Counter
+import json
+import hashlib
+import pickle
+import shutil
+import tempfile
 import csv
 
 
@@ -13,7 +18,13 @@ class TCGAMeta(Dataset):
 
     """
 
-    def __init__(self, data_dir=None, dataset_transform=None, transform=None, target_transform=None, download=False, preload=True, min_samples_per_class=3, task_variables_file=None, gene_symbol_map_file=None):
+    def __init__(self, data_dir=None, dataset_transform=None, transform=None, target_transform=None, download=False, preload=True, min_samples_per_class=3, task_variables_file=None, gene_symbol_map_file=None, genes=None, mmap=False):
+        """
+        With preload, the expression matrix is read once and shared by all the tasks, which only hold the indices of
+        their rows. With mmap, the matrix is memory-mapped from an uncompressed copy of TCGA_HiSeqV2.hdf5 (written
+        the first time) instead of being read in memory.
+        """
+        self.genes = genes
         self.dataset_transform = dataset_transform
         self.target_transform = target_transform
         self.transform = transform
@@ -22,6 +33,7 @@ class TCGAMeta(Dataset):
         # specify a default data directory
         if data_dir is None:
             data_dir = os.path.join(os.path.dirname(__file__), 'data')
+        self.data_dir = data_dir
 
         if download:
             with open(os.path.join(os.path.dirname(__file__), 'cancers')) as f:
@@ -36,13 +48,14 @@ class TCGAMeta(Dataset):
         if preload:
             try:
                 hdf_file = os.path.join(data_dir, "TCGA_HiSeqV2.hdf5")
-                f = h5py.File(hdf_file)
-                self.gene_expression_data = f['dataset'][:]
-                f.close()
-                gene_ids_file = os.path.join(data_dir, 'gene_ids')
-                all_sample_ids_file = os.path.join(data_dir, 'all_sample_ids')
-                self.gene_ids = _read_string_list(gene_ids_file)
-                self.all_sample_ids = _read_string_list(all_sample_ids_file)
+                if mmap:
+                    self.gene_expression_data = _memory_map(hdf_file)
+                else:
+                    with h5py.File(hdf_file, 'r') as f:
+                        self.gene_expression_data = f['dataset'][:]
+                    # the matrix is shared by all the tasks, like the memory-mapped one it is read-only
+                    self.gene_expression_data.flags.writeable = False
+                self.gene_ids, self.all_sample_ids = _read_id_lists(data_dir)
                 self.preloaded = (self.all_sample_ids, self.gene_ids, self.gene_expression_data)
             except:
                 print('TCGA_HiSeqV2.hdf5 could not be read from the data_dir.')
@@ -96,7 +109,7 @@ class TCGAMeta(Dataset):
             The target variable is a combination of a clinical attribute and one of 39 types of cancer.
             An example of a target variable is: 'gender-BRCA', where we predict gender for breast cancer(BRCA) patients.
         """
-        dataset = TCGATask(self.task_ids[index], transform=self.transform, target_transform=self.target_transform, download=False, preloaded=self.preloaded, gene_symbol_map_file=self.gene_symbol_map_file)
+        dataset = TCGATask(self.task_ids[index], data_dir=self.data_dir, transform=self.transform, target_transform=self.target_transform, download=False, preloaded=self.preloaded, gene_symbol_map_file=self.gene_symbol_map_file, genes=self.genes)
 
         if self.dataset_transform is not None:
             dataset = self.dataset_transform(dataset)
@@ -107,7 +120,10 @@ class TCGAMeta(Dataset):
 
 
 class TCGATask(Dataset):
-    def __init__(self, task_id, data_dir=None, transform=None, target_transform=None, download=False, preloaded=None, gene_symbol_map_file=None):
+    def __init__(self, task_id, data_dir=None, transform=None, target_transform=None, download=False, preloaded=None, gene_symbol_map_file=None, genes=None):
+        """
+        If genes is given, only these genes are kept, as float32 columns in the order of genes.
+        """
         self.id = task_id
         self.transform = transform
         self.target_transform = target_transform
@@ -128,45 +144,89 @@ class TCGATask(Dataset):
             if not(os.path.isfile(gene_ids_file) and os.path.isfile(all_sample_ids_file)):
                 raise ValueError('Preprocessed gene_ids and sample_ids list where not found in {}.'.format(data_dir))
 
-            self.gene_ids = _read_string_list(gene_ids_file)
-            self._all_sample_ids = _read_string_list(all_sample_ids_file)
+            self.gene_ids, self._all_sample_ids = _read_id_lists(data_dir)
         else:
             self._all_sample_ids, self.gene_ids, self._data = preloaded
-            
+
         if gene_symbol_map_file:
-            self.gene_ids = symbol_map(self.gene_ids, gene_symbol_map_file)
+            self.gene_ids = _mapped_gene_ids(data_dir, self.gene_ids, gene_symbol_map_file)
+
+        columns = None
+        if genes is not None:
+            gene_ids_key = (os.path.abspath(data_dir), 'gene_ids', gene_symbol_map_file)
+            columns = _gene_columns(self.gene_ids, genes, gene_ids_key)
+            self.gene_ids = list(genes)
 
         # load the cancer specific matrix
-        matrix = pd.read_csv(os.path.join(data_dir, 'clinicalMatrices', cancer + '_clinicalMatrix'), delimiter='\t')
+        matrix = get_clinical_matrix(data_dir, cancer + '_clinicalMatrix')
         # TODO: verify we don't need this
         #matrix.drop_duplicates(subset=['sampleID'], keep='first', inplace=True)
-        ids = matrix['sampleID']
-        attribute = matrix[task_variable]
+        codes = matrix.codes(task_variable)
 
         # filter all elements where the clinical variable is not available or the associated gene expression data
-        available_elements = attribute.notnull() & matrix['sampleID'].isin(self._all_sample_ids)
-        sample_ids = ids[available_elements].tolist()
-        filtered_attribute = attribute[available_elements].astype('category').cat
-        self._labels = filtered_attribute.codes.tolist()
-        self.categories = filtered_attribute.categories.tolist()
+        rows = _id_index(self._all_sample_ids, _sample_ids_key(data_dir)).reindex(matrix.sample_ids).values
+        available_elements = (codes >= 0) & ~np.isnan(rows)
+        # the categories of the task are the categories of the matrix which it uses, in the same order
+        used_codes = np.unique(codes[available_elements])
+        labels = np.searchsorted(used_codes, codes[available_elements])
+        categories = matrix.categories(task_variable)
+        self.categories = [categories[code] for code in used_codes]
         self.num_classes = len(self.categories)
 
-        # generator to retrieve the specific indices we need
-        indices_to_load = [self._all_sample_ids.index(sample_id) for sample_id in sample_ids]
-        indices_to_load, self._labels = zip(*sorted(zip(indices_to_load, self._labels)))
+        # the rows we need, sorted by row and then by label
+        indices_to_load = rows[available_elements].astype(int)
+        order = np.lexsort((labels, indices_to_load))
+        indices_to_load = indices_to_load[order]
+        self._labels = tuple(labels[order].tolist())
 
-        # lazy loading or loading from preloaded data if available
+        # With preloaded data, the task is a view on the shared matrix: its rows are only read when they are used
+        self._rows = indices_to_load
+        self._columns = columns
         if preloaded is None:
-            hdf_file = os.path.join(data_dir, "TCGA_HiSeqV2.hdf5")
-            with h5py.File(hdf_file, 'r') as f:
-                self._samples = f['dataset'][indices_to_load, :]
-        else:
-            self._samples = self._data[np.array(list(indices_to_load), dtype=int), :]
-            
-        self.input_size = self._samples.shape[1]
+            self._samples = _read_rows(data_dir, indices_to_load)
+            if columns is not None:
+                # h5py only supports one list of indices, so the columns are selected after the rows are read
+                self._samples = self._samples[:, columns].astype(np.float32)
+
+        self.input_size = self._data.shape[1] if self._columns is None else len(self._columns)
+
+    @property
+    def _samples(self):
+        """ The samples of the task as one array, which is read from the matrix of the task on each access """
+        return self.get_samples()
+
+    @_samples.setter
+    def _samples(self, samples):
+        # The task now owns its samples, e.g. after they were normalized
+        self._data = np.asarray(samples)
+        self._rows = np.arange(self._data.shape[0])
+        self._columns = None
+
+    def get_samples(self, indices=None):
+        """ Returns the samples indices of the task (all of them by default), e.g. a batch """
+        rows = self._rows if indices is None else self._rows[indices]
+        if self._columns is None:
+            # a single row would be a view on the matrix, which may be shared with other tasks
+            return np.array(self._data[rows]) if np.ndim(rows) == 0 else self._data[rows]
+        if np.ndim(rows) == 0:
+            return self._data[rows, self._columns].astype(np.float32)
+        return self._data[np.ix_(rows, self._columns)].astype(np.float32)
+
+    def get_batch(self, indices):
+        """ Returns the samples and the labels of the indices of the task, without the transforms """
+        return self.get_samples(indices), np.asarray(self._labels)[indices]
+
+    def __deepcopy__(self, memo):
+        # The matrix is shared between the tasks, and a task never modifies it, so copies of a task share it too
+        memo[id(self._data)] = self._data
+        result = self.__class__.__new__(self.__class__)
+        memo[id(self)] = result
+        for name, value in self.__dict__.items():
+            setattr(result, name, copy.deepcopy(value, memo))
+        return result
 
     def __getitem__(self, index):
-        sample = self._samples[index, :]
+        sample = self.get_samples(index)
         label = self._labels[index]
 
         if self.transform is not None:
@@ -178,7 +238,7 @@ class TCGATask(Dataset):
         return (sample, label)
 
     def __len__(self):
-        return self._samples.shape[0]
+        return len(self._rows)
 
 
 def get_TCGA_task_ids(data_dir=None, min_samples_per_class=3, task_variables_file=None):
@@ -186,41 +246,17 @@ def get_TCGA_task_ids(data_dir=None, min_samples_per_class=3, task_variables_fil
     if data_dir is None:
         data_dir = os.path.join(os.path.dirname(__file__), 'data')
 
-    try:
-        all_sample_ids_file = os.path.join(data_dir, 'all_sample_ids')
-        all_sample_ids = _read_string_list(all_sample_ids_file)
-    except:
+    if not os.path.isfile(os.path.join(data_dir, 'all_sample_ids')):
         print('TCGA_HiSeqV2.hdf5 could not be read from the data_dir.')
         sys.exit()
 
-    if task_variables_file is None:
-        task_variables_file = os.path.join(os.path.dirname(__file__), 'task_variables')
-
-    with open(task_variables_file) as f:
-        task_variables = f.readlines()
-    # remove whitespace
-    task_variables = [x.strip() for x in task_variables]
+    task_index = get_TCGA_task_index(data_dir, task_variables_file)
 
     task_ids = []
     for filename in os.listdir(os.path.join(data_dir, 'clinicalMatrices')):
-        matrix = pd.read_csv(os.path.join(data_dir, 'clinicalMatrices', filename), delimiter='\t')
-
-        for task_variable in task_variables:
-            try:
-                # if this task_variable exists for this cancer find the sample_ids for this task
-                filter_clinical_variable_present = matrix[task_variable].notnull()
-                # filter out all sample_ids for which no valid value exists
-                potential_sample_ids = matrix['sampleID'][filter_clinical_variable_present]
-                # filter out all sample_ids for which no gene expression data exists
-                task_sample_ids = set(potential_sample_ids).intersection(all_sample_ids)
-#                task_sample_ids = [sample_id for sample_id in potential_sample_ids if sample_id in all_sample_ids]
-            except KeyError:
-                continue
-
+        for task_variable, num_samples_per_label, _ in task_index[filename]:
             task_id = (task_variable, filename.split('_')[0])
 
-            num_samples_per_label = Counter(matrix[task_variable][matrix['sampleID'].isin(task_sample_ids)])
-
             # only add this task for the specified range of number of samples
             num_samples_per_class_is_in_range = all([num_samples > min_samples_per_class for num_samples in num_samples_per_label.values()])
             # Make sure this task is not a one-class classification in the first place
@@ -230,6 +266,243 @@ def get_TCGA_task_ids(data_dir=None, min_samples_per_class=3, task_variables_fil
     return task_ids
 
 
+# Bump this whenever the content of the task index changes, older indices will then be rebuilt
+TASK_INDEX_VERSION = 1
+
+
+def get_TCGA_task_index(data_dir=None, task_variables_file=None):
+    """
+    Returns the task index of data_dir: a dictionary from the file name of each clinical matrix to the list of the
+    (task_variable, num_samples_per_label, rows) of its task variables. rows are the rows in all_sample_ids of the
+    samples of the task which have a value, in the order of the clinical matrix.
+
+    The index is stored in data_dir/task_index.pkl. Only the clinical matrices which changed since the index was
+    written (by size or modification time) are parsed again, and all of them if all_sample_ids or the task
+    variables changed.
+    """
+    if data_dir is None:
+        data_dir = os.path.join(os.path.dirname(__file__), 'data')
+    if task_variables_file is None:
+        task_variables_file = os.path.join(os.path.dirname(__file__), 'task_variables')
+    task_variables = _read_string_list(task_variables_file)
+
+    matrices_dir = os.path.join(data_dir, 'clinicalMatrices')
+    index_file = os.path.join(data_dir, 'task_index.pkl')
+    all_sample_ids_file = os.path.join(data_dir, 'all_sample_ids')
+    signature = (TASK_INDEX_VERSION, _file_signature(all_sample_ids_file), task_variables)
+
+    index = {}
+    if os.path.isfile(index_file):
+        try:
+            with open(index_file, 'rb') as f:
+                stored_signature, index = pickle.load(f)
+            if stored_signature != signature:
+                index = {}
+        except Exception:
+            index = {}
+
+    filenames = os.listdir(matrices_dir)
+    file_signatures = {filename: _file_signature(os.path.join(matrices_dir, filename)) for filename in filenames}
+    stale = [filename for filename in filenames if index.get(filename, (None,))[0] != file_signatures[filename]]
+    if stale or len(index) != len(filenames):
+        sample_rows = _id_index(_read_id_list(all_sample_ids_file), _sample_ids_key(data_dir))
+        index = {filename: index[filename] for filename in filenames if filename not in stale}
+        for filename in stale:
+            entries = _index_clinical_matrix(get_clinical_matrix(data_dir, filename), task_variables, sample_rows)
+            index[filename] = (file_signatures[filename], entries)
+        try:
+            tmp_file = index_file + '.{}.tmp'.format(os.getpid())
+            with open(tmp_file, 'wb') as f:
+                pickle.dump((signature, index), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, index_file)
+        except OSError:
+            print('The task index could not be written to ' + index_file)
+    return {filename: entries for filename, (_, entries) in index.items()}
+
+
+def _index_clinical_matrix(matrix, task_variables, sample_rows):
+    sample_ids = pd.Index(matrix.sample_ids)
+    has_expression = sample_ids.isin(sample_rows.index)
+    entries = []
+    for task_variable in task_variables:
+        if task_variable not in matrix.columns:
+            continue
+        codes = matrix.codes(task_variable)
+        # filter out all sample_ids for which no valid value or no gene expression data exists
+        available_elements = (codes >= 0) & has_expression
+        task_sample_ids = sample_ids.isin(sample_ids[available_elements])
+        labels, counts = np.unique(codes[task_sample_ids], return_counts=True)
+        categories = matrix.categories(task_variable)
+        num_samples_per_label = {categories[label] if label >= 0 else np.nan: int(count)
+                                 for label, count in zip(labels, counts)}
+        rows = sample_rows[sample_ids[available_elements]].values.astype(np.int32)
+        entries.append((task_variable, num_samples_per_label, rows))
+    return entries
+
+
+# Bump this whenever the format of the clinical matrix cache changes, older caches will then be rebuilt
+CLINICAL_CACHE_VERSION = 1
+
+
+class ClinicalMatrix(object):
+    """
+    A clinical matrix parsed once and stored column by column in a cache directory: the sample ids, and each column
+    as int32 categorical codes (-1 for missing values) with its categories. The columns are memory-mapped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.columns = list(self.meta['columns'].keys())
+        self.sample_ids = np.load(os.path.join(path, 'sampleID.npy'), mmap_mode='r')
+
+    def codes(self, column):
+        """ Returns the codes of the column, raises a KeyError if the matrix has no such column """
+        return np.load(os.path.join(self.path, self.meta['columns'][column]['file']), mmap_mode='r')
+
+    def categories(self, column):
+        return self.meta['columns'][column]['categories']
+
+    @staticmethod
+    def write(source, path, signature):
+        """ Parses the clinical matrix source and writes it to the cache directory path """
+        matrix = pd.read_csv(source, delimiter='\t')
+        parent = os.path.dirname(path)
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        tmp_path = tempfile.mkdtemp(dir=parent, prefix='.tmp_' + os.path.basename(path))
+        np.save(os.path.join(tmp_path, 'sampleID.npy'), np.asarray(matrix['sampleID']).astype(str))
+        columns = {}
+        for i, column in enumerate(matrix.columns):
+            categorical = pd.Categorical(matrix[column])
+            columns[column] = {'file': 'c{}.npy'.format(i), 'categories': categorical.categories.tolist()}
+            np.save(os.path.join(tmp_path, columns[column]['file']), categorical.codes.astype(np.int32))
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump({'version': CLINICAL_CACHE_VERSION, 'signature': list(signature), 'columns': columns}, f)
+
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Another process wrote the same cache in the meantime
+            shutil.rmtree(tmp_path)
+
+
+# Clinical matrices already opened by this process, by path, with the signature of their source
+_CLINICAL_MATRICES = {}
+
+
+def get_clinical_matrix(data_dir, filename):
+    """
+    Returns the ClinicalMatrix of data_dir/clinicalMatrices/filename. The matrix is parsed the first time and
+    whenever it changes, and cached in data_dir/clinicalMatrices.cache.
+    """
+    source = os.path.join(data_dir, 'clinicalMatrices', filename)
+    path = os.path.join(data_dir, 'clinicalMatrices.cache', filename)
+    signature = _file_signature(source)
+    key = os.path.abspath(path)
+    entry = _CLINICAL_MATRICES.get(key)
+    if entry is None or entry[0] != signature:
+        try:
+            with open(os.path.join(path, 'meta.json')) as f:
+                meta = json.load(f)
+            is_valid = meta['version'] == CLINICAL_CACHE_VERSION and tuple(meta['signature']) == signature
+        except (IOError, ValueError, KeyError):
+            is_valid = False
+        if not is_valid:
+            try:
+                ClinicalMatrix.write(source, path, signature)
+            except OSError:
+                # data_dir is read-only, the cache goes to the temporary directory instead
+                path = os.path.join(tempfile.gettempdir(), 'clinicalMatrices.cache',
+                                    '{}_{}'.format(filename, hashlib.sha1(os.path.abspath(source).encode()).hexdigest()))
+                ClinicalMatrix.write(source, path, signature)
+        # the matrix of an older version of the source is replaced
+        entry = (signature, ClinicalMatrix(path))
+        _CLINICAL_MATRICES[key] = entry
+    return entry[1]
+
+
+# Indices and id lists shared by all the tasks, see _id_index, _read_id_list and _mapped_gene_ids. They hold one entry
+# per file, which is replaced when the file or the list changes.
+_ID_INDICES = {}
+_ID_LISTS = {}
+_MAPPED_GENE_IDS = {}
+
+
+def _id_index(ids, key):
+    """
+    Returns the Series from each id of the list ids to its first position in ids. It is built once per list and kept
+    under key, which names where the list comes from (see _sample_ids_key), so the tasks which share the id lists of
+    a TCGAMeta, or of a data directory, share their index.
+    """
+    entry = _ID_INDICES.get(key)
+    if entry is None or entry[0] is not ids:
+        index = pd.Index(ids)
+        first = ~index.duplicated()
+        entry = (ids, pd.Series(np.flatnonzero(first), index=index[first]))
+        _ID_INDICES[key] = entry
+    return entry[1]
+
+
+def _sample_ids_key(data_dir):
+    return os.path.abspath(data_dir), 'all_sample_ids'
+
+
+def _read_id_list(path):
+    """ Returns the list of ids of the file path, which is read once per version of the file """
+    key, signature = os.path.abspath(path), _file_signature(path)
+    entry = _ID_LISTS.get(key)
+    if entry is None or entry[0] != signature:
+        entry = (signature, _read_string_list(path))
+        _ID_LISTS[key] = entry
+    return entry[1]
+
+
+def _read_id_lists(data_dir):
+    """ Returns the gene_ids and all_sample_ids lists of data_dir, see _read_id_list """
+    return _read_id_list(os.path.join(data_dir, 'gene_ids')), _read_id_list(os.path.join(data_dir, 'all_sample_ids'))
+
+
+def _mapped_gene_ids(data_dir, gene_ids, gene_symbol_map_file):
+    """ Returns symbol_map(gene_ids, gene_symbol_map_file), computed once per list of gene ids of data_dir """
+    key = (os.path.abspath(data_dir), os.path.abspath(gene_symbol_map_file))
+    signature = _file_signature(gene_symbol_map_file)
+    entry = _MAPPED_GENE_IDS.get(key)
+    if entry is None or entry[0] is not gene_ids or entry[1] != signature:
+        entry = (gene_ids, signature, symbol_map(gene_ids, gene_symbol_map_file))
+        _MAPPED_GENE_IDS[key] = entry
+    return entry[2]
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _memory_map(hdf_file):
+    """
+    Returns the dataset of hdf_file memory-mapped from an uncompressed .npy copy, which is written the first time
+    and again whenever hdf_file is newer
+    """
+    npy_file = os.path.splitext(hdf_file)[0] + '.npy'
+    if not os.path.isfile(npy_file) or os.path.getmtime(npy_file) < os.path.getmtime(hdf_file):
+        print('Writing an uncompressed copy of {}. This only happens on first run.'.format(hdf_file))
+        tmp_file = npy_file + '.{}.tmp'.format(os.getpid())
+        with h5py.File(hdf_file, 'r') as f:
+            dataset = f['dataset']
+            array = np.lib.format.open_memmap(tmp_file, mode='w+', dtype=dataset.dtype, shape=dataset.shape)
+            step = max(1, 2 ** 26 // (dataset.shape[1] * dataset.dtype.itemsize))
+            for start in range(0, dataset.shape[0], step):
+                array[start:start + step] = dataset[start:start + step]
+            array.flush()
+            del array
+        os.replace(tmp_file, npy_file)
+    return np.load(npy_file, mmap_mode='r')
+
+
 def _download(data_dir, cancers):
     import academictorrents as at
     from six.moves import urllib
@@ -280,6 +553,7 @@ def _download(data_dir, cancers):
 
     print('Downloading or checking for TCGA_HiSeqV2 using Academic Torrents')
     csv_file = at.get("e4081b995625f9fc599ad860138acf7b6eb1cf6f", datastore=data_dir)
+    data = None
     if not os.path.isfile(hdf_file) and os.path.isfile(csv_file):
         print("Downloaded to: " + csv_file)
         print("Converting TCGA CSV dataset to HDF5. This only happens on first run.")
@@ -295,9 +569,97 @@ def _download(data_dir, cancers):
             for sample_id in all_sample_ids:
                 text_file.write('{}\n'.format(sample_id))
 
-        f = h5py.File(hdf_file)
-        f.create_dataset("dataset", data=df.values, compression="gzip")
-        f.close()
+        data = df.values
+        with h5py.File(hdf_file, 'w') as f:
+            f.create_dataset("dataset", data=data, compression="gzip")
+
+    if os.path.isfile(hdf_file) and not _is_newer(os.path.join(data_dir, COHORT_STORE), hdf_file):
+        print("Writing the TCGA expression data sorted by cohort. This only happens on first run.")
+        _write_cohort_store(data_dir, data)
+
+
+# Copy of TCGA_HiSeqV2.hdf5 whose rows are sorted by cohort, see _write_cohort_store
+COHORT_STORE = 'TCGA_HiSeqV2_cohorts.hdf5'
+
+
+def _write_cohort_store(data_dir, data=None):
+    """
+    Writes the expression matrix of data_dir with its rows partitioned by cohort, so that the samples of a cohort are
+    one contiguous range of rows. A sample in several cohorts (e.g. COAD and COADREAD) goes to the smallest one, and
+    the partitions are grouped by their largest cohort, so pan-cancer cohorts are contiguous too. The chunks hold
+    whole rows and are compressed with LZF, which is much faster to decompress than gzip.
+    :param data: the expression matrix, read from TCGA_HiSeqV2.hdf5 if not given
+    """
+    if data is None:
+        with h5py.File(os.path.join(data_dir, "TCGA_HiSeqV2.hdf5"), 'r') as f:
+            data = f['dataset'][:]
+    _, all_sample_ids = _read_id_lists(data_dir)
+    sample_rows = _id_index(all_sample_ids, _sample_ids_key(data_dir))
+
+    # the rank of the name of the largest and the smallest cohort of each sample, len(cohorts) if it has none
+    filenames = sorted(os.listdir(os.path.join(data_dir, 'clinicalMatrices')))
+    members = [sample_rows.reindex(get_clinical_matrix(data_dir, filename).sample_ids).dropna().values.astype(int)
+               for filename in filenames]
+    group = np.full(len(all_sample_ids), len(filenames))
+    partition = np.full(len(all_sample_ids), len(filenames))
+    by_size = sorted(range(len(filenames)), key=lambda i: len(members[i]))
+    for i in by_size:
+        group[members[i]] = i
+    for i in reversed(by_size):
+        partition[members[i]] = i
+    order = np.lexsort((np.arange(len(all_sample_ids)), partition, group))
+
+    store_file = os.path.join(data_dir, COHORT_STORE)
+    tmp_file = store_file + '.{}.tmp'.format(os.getpid())
+    with h5py.File(tmp_file, 'w') as f:
+        # about 1MB per chunk
+        chunk_rows = int(max(1, min(len(order), 2 ** 20 // (data.shape[1] * data.dtype.itemsize))))
+        f.create_dataset('dataset', data=data[order], chunks=(chunk_rows, data.shape[1]), compression='lzf',
+                         shuffle=True)
+        # the row in all_sample_ids of each row of the store, and the other way around
+        f.create_dataset('sample_rows', data=order.astype(np.int32))
+        f.create_dataset('store_rows', data=np.argsort(order).astype(np.int32))
+    os.replace(tmp_file, store_file)
+
+
+def _read_rows(data_dir, rows):
+    """
+    Returns the rows (of all_sample_ids) of the expression matrix of data_dir. They are read from the cohort store
+    if it is up to date, where the rows of a task usually are one contiguous range, and from TCGA_HiSeqV2.hdf5
+    otherwise.
+    """
+    hdf_file = os.path.join(data_dir, "TCGA_HiSeqV2.hdf5")
+    store_file = os.path.join(data_dir, COHORT_STORE)
+    if not (os.path.isfile(store_file) and (not os.path.isfile(hdf_file) or _is_newer(store_file, hdf_file))):
+        with h5py.File(hdf_file, 'r') as f:
+            return f['dataset'][np.asarray(rows).tolist(), :]
+
+    with h5py.File(store_file, 'r') as f:
+        positions, inverse = np.unique(f['store_rows'][:][rows], return_inverse=True)
+        if len(positions) == 0:
+            return np.empty((0, f['dataset'].shape[1]), dtype=f['dataset'].dtype)
+        first, last = positions[0], positions[-1]
+        if last - first < 4 * len(positions):
+            data = f['dataset'][first:last + 1][positions - first]
+        else:
+            data = f['dataset'][positions.tolist(), :]
+    return data[inverse]
+
+
+def _is_newer(path, other_path):
+    """ Returns True if path exists and was modified after other_path """
+    return os.path.isfile(path) and os.path.getmtime(path) >= os.path.getmtime(other_path)
+
+
+def _gene_columns(gene_ids, genes, key):
+    """
+    Returns the column of each gene of genes in gene_ids, using the first occurrence of duplicated gene ids
+    :param key: key of the index of gene_ids, see _id_index
+    """
+    columns = _id_index(gene_ids, key).reindex(list(genes))
+    if columns.isnull().any():
+        raise KeyError("Genes not in the dataset: " + ", ".join(columns.index[columns.isnull()][:10]))
+    return columns.values.astype(int)
 
 
 def _read_string_list(path):
@@ -316,11 +678,14 @@ def symbol_map(gene_symbols, gene_symbol_map_file):
         line_count = 0
         x = {row[0]: row[1] for row in csv_reader}
 
+        # a set makes the membership test below O(1) instead of a scan of gene_symbols
+        gene_symbol_set = set(gene_symbols)
         gene_symbol_map = {}
         for key, val in x.items():
-            for v in val.split(", "):
-                if key not in gene_symbols:
+            if key not in gene_symbol_set:
+                for v in val.split(", "):
                     gene_symbol_map[v] = key
-        
-        
-    return pd.Series(gene_symbols).replace(gene_symbol_map).values.tolist()
\ No newline at end of file
+
+    gene_symbols = pd.Series(gene_symbols)
+    mapped = gene_symbols.map(gene_symbol_map)
+    return mapped.where(mapped.notnull(), gene_symbols).values.tolist()
\ No newline at end of file
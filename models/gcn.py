@@ -32,7 +32,7 @@ class GCN(Model):
         if (self.adj is None):
             raise Exception("adj must be specified for GCN")
         self.adj = scipy.sparse.csr_matrix(self.adj)
-        self.adjs, self.centroids = setup_aggregates(self.adj, self.num_layer, self.X, aggregation=self.aggregation, agg_reduce=self.agg_reduce, verbose=self.verbose)
+        self.adjs, self.centroids = setup_aggregates(self.adj, self.num_layer, self.X, aggregation=self.aggregation, agg_reduce=self.agg_reduce, verbose=self.verbose, weighted=self.weighted_adj)
         self.nb_nodes = self.X.shape[1]
 
         if self.embedding:
@@ -27,8 +27,10 @@ class GCNLayer(nn.Module):
         self.id_layer = id_layer
         self.adj = adj
         self.centroids = centroids
-        edges = torch.LongTensor(np.array(self.adj.nonzero()))
-        sparse_adj = torch.sparse.FloatTensor(edges, torch.FloatTensor(self.adj.data), torch.Size([self.nb_nodes, self.nb_nodes]))
+        # go through coo so that each edge is paired with its own weight
+        coo_adj = sparse.coo_matrix(self.adj)
+        edges = torch.LongTensor(np.array([coo_adj.row, coo_adj.col]))
+        sparse_adj = torch.sparse.FloatTensor(edges, torch.FloatTensor(coo_adj.data.astype(np.float32)), torch.Size([self.nb_nodes, self.nb_nodes]))
         self.register_buffer('sparse_adj', sparse_adj)
 
         self.linear = nn.Conv1d(in_channels=self.in_dim, out_channels=int(self.channels/2), kernel_size=1, bias=True)
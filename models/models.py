@@ -24,7 +24,7 @@ class Model(nn.Module):
                  dropout=False, cuda=False, seed=0, adj=None, graph_name=None, aggregation=None, prepool_extralayers=0,
                  lr=0.0001, patience=10, agg_reduce=2, scheduler=False, metric=sklearn.metrics.accuracy_score,
                  optimizer=torch.optim.Adam, weight_decay=0.0001, batch_size=10, train_valid_split=0.8, 
-                 evaluate_train=True, verbose=True, full_data_cuda=True):
+                 evaluate_train=True, verbose=True, full_data_cuda=True, weighted_adj=False):
         self.name = name
         self.column_names = column_names
         self.num_layer = num_layer
@@ -53,32 +53,55 @@ class Model(nn.Module):
         self.verbose = verbose
         self.evaluate_train = evaluate_train
         self.full_data_cuda = full_data_cuda
+        self.weighted_adj = weighted_adj
         if self.verbose:
             print("Early stopping metric is " + self.metric.__name__)
         super(Model, self).__init__()
 
-    def fit(self, X, y, adj=None):
+    def fit(self, X, y=None, adj=None, valid=None):
+        """
+        Train the model, with early stopping on the validation metric
+
+        Args:
+        X, y: Training data, which is split into a train and a validation set with train_valid_split
+        adj: Adjacency matrix of the graph of the model
+        valid: In streaming mode, y is None and X is an iterable over (inputs, labels) mini-batches, iterated once
+            per epoch, with a shape and the classes of the labels (e.g. data.datasets.HDF5BatchStream). valid is then
+            the iterable over the validation mini-batches.
+        """
         self.adj = adj
         self.X = X
         self.y = y
+        streaming = y is None
+        if streaming:
+            self.y = X.classes
         self.setup_layers()
-        x_train, x_valid, y_train, y_valid = sklearn.model_selection.train_test_split(X, y, stratify=y, train_size=self.train_valid_split, test_size=1-self.train_valid_split, random_state=self.seed)
-        
-        y_true = y_train # Save copy on CPU for evaluation
-
-        x_train = torch.FloatTensor(np.expand_dims(x_train, axis=2))
-        x_valid = torch.FloatTensor(np.expand_dims(x_valid, axis=2))
-        y_train = torch.FloatTensor(y_train)
-        if self.on_cuda and self.full_data_cuda:
-            try:
-                x_train = x_train.cuda()
-                x_valid = x_valid.cuda()
-                y_train = y_train.cuda()
-            except:
-                # Move data to GPU batch by batch
-                self.full_data_cuda = False
-                
-        
+
+        if streaming:
+            nb_train = len(X)
+            train_batches = lambda: self._stream_batches(X)
+            valid_batches = lambda: self._stream_batches(valid)
+        else:
+            x_train, x_valid, y_train, y_valid = sklearn.model_selection.train_test_split(X, y, stratify=y, train_size=self.train_valid_split, test_size=1-self.train_valid_split, random_state=self.seed)
+
+            x_train = torch.FloatTensor(np.expand_dims(x_train, axis=2))
+            x_valid = torch.FloatTensor(np.expand_dims(x_valid, axis=2))
+            y_train = torch.FloatTensor(np.asarray(y_train))
+            y_valid = np.asarray(y_valid)
+            if self.on_cuda and self.full_data_cuda:
+                try:
+                    x_train = x_train.cuda()
+                    x_valid = x_valid.cuda()
+                    y_train = y_train.cuda()
+                except:
+                    # Move data to GPU batch by batch
+                    self.full_data_cuda = False
+            nb_train = x_train.shape[0]
+            train_batches = lambda: self._tensor_batches(x_train, y_train)
+            valid_batches = lambda: self._tensor_batches(x_valid, y_valid)
+        # Whether the batches have to be moved to the GPU one by one
+        cuda_batches = self.on_cuda and (streaming or not self.full_data_cuda)
+
         criterion = torch.nn.CrossEntropyLoss(reduction='mean')
         optimizer = self.optimizer(self.parameters(), lr=self.lr, weight_decay=self.weight_decay)
         if self.scheduler:
@@ -91,11 +114,10 @@ class Model(nn.Module):
         epoch = 0 # when num_epoch is set to 0 for testing
         for epoch in range(0, self.num_epochs):
             start = time.time()
-            for i in range(0, x_train.shape[0], self.batch_size):
-                inputs, labels = x_train[i:i + self.batch_size], y_train[i:i + self.batch_size]
-
+            i = 0
+            for inputs, labels in train_batches():
                 inputs = Variable(inputs, requires_grad=False).float()
-                if self.on_cuda and not self.full_data_cuda:
+                if cuda_batches:
                     inputs = inputs.cuda()
                     labels = labels.cuda()
 
@@ -105,7 +127,8 @@ class Model(nn.Module):
                 targets = Variable(labels, requires_grad=False).long()
                 loss = criterion(y_pred, targets)
                 if self.verbose:
-                    print("  batch ({}/{})".format(i, x_train.shape[0]) + ", train loss:" + "{0:.4f}".format(loss))
+                    print("  batch ({}/{})".format(i, nb_train) + ", train loss:" + "{0:.4f}".format(loss))
+                i += inputs.shape[0]
 
                 optimizer.zero_grad()
                 loss.backward()
@@ -115,23 +138,8 @@ class Model(nn.Module):
 
             auc = {'train': 0., 'valid': 0.}
             if self.evaluate_train:
-                res = []
-                for i in range(0, x_train.shape[0], self.batch_size):
-                    inputs = Variable(x_train[i:i + self.batch_size]).float()
-                    if self.on_cuda and not self.full_data_cuda:
-                        inputs = inputs.cuda()
-                    res.append(self(inputs).data.cpu().numpy())
-                y_hat = np.concatenate(res)
-                auc['train'] = self.metric(y_true, np.argmax(y_hat, axis=1))
-
-            res = []
-            for i in range(0, x_valid.shape[0], self.batch_size):
-                inputs = Variable(x_valid[i:i + self.batch_size]).float()
-                if self.on_cuda and not self.full_data_cuda:
-                    inputs = inputs.cuda()
-                res.append(self(inputs).data.cpu().numpy())
-            y_hat = np.concatenate(res)
-            auc['valid'] = self.metric(y_valid, np.argmax(y_hat, axis=1))
+                auc['train'] = self._evaluate(train_batches(), cuda_batches)
+            auc['valid'] = self._evaluate(valid_batches(), cuda_batches)
             patience = patience - 1
             if patience == 0:
                 break
@@ -148,6 +156,27 @@ class Model(nn.Module):
         self.load_state_dict(self.best_model)
         self.best_model = None
 
+    def _tensor_batches(self, x, y):
+        for i in range(0, x.shape[0], self.batch_size):
+            yield x[i:i + self.batch_size], y[i:i + self.batch_size]
+
+    def _stream_batches(self, batches):
+        for inputs, labels in batches:
+            yield torch.FloatTensor(np.expand_dims(inputs, axis=2)), torch.FloatTensor(labels)
+
+    def _evaluate(self, batches, cuda_batches):
+        """ Returns the metric of the predictions of the model on the batches """
+        res = []
+        y_true = []
+        for inputs, labels in batches:
+            inputs = Variable(inputs).float()
+            if cuda_batches:
+                inputs = inputs.cuda()
+            res.append(self(inputs).data.cpu().numpy())
+            y_true.append(labels.cpu().numpy() if torch.is_tensor(labels) else labels)
+        y_hat = np.concatenate(res)
+        return self.metric(np.concatenate(y_true), np.argmax(y_hat, axis=1))
+
     def predict(self, inputs, probs=True):
         """
         Run the trained model on the inputs
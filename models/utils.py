@@ -32,8 +32,11 @@ def max_pool(x, centroids, adj):
     return res
 
 # We use this to calculate the noramlized laplacian for our graph convolution signal propagation
-def norm_laplacian(adj):
-    D = np.array(adj.astype(bool).sum(axis=0))[0].astype("float32")
+def norm_laplacian(adj, weighted=False):
+    if weighted:
+        D = np.array(adj.sum(axis=0))[0].astype("float32")
+    else:
+        D = np.array(adj.astype(bool).sum(axis=0))[0].astype("float32")
     D_inv = np.divide(1., np.sqrt(D), out=np.zeros_like(D), where=D!=0.)
     D_inv_diag = sparse.diags(D_inv)
     adj = D_inv_diag.dot(adj).dot(D_inv_diag)
@@ -87,11 +90,17 @@ def kmeans_clustering(adj, n_clusters):
 
 
 # This function takes in the full adjacency matrix and a number of layers, then returns a bunch of clustered adjacencies
-def setup_aggregates(adj, nb_layer, x, aggregation="hierarchy", agg_reduce=2, verbose=True):
+def setup_aggregates(adj, nb_layer, x, aggregation="hierarchy", agg_reduce=2, verbose=True, weighted=False):
     adj.resize((x.shape[1], x.shape[1]))
+    if weighted:
+        # The first layer keeps the edge weights, the clustering only depends on which edges exist
+        weighted_adj = adj.astype("float32").tolil()
+        weighted_adj.setdiag(np.ones(adj.shape[0]))
+        adjs = [norm_laplacian(weighted_adj.tocsr(), weighted=True)]
     adj = (adj > 0.).astype(int)
     adj.setdiag(np.ones(adj.shape[0]))
-    adjs = [norm_laplacian(adj)]
+    if not weighted:
+        adjs = [norm_laplacian(adj)]
     centroids = []
     for _ in range(nb_layer):
         n_clusters = int(adj.shape[0] / agg_reduce) if int(adj.shape[0] / agg_reduce) > 0 else adj.shape[0]
@@ -58,7 +58,7 @@ def main(argv=None):
         task._samples = task._samples - task._samples.mean(axis=0)
         task._samples = task._samples / task._samples.var()
         X_train, X_test, y_train, y_test = sklearn.model_selection.train_test_split(task._samples, task._labels, stratify=task._labels, train_size=train_size, test_size=len(task._labels) - train_size)
-        adj = sparse.csr_matrix(nx.to_numpy_matrix(GeneManiaGraph().nx_graph))
+        adj = GeneManiaGraph().adj(nodelist=task.gene_ids)
         model.fit(X_train, y_train, adj=adj)
 
         y_hat = []
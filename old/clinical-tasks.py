@@ -100,7 +100,7 @@ for row in todo:
     X_train = X_train.copy()
     X_test = X_test.copy()
     gene_graph = graphs[graph_name]
-    adj = sparse.csr_matrix(nx.to_numpy_matrix(gene_graph.nx_graph))
+    adj = gene_graph.adj(nodelist=task.gene_ids)
     model.fit(X_train, y_train, adj=adj)
 
     y_hat = []
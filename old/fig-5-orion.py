@@ -44,15 +44,14 @@ def main(argv=None):
         dataset.labels = dataset.labels.values if type(dataset.labels) == pd.Series else dataset.labels
         X_train, X_test, y_train, y_test = sklearn.model_selection.train_test_split(dataset.df, dataset.labels, stratify=dataset.labels, train_size=opt.train_size, test_size=opt.test_size, random_state=opt.seed)
         if num_genes == 16300:
-            neighbors = gene_graph.nx_graph
+            neighbors, adj = gene_graph.node_names, gene_graph.adj()
         else:
-            neighbors = gene_graph.bfs_sample_neighbors(gene, num_genes)
+            neighbors, adj = gene_graph.bfs_neighborhood(gene, num_genes)
 
-        X_train = X_train[list(neighbors.nodes)].copy()
-        X_test = X_test[list(neighbors.nodes)].copy()
+        X_train = X_train[list(neighbors)].copy()
+        X_test = X_test[list(neighbors)].copy()
         X_train[gene] = 1
         X_test[gene] = 1
-        adj = sparse.csr_matrix(nx.to_numpy_matrix(neighbors))
         model.fit(X_train, y_train, adj=adj)
 
         y_hat = model.predict(X_test)
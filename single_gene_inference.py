@@ -11,8 +11,7 @@ import torch
 
 from models.mlp import MLP
 from data.datasets import TCGADataset, GTexDataset, GEODataset
-from data.gene_graphs import GeneManiaGraph, RegNetGraph,HumanNetV1Graph, HumanNetV2Graph, \
-    FunCoupGraph, HetIOGraph, StringDBGraph
+from data.gene_graphs import graph_dict
 from data.utils import record_result
 from tqdm import tqdm
 
@@ -50,10 +49,6 @@ train_size = 2000
 test_size = 1000
 cuda = torch.cuda.is_available()
 
-graph_dict = {"regnet": RegNetGraph, "genemania": GeneManiaGraph, "humannetv1": HumanNetV1Graph,
-              "humannetv2": HumanNetV2Graph, "funcoup": FunCoupGraph,
-              "hetio": HetIOGraph, "stringdb": StringDBGraph, "landmark": None}
-
 # Select graph and set variables
 if args.graph:
     # Check graph arg is valid
@@ -99,13 +94,18 @@ except Exception:
 # that are there in the graph 
 which_genes = dataset.df.columns.tolist()
 if args.graph and args.graph != 'landmark':
-    which_genes = set(gene_graph.nx_graph.nodes).intersection(which_genes)
+    which_genes = set(gene_graph.node_names.tolist()).intersection(which_genes)
 if args.graph and args.graph == 'landmark':
     landmark_genes = [x for x in which_genes if x in landmark_genes]
     print("Number of covered landmark genes", len(landmark_genes))
 
 print("Number of covered genes", len(which_genes))
 
+# Look up the columns of the first degree neighborhood of every gene at once
+if is_first_degree and not is_landmark:
+    which_genes = list(which_genes)
+    neighbor_columns = dict(zip(which_genes, gene_graph.first_degree_index(which_genes, dataset.df.columns)))
+
 # Create the set of all experiment ids and see which are left to do
 columns = ["gene"]
 all_exp_ids = [x for x in itertools.product(which_genes)]
@@ -154,11 +154,12 @@ for row in tqdm(todo, desc=name):
     if is_first_degree:
         if is_landmark:
             neighbors = landmark_genes
+            X_train = X_train.loc[:, neighbors].copy()
+            X_test = X_test.loc[:, neighbors].copy()
         else:
-            neighbors = list(gene_graph.first_degree(gene)[0])
-            neighbors = [n for n in neighbors if n in X_train.columns.values]
-        X_train = X_train.loc[:, neighbors].copy()
-        X_test = X_test.loc[:, neighbors].copy()
+            neighbors = neighbor_columns[gene]
+            X_train = X_train.iloc[:, neighbors].copy()
+            X_test = X_test.iloc[:, neighbors].copy()
     else:
         X_train = X_train.copy()
         X_test = X_test.copy()
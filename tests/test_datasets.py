@@ -0,0 +1,158 @@
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import h5py
+import pandas as pd
+from data import datasets
+
+
+class ExpressionStoreTestSuite(unittest.TestCase):
+    """Test cases on the expression stores of data/datasets.py."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.df = pd.DataFrame([[1., 10., 0.], [3., 20., 0.], [5., 30., 3.]],
+                               index=["S1", "S2", "S3"], columns=["A", "B", "C"])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_roundtrip(self):
+        path = self.tmp_dir + "/expression.f32"
+        datasets.write_expression_store(path, self.df)
+        df, mean = datasets.read_expression_store(path)
+        self.assertEqual(df.index.tolist(), ["S1", "S2", "S3"])
+        self.assertEqual(df.columns.tolist(), ["A", "B", "C"])
+        self.assertEqual(mean.tolist(), [3., 20., 1.])
+        self.assertEqual(df.values.dtype, np.float32)
+        self.assertTrue((df.values + mean == self.df.values).all())
+
+    def test_gene_major_mmap(self):
+        path = self.tmp_dir + "/expression.f32"
+        datasets.write_expression_store(path, self.df)
+        df, _ = datasets.read_expression_store(path)
+        # the DataFrame is a view on the memory-mapped genes x samples array
+        self.assertFalse(df.values.flags.writeable)
+        self.assertTrue(df.values.T.flags.c_contiguous)
+        self.assertFalse(df.values.flags.owndata)
+
+    def test_projected_read(self):
+        path = self.tmp_dir + "/expression.f32"
+        datasets.write_expression_store(path, self.df)
+        df, mean = datasets.read_expression_store(path, genes=["C", "A"])
+        self.assertEqual(df.columns.tolist(), ["C", "A"])
+        self.assertEqual(mean.tolist(), [1., 3.])
+        self.assertEqual(df.values.dtype, np.float32)
+        self.assertTrue((df.values + mean == self.df[["C", "A"]].values).all())
+        with self.assertRaises(KeyError):
+            datasets.read_expression_store(path, genes=["A", "D"])
+
+    def test_store_stats(self):
+        path = self.tmp_dir + "/expression.f32"
+        datasets.write_expression_store(path, self.df)
+        stats = datasets.expression_store_stats(path, genes=["B", "C"])
+        self.assertEqual(stats.count, 3)
+        self.assertEqual(stats.min.tolist(), [10., 0.])
+        self.assertEqual(stats.max.tolist(), [30., 3.])
+        self.assertTrue(np.allclose(stats.variance, self.df[["B", "C"]].values.var(axis=0)))
+        # min max scaling of the centered data of the store
+        df, _ = datasets.read_expression_store(path, genes=["B", "C"])
+        scaled = stats.centered().apply(df.values, method="min_max")
+        self.assertTrue(np.allclose(scaled, [[-10., -10.], [0., -10.], [10., 10.]]))
+
+    def test_gene_positions(self):
+        self.assertEqual(datasets.gene_positions(["A", "B", "A", "C"], ["C", "A", "B"]).tolist(), [3, 0, 1])
+
+
+class HDF5RowReaderTestSuite(unittest.TestCase):
+    """Test cases on data.datasets.HDF5RowReader."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data = np.random.RandomState(0).rand(1000, 7).astype(np.float32)
+        self.hdf5 = h5py.File(self.tmp_dir + "/data.hdf5", "w")
+        self.hdf5.create_dataset("contiguous", data=self.data)
+        self.hdf5.create_dataset("chunked", data=self.data, chunks=(64, 7), compression="gzip")
+
+    def tearDown(self):
+        self.hdf5.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_read(self):
+        rows = np.sort(np.random.RandomState(1).choice(1000, 300, replace=False))
+        for name in ["contiguous", "chunked"]:
+            for workers in [1, 3]:
+                reader = datasets.HDF5RowReader(self.hdf5[name], block_rows=None if name == "chunked" else 50,
+                                                workers=workers)
+                self.assertTrue((reader.read(rows) == self.data[rows]).all())
+                self.assertTrue((reader.read(rows, columns=[4, 1]) == self.data[rows][:, [4, 1]]).all())
+        self.assertTrue(isinstance(datasets.HDF5RowReader(self.hdf5["contiguous"]).source, np.memmap))
+        self.assertEqual(datasets.HDF5RowReader(self.hdf5["chunked"]).block_rows, 64)
+
+    def test_sample_seed(self):
+        reader = datasets.HDF5RowReader(self.hdf5["chunked"])
+        rows, data = reader.sample(40, seed=3)
+        self.assertTrue((data == self.data[rows]).all())
+        # same subset as the former np.random.seed / np.random.choice sampling
+        np.random.seed(3)
+        self.assertEqual(rows.tolist(), np.sort(np.random.choice(1000, size=40, replace=False)).tolist())
+        self.assertNotEqual(reader.sample(40, seed=4)[0].tolist(), rows.tolist())
+
+    def test_batch_stream(self):
+        rows = np.arange(0, 1000, 3)
+        labels = np.arange(1000) % 2
+        stream = datasets.HDF5BatchStream(self.hdf5["chunked"], labels, rows=rows, columns=[2, 5], batch_size=16,
+                                          chunk_rows=128, prefetch=1)
+        self.assertEqual(stream.shape, (len(rows), 2))
+        self.assertEqual(stream.classes.tolist(), [0, 1])
+        first_epoch = [(inputs.copy(), batch_labels) for inputs, batch_labels in stream]
+        self.assertTrue(all(len(batch_labels) <= 16 for _, batch_labels in first_epoch))
+        inputs = np.concatenate([inputs for inputs, _ in first_epoch])
+        batch_labels = np.concatenate([batch_labels for _, batch_labels in first_epoch])
+        # every row once per epoch, with its own label
+        order = np.lexsort(inputs.T[::-1])
+        expected = self.data[rows][:, [2, 5]]
+        expected_order = np.lexsort(expected.T[::-1])
+        self.assertTrue((inputs[order] == expected[expected_order]).all())
+        self.assertTrue((batch_labels[order] == labels[rows][expected_order]).all())
+        # the next epoch is shuffled differently
+        second_inputs = np.concatenate([inputs for inputs, _ in stream])
+        self.assertFalse((second_inputs == inputs).all())
+
+    def test_batch_stream_label_function(self):
+        with self.assertRaises(ValueError):
+            datasets.HDF5BatchStream(self.hdf5["chunked"], lambda data: data[:, 0] > .5)
+        stream = datasets.HDF5BatchStream(self.hdf5["contiguous"], lambda data: data[:, 0] > .5, classes=[0, 1],
+                                          columns=[0], shuffle=False, batch_size=100)
+        inputs, labels = next(iter(stream))
+        self.assertTrue((inputs[:, 0] == self.data[:100, 0]).all())
+        self.assertTrue((labels == (self.data[:100, 0] > .5)).all())
+
+
+class GEODatasetTestSuite(unittest.TestCase):
+    """Test cases on data.datasets.GEODataset, on a small HDF5 file."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data = np.random.RandomState(0).rand(20, 3).astype(np.float32)
+        with h5py.File(self.tmp_dir + "/geo.hdf5", "w") as f:
+            f.create_dataset("expression_data", data=self.data)
+            f.create_dataset("gene_names", data=np.array([b"TP53", b"MDM2", b"EGFR"]))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_repeated_genes(self):
+        genes = ["EGFR", "TP53", "EGFR"]
+        full = datasets.GEODataset(self.tmp_dir + "/geo.hdf5", load_full=True, normalize=False, genes=genes)
+        self.assertEqual(full.df.columns.tolist(), genes)
+        self.assertTrue((full.df.values == self.data[:, [2, 0, 2]]).all())
+        sampled = datasets.GEODataset(self.tmp_dir + "/geo.hdf5", nb_examples=5, normalize=False, genes=genes)
+        self.assertTrue((sampled.df.values == self.data[sampled.indices][:, [2, 0, 2]]).all())
+        full.hdf5.close()
+        sampled.hdf5.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
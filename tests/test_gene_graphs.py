@@ -0,0 +1,364 @@
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+import networkx as nx
+from data.gene_graphs import GeneInteractionGraph, LandmarkGraph, StringDBGraph, HetIOGraph, HumanNetV1Graph, \
+    EcoliEcocycGraph, FunCoupGraph
+from data import array_store
+
+
+class ToyGraph(GeneInteractionGraph):
+    """ TP53 - MDM2 - EGFR - KRAS, plus BRCA1 - TP53 and an isolated MYC """
+
+    def load_data(self):
+        graph = nx.Graph()
+        graph.add_nodes_from(["TP53", "MDM2", "EGFR", "KRAS", "BRCA1", "MYC"])
+        graph.add_edges_from([("TP53", "MDM2"), ("MDM2", "EGFR"), ("EGFR", "KRAS"), ("BRCA1", "TP53")])
+        self.nx_graph = graph
+
+
+class ToyEdgelistGraph(GeneInteractionGraph):
+    """ Same graph as ToyGraph, where KRAS is given under its previous symbol KRAS2 """
+
+    def load_data(self):
+        self.set_edgelist(["TP53", "MDM2", "EGFR", "BRCA1"], ["MDM2", "EGFR", "KRAS2", "TP53"], nodes=["MYC"])
+
+
+class GeneInteractionGraphTestSuite(unittest.TestCase):
+    """Test cases on the data/gene_graphs.py file."""
+
+    def setUp(self):
+        self.graph = ToyGraph()
+
+    def test_adj(self):
+        adj = self.graph.adj()
+        self.assertEqual(adj.shape, (6, 6))
+        self.assertEqual(adj.nnz, 8)
+        self.assertEqual(adj.dtype, np.float32)
+
+    def test_adj_nodelist(self):
+        adj = self.graph.adj(nodelist=["KRAS", "UNKNOWN", "EGFR", "TP53"], dtype=np.float64)
+        expected_result = np.array([[0, 0, 1, 0], [0, 0, 0, 0], [1, 0, 0, 0], [0, 0, 0, 0]])
+        self.assertEqual(adj.dtype, np.float64)
+        self.assertTrue((adj.toarray() == expected_result).all())
+
+    def test_weights(self):
+        graph = ToyEdgelistGraph()
+        graph.set_edgelist(["TP53", "MDM2", "EGFR"], ["MDM2", "EGFR", "KRAS"], weights=[.9, .3, .6])
+        self.assertEqual(graph.adj(nodelist=["EGFR", "KRAS"])[0, 1], np.float32(.6))
+        self.assertEqual(graph.adj(weighted=False).sum(), 6)
+        thresholded = graph.threshold(.5)
+        self.assertEqual(thresholded.node_names.tolist(), graph.node_names.tolist())
+        self.assertEqual(thresholded.first_degree("EGFR", neighborhood=False)[0], {"EGFR", "KRAS"})
+        self.assertEqual(graph.adj().nnz, 6)
+        self.assertEqual(graph.top_k(1).adj().nnz, 4)
+
+    def test_set_edgelist_relabel(self):
+        graph = ToyEdgelistGraph()
+        self.assertEqual(graph.node_names.tolist(), ["MYC", "TP53", "MDM2", "EGFR", "KRAS", "BRCA1"])
+        self.assertEqual(graph.adj().nnz, 8)
+
+    def test_relabel_cache(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            ToyEdgelistGraph.graph_name = "toy"
+            graph = ToyEdgelistGraph(relabel_genes=False, datastore=tmp_dir)
+            self.assertIn("KRAS2", graph.node_names.tolist())
+            # the relabeled graph does not reuse the cache of the original one
+            graph = ToyEdgelistGraph(datastore=tmp_dir)
+            self.assertIn("KRAS", graph.node_names.tolist())
+            self.assertNotIn("KRAS2", graph.node_names.tolist())
+            self.assertTrue(os.path.isdir(tmp_dir + "/graphs/toy.csr"))
+            self.assertTrue(os.path.isdir(tmp_dir + "/graphs/toy_raw.csr"))
+        finally:
+            del ToyEdgelistGraph.graph_name
+            shutil.rmtree(tmp_dir)
+
+    def test_first_degree(self):
+        neighbors, neighborhood = self.graph.first_degree("MDM2")
+        self.assertEqual(neighbors, {"TP53", "MDM2", "EGFR"})
+        expected_result = np.array([[0, 1, 0], [1, 0, 1], [0, 1, 0]])
+        self.assertTrue((neighborhood == expected_result).all())
+
+    def test_first_degree_missing_gene(self):
+        neighbors, neighborhood = self.graph.first_degree("UNKNOWN")
+        self.assertEqual(neighbors, {"UNKNOWN"})
+        self.assertEqual(neighborhood.shape, (0, 0))
+
+    def test_first_degree_no_neighborhood(self):
+        neighbors, neighborhood = self.graph.first_degree("KRAS", neighborhood=False)
+        self.assertEqual(neighbors, {"KRAS", "EGFR"})
+        self.assertIsNone(neighborhood)
+
+    def test_first_degree_index(self):
+        columns = ["EGFR", "MYC", "TP53", "MDM2", "UNKNOWN"]
+        index = self.graph.first_degree_index(["MDM2", "KRAS", "UNKNOWN", "BRCA1"], columns)
+        self.assertEqual([columns.tolist() for columns in index], [[0, 2, 3], [0], [4], [2]])
+
+    def test_bfs_sample_neighbors(self):
+        neighbors = self.graph.bfs_sample_neighbors("TP53", 4)
+        self.assertEqual(list(neighbors.nodes), ["TP53", "MDM2", "BRCA1", "EGFR"])
+        self.assertEqual(neighbors.number_of_edges(), 3)
+        neighbors = self.graph.bfs_sample_neighbors("TP53", 2, include_self=False)
+        self.assertEqual(list(neighbors.nodes), ["MDM2", "BRCA1"])
+
+    def test_bfs_neighborhood_prefixes(self):
+        node_names, adj = self.graph.bfs_neighborhood("KRAS", 3)
+        self.assertEqual(node_names.tolist(), ["KRAS", "EGFR", "MDM2"])
+        self.assertTrue((adj.toarray() == np.array([[0, 1, 0], [1, 0, 1], [0, 1, 0]])).all())
+        # the order is computed once, larger neighborhoods extend smaller ones
+        node_names, adj = self.graph.bfs_neighborhood("KRAS", 10)
+        self.assertEqual(node_names.tolist(), ["KRAS", "EGFR", "MDM2", "TP53", "BRCA1"])
+        self.assertEqual(list(self.graph._bfs_orders.keys()), ["KRAS"])
+
+    def test_bfs_order_cache_size(self):
+        self.graph.bfs_cache_size = 2
+        for gene in ["KRAS", "TP53", "KRAS", "MDM2"]:
+            self.graph.bfs_order(gene)
+        # the least recently used order is dropped first
+        self.assertEqual(list(self.graph._bfs_orders.keys()), ["KRAS", "MDM2"])
+        self.graph.clear_bfs_orders()
+        self.assertEqual(len(self.graph._bfs_orders), 0)
+
+    def test_randomize(self):
+        graph = ToyGraph(randomize=True)
+        self.assertEqual(sorted(graph.node_names.tolist()), sorted(self.graph.node_names.tolist()))
+        self.assertTrue((graph.csr.toarray() == self.graph.csr.toarray()).all())
+
+    def test_random_graphs(self):
+        graphs = list(self.graph.random_graphs(range(3)))
+        self.assertEqual(len(graphs), 3)
+        for graph in graphs:
+            self.assertEqual(sorted(graph.node_names.tolist()), sorted(self.graph.node_names.tolist()))
+            self.assertIs(graph.csr, self.graph.csr)
+        self.assertNotEqual(graphs[0].node_names.tolist(), graphs[1].node_names.tolist())
+
+        graph = next(self.graph.random_graphs([0], mode="edge_swap"))
+        self.assertEqual(graph.node_names.tolist(), self.graph.node_names.tolist())
+        self.assertEqual(graph.degree().tolist(), self.graph.degree().tolist())
+
+    def test_nx_graph(self):
+        nx_graph = self.graph.nx_graph
+        self.assertEqual(nx_graph.number_of_nodes(), 6)
+        self.assertTrue(nx_graph.has_edge("KRAS", "EGFR"))
+
+
+class LandmarkGraphTestSuite(unittest.TestCase):
+    """Test cases on the implicit LandmarkGraph, compared to its explicit adjacency matrix."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        os.makedirs(self.tmp_dir + "/datastore")
+        np.save(self.tmp_dir + "/datastore/landmarkgenes.npy", np.array(["TP53", "EGFR"]))
+        self.graph = LandmarkGraph(["MDM2", "EGFR", "KRAS"], relabel_genes=False, datastore=self.tmp_dir)
+        # TP53, EGFR, MDM2, KRAS where everything is connected to the landmarks TP53 and EGFR
+        self.dense = np.array([[1, 1, 1, 1], [1, 1, 1, 1], [1, 1, 0, 0], [1, 1, 0, 0]])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_adj(self):
+        self.assertEqual(self.graph.node_names.tolist(), ["TP53", "EGFR", "MDM2", "KRAS"])
+        self.assertIsNone(self.graph.csr)
+        self.assertTrue((self.graph.adj().toarray() == self.dense).all())
+        adj = self.graph.adj(nodelist=["KRAS", "UNKNOWN", "EGFR"])
+        self.assertTrue((adj.toarray() == np.array([[0, 0, 1], [0, 0, 0], [1, 0, 1]])).all())
+
+    def test_degree_matmul(self):
+        nodelist = ["KRAS", "UNKNOWN", "EGFR", "TP53"]
+        adj = self.graph.adj(nodelist=nodelist).toarray()
+        self.assertEqual(self.graph.degree(nodelist).tolist(), adj.sum(axis=1).tolist())
+        x = np.arange(8.).reshape(4, 2)
+        self.assertTrue(np.allclose(self.graph.adj_matmul(x, nodelist), adj.dot(x)))
+        d_inv = np.array([1 / np.sqrt(d) if d > 0 else 0. for d in adj.sum(axis=1)])
+        expected_result = d_inv[:, None] * adj * d_inv[None, :]
+        self.assertTrue(np.allclose(self.graph.adj_matmul(x, nodelist, normalize=True), expected_result.dot(x)))
+
+    def test_first_degree(self):
+        neighbors, neighborhood = self.graph.first_degree("KRAS")
+        self.assertEqual(neighbors, {"TP53", "EGFR", "KRAS"})
+        self.assertTrue((neighborhood == self.dense[[0, 1, 3]][:, [0, 1, 3]]).all())
+        columns = ["KRAS", "TP53", "MDM2", "UNKNOWN"]
+        index = self.graph.first_degree_index(["KRAS", "TP53", "UNKNOWN"], columns)
+        self.assertEqual([columns.tolist() for columns in index], [[0, 1], [0, 1, 2], [3]])
+
+    def test_bfs_order(self):
+        self.assertEqual(self.graph.bfs_order("KRAS").tolist(), [3, 0, 1, 2])
+        self.assertEqual(self.graph.bfs_order("EGFR").tolist(), [1, 0, 2, 3])
+
+    def test_relabel(self):
+        self.graph.relabel({"MDM2": "TP53"})
+        self.assertEqual(self.graph.node_names.tolist(), ["TP53", "EGFR", "KRAS"])
+        self.assertEqual(self.graph.is_landmark.tolist(), [True, True, False])
+
+
+class StringDBGraphTestSuite(unittest.TestCase):
+    """Test cases on the StringDB edge store, built from a small links file."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        os.makedirs(self.tmp_dir + "/datastore")
+        os.makedirs(self.tmp_dir + "/graphs")
+        pd.DataFrame({"gene_id": ["ENSG1", "ENSG2", "ENSG2", "ENSG3"],
+                      "protein_id": ["ENSP1", "ENSP2", "ENSP22", "ENSP3"]}).to_pickle(
+            self.tmp_dir + "/datastore/ensp_ensg_df.pkl")
+        with open(self.tmp_dir + "/datastore/ensembl_map.txt", "w") as f:
+            f.write("symbol\tensembl\nTP53\tENSG1\nMDM2\tENSG2\nEGFR\tENSG3\n")
+        channels = ["neighborhood", "fusion", "cooccurence", "coexpression", "experimental", "database",
+                    "textmining", "combined_score"]
+        links = [("ENSP1", "ENSP2", 0, 0, 0, 0, 500, 0, 0, 500),
+                 ("ENSP2", "ENSP1", 0, 0, 0, 0, 500, 0, 0, 500),
+                 ("ENSP22", "ENSP3", 0, 0, 0, 900, 0, 0, 0, 900),
+                 ("ENSP3", "ENSP22", 0, 0, 0, 900, 0, 0, 0, 900),
+                 ("ENSP1", "ENSP9", 0, 0, 0, 0, 800, 0, 0, 800)]
+        with open(self.tmp_dir + "/graphs/9606.protein.links.detailed.v11.0.txt", "w") as f:
+            f.write(" ".join(["protein1", "protein2"] + channels) + "\n")
+            for link in links:
+                f.write(" ".join(["9606." + link[0], "9606." + link[1]] + [str(x) for x in link[2:]]) + "\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_channels(self):
+        graph = StringDBGraph(graph_type="all", chunksize=2, relabel_genes=False, datastore=self.tmp_dir)
+        self.assertEqual(graph.node_names.tolist(), ["TP53", "MDM2", "EGFR"])
+        self.assertEqual(graph.adj().nnz, 4)
+        self.assertEqual(graph.adj()[1, 2], np.float32(.9))
+        # the other channels are built from the edge store, without reading the links file again
+        os.remove(self.tmp_dir + "/graphs/9606.protein.links.detailed.v11.0.txt")
+        graph = StringDBGraph(graph_type="experimental", relabel_genes=False, datastore=self.tmp_dir)
+        self.assertEqual(graph.node_names.tolist(), ["TP53", "MDM2"])
+        graph = StringDBGraph(graph_type="all", min_score=600, relabel_genes=False, datastore=self.tmp_dir)
+        self.assertEqual(graph.node_names.tolist(), ["MDM2", "EGFR"])
+
+    def test_protein_pairs_of_one_gene_pair(self):
+        # ENSP2 - ENSP3 is another pair of proteins of MDM2 - EGFR, listed first with a lower combined score but a
+        # higher experimental score
+        links_file = self.tmp_dir + "/graphs/9606.protein.links.detailed.v11.0.txt"
+        with open(links_file) as f:
+            lines = f.readlines()
+        lines.insert(1, "9606.ENSP2 9606.ENSP3 0 0 0 0 700 0 0 300\n")
+        with open(links_file, "w") as f:
+            f.writelines(lines)
+        graph = StringDBGraph(graph_type="all", relabel_genes=False, datastore=self.tmp_dir)
+        self.assertEqual(graph.adj(nodelist=["MDM2", "EGFR"])[0, 1], np.float32(.9))
+        graph = StringDBGraph(graph_type="experimental", min_score=600, relabel_genes=False, datastore=self.tmp_dir)
+        self.assertEqual(graph.node_names.tolist(), ["MDM2", "EGFR"])
+        self.assertEqual(graph.adj()[0, 1], np.float32(.7))
+
+    def test_legacy_adjlist(self):
+        with open(self.tmp_dir + "/graphs/stringdb_graph_all_edges.adjlist", "w") as f:
+            f.write("TP53 MDM2\nMDM2 EGFR\n")
+        # the weighted links file is used while it exists
+        graph = StringDBGraph(graph_type="all", relabel_genes=False, datastore=self.tmp_dir)
+        self.assertEqual(graph.adj()[1, 2], np.float32(.9))
+        array_store.remove(self.tmp_dir + "/graphs/stringdb.edges")
+        os.remove(self.tmp_dir + "/graphs/9606.protein.links.detailed.v11.0.txt")
+        graph = StringDBGraph(graph_type="all", relabel_genes=False, rebuild=True, datastore=self.tmp_dir)
+        self.assertEqual(graph.adj()[1, 2], np.float32(1.))
+
+
+class FunCoupGraphTestSuite(unittest.TestCase):
+    """Test cases on the FunCoup loader, built from a small data file."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        os.makedirs(self.tmp_dir + "/graphs")
+        with open(self.tmp_dir + "/graphs/ensembl_to_hugo.tsv", "w") as f:
+            f.write("symbol\tensembl\nTP53\tENSG1\nMDM2\tENSG2\nEGFR\tENSG3\n")
+        pd.DataFrame({"#0:PFC": [.5, .9], "1:FBS_max": [3., 7.], "2:Gene1": ["ENSG1", "ENSG2"],
+                      "3:Gene2": ["ENSG2", "ENSG3"]}).to_csv(
+            self.tmp_dir + "/graphs/FC4.0_H.sapiens_full.gz", sep="\t", index=False, compression="gzip")
+        with gzip.open(self.tmp_dir + "/graphs/funcoup.adjlist.gz", "wt") as f:
+            f.write("TP53 MDM2\nMDM2 EGFR\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_weights(self):
+        # the unweighted adjlist file is only used when the data file is missing
+        graph = FunCoupGraph(weight="FBS_max", relabel_genes=False, datastore=self.tmp_dir)
+        self.assertEqual(graph.adj(nodelist=["MDM2", "EGFR"])[0, 1], np.float32(7.))
+        graph = FunCoupGraph(relabel_genes=False, datastore=self.tmp_dir)
+        self.assertEqual(graph.adj(nodelist=["MDM2", "EGFR"])[0, 1], np.float32(.9))
+        os.remove(self.tmp_dir + "/graphs/FC4.0_H.sapiens_full.gz")
+        graph = FunCoupGraph(relabel_genes=False, rebuild=True, datastore=self.tmp_dir)
+        self.assertEqual(graph.adj(nodelist=["MDM2", "EGFR"])[0, 1], np.float32(1.))
+
+
+class HetIOHumanNetTestSuite(unittest.TestCase):
+    """Test cases on the HetIO and HumanNet loaders, built from small files."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        os.makedirs(self.tmp_dir + "/graphs")
+        with open(self.tmp_dir + "/graphs/hetionet-v1.0-nodes.tsv", "w") as f:
+            f.write("id\tname\tkind\nGene::1\tTP53\tGene\nGene::2\tMDM2\tGene\nGene::3\tEGFR\tGene\n"
+                    "Disease::1\tcancer\tDisease\n")
+        pd.DataFrame({"source": ["Gene::1", "Gene::2", "Gene::2", "Gene::1", "Disease::1", "Gene::3"],
+                      "metaedge": ["GiG", "GiG", "Gr>G", "GcG", "DaG", "GiG"],
+                      "target": ["Gene::2", "Gene::1", "Gene::3", "Gene::3", "Gene::1", "Gene::9"]}).to_csv(
+            self.tmp_dir + "/graphs/hetionet-v1.0-edges.sif.gz", sep="\t", index=False, compression="gzip")
+        with open(self.tmp_dir + "/graphs/enterez_NCBI_to_hugo_gene_symbol_march_2019.txt", "w") as f:
+            f.write("symbol\tentrez\nTP53\t7157\nMDM2\t4193\nEGFR\t1956\n")
+        with open(self.tmp_dir + "/graphs/HumanNet.v1.benchmark.txt", "w") as f:
+            f.write("7157\t4193\n4193\t1956\n1956\t99\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_hetio(self):
+        graph = HetIOGraph(graph_type="interaction", relabel_genes=False, datastore=self.tmp_dir)
+        self.assertEqual(graph.node_names.tolist(), ["TP53", "MDM2"])
+        self.assertEqual(graph.adj().nnz, 2)
+        # the other types are built from the edge store, without reading the edges file again
+        os.remove(self.tmp_dir + "/graphs/hetionet-v1.0-edges.sif.gz")
+        graph = HetIOGraph(graph_type="all", relabel_genes=False, datastore=self.tmp_dir)
+        self.assertEqual(graph.adj().nnz, 6)
+        graph = HetIOGraph(graph_type="regulation", relabel_genes=False, datastore=self.tmp_dir)
+        self.assertEqual(graph.node_names.tolist(), ["MDM2", "EGFR"])
+
+    def test_humannet(self):
+        graph = HumanNetV1Graph(relabel_genes=False, datastore=self.tmp_dir)
+        self.assertEqual(graph.node_names.tolist(), ["TP53", "MDM2", "EGFR"])
+        # the edge to the unmapped id 99 is left out
+        self.assertEqual(graph.adj().nnz, 4)
+
+
+class EcoliEcocycGraphTestSuite(unittest.TestCase):
+    """Test cases on the pathway incidence matrix of EcoliEcocycGraph."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = self.tmp_dir + "/pathways.col"
+        with open(self.path, "w") as f:
+            f.write("# header\n" * 40)
+            # columns are padded with tabs to the same length
+            f.write("PWY-1\tfirst pathway\tthrA\tthrB\t\n")
+            f.write("PWY-2\tsecond pathway\tthrB\tthrC\tlacZ\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_pathways(self):
+        graph = EcoliEcocycGraph(self.path)
+        self.assertEqual(graph.node_names.tolist(), ["lacZ", "thrA", "thrB", "thrC"])
+        self.assertEqual(graph.incidence.shape, (4, 2))
+        expected_result = np.array([[1, 0, 1, 1], [0, 1, 1, 0], [1, 1, 1, 1], [1, 0, 1, 1]])
+        self.assertTrue((graph.adj().toarray() == expected_result).all())
+        self.assertEqual(graph.pathway_adj("PWY-1").nnz, 4)
+        self.assertEqual(graph.pathway_adj(1).nnz, 9)
+
+    def test_relabel(self):
+        graph = EcoliEcocycGraph(self.path)
+        graph.relabel({"thrC": "thrA"})
+        self.assertEqual(graph.node_names.tolist(), ["lacZ", "thrA", "thrB"])
+        self.assertEqual(graph.incidence.toarray().tolist(), [[0, 1], [1, 1], [1, 1]])
+
+
+if __name__ == '__main__':
+    unittest.main()
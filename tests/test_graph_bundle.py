@@ -0,0 +1,48 @@
+import unittest
+from data.gene_graphs import GeneInteractionGraph
+from data.graph_bundle import GraphBundle
+
+
+class EdgelistGraph(GeneInteractionGraph):
+
+    def __init__(self, sources, targets, **kwargs):
+        self.sources = sources
+        self.targets = targets
+        super(EdgelistGraph, self).__init__(**kwargs)
+
+    def load_data(self):
+        self.set_edgelist(self.sources, self.targets)
+
+
+class GraphBundleTestSuite(unittest.TestCase):
+    """Test cases on the data/graph_bundle.py file."""
+
+    def setUp(self):
+        first = EdgelistGraph(["TP53", "MDM2"], ["MDM2", "EGFR"], relabel_genes=False)
+        second = EdgelistGraph(["MDM2", "KRAS"], ["TP53", "EGFR"], relabel_genes=False)
+        self.bundle = GraphBundle({"first": first, "second": second})
+
+    def test_vocabulary(self):
+        self.assertEqual(self.bundle.genes.tolist(), ["TP53", "MDM2", "EGFR", "KRAS"])
+        self.assertEqual(self.bundle.intersection().tolist(), ["TP53", "MDM2", "EGFR"])
+        self.assertEqual(self.bundle.union().tolist(), ["TP53", "MDM2", "EGFR", "KRAS"])
+        self.assertEqual(self.bundle.union(["first"]).tolist(), ["TP53", "MDM2", "EGFR"])
+
+    def test_covered_genes(self):
+        covered = self.bundle.covered_genes(["BRCA1", "EGFR", "KRAS", "TP53"])
+        self.assertEqual(covered.tolist(), ["EGFR", "TP53"])
+
+    def test_edges(self):
+        intersection = self.bundle.edge_intersection()
+        self.assertEqual(intersection.nnz, 2)
+        self.assertEqual(intersection[0, 1], 1.)
+        self.assertEqual(self.bundle.edge_union().nnz, 6)
+
+    def test_adjs(self):
+        adjs = self.bundle.adjs(["EGFR", "KRAS", "MDM2"])
+        self.assertEqual(adjs["first"].toarray().tolist(), [[0, 0, 1], [0, 0, 0], [1, 0, 0]])
+        self.assertEqual(adjs["second"].toarray().tolist(), [[0, 1, 0], [1, 0, 0], [0, 0, 0]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import numpy as np
+import networkx as nx
+from data import graph_store, array_store
+
+
+class GraphStoreTestSuite(unittest.TestCase):
+    """Test cases on the data/graph_store.py file."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_to_csr_symmetric(self):
+        # edges given once, with a duplicate in the other direction and a self loop
+        csr = graph_store.to_csr([0, 1, 2, 2], [1, 0, 2, 0], [1., 5., 3., 2.], 4)
+        expected_result = np.array([[0, 1, 2, 0], [1, 0, 0, 0], [2, 0, 3, 0], [0, 0, 0, 0]])
+        self.assertTrue((csr.toarray() == expected_result).all())
+        self.assertEqual(csr.indices.dtype, np.int32)
+        self.assertEqual(csr.data.dtype, np.float32)
+        self.assertTrue(csr.has_sorted_indices)
+
+    def test_save_load_mmap(self):
+        node_names = np.array(["A", "B", "C"])
+        csr = graph_store.to_csr([0, 1], [1, 2], None, 3)
+        path = self.tmp_dir + "/graph.csr"
+        self.assertFalse(graph_store.is_cached(path))
+        graph_store.save(path, node_names, csr)
+        self.assertTrue(graph_store.is_cached(path))
+
+        loaded_names, loaded_csr = graph_store.load(path)
+        # memory-mapped arrays are read-only
+        self.assertFalse(loaded_csr.indices.flags.writeable)
+        self.assertEqual(loaded_names.tolist(), node_names.tolist())
+        self.assertTrue((loaded_csr.toarray() == csr.toarray()).all())
+
+    def test_read_while_rewritten(self):
+        path = self.tmp_dir + "/arrays"
+        array_store.save_arrays(path, {"a": np.zeros(1000), "b": np.zeros(1000)}, 1)
+        done = threading.Event()
+
+        def rewrite():
+            for i in range(1, 50):
+                array_store.save_arrays(path, {"a": np.full(1000, i), "b": np.full(1000, i)}, 1)
+            done.set()
+
+        writer = threading.Thread(target=rewrite)
+        writer.start()
+        # the readers always find a complete cache, whose arrays all come from the same version
+        while not done.is_set():
+            self.assertTrue(array_store.is_complete(path, 1))
+            arrays = array_store.load_arrays(path, mmap=False)
+            self.assertEqual(arrays["a"][0], arrays["b"][-1])
+        writer.join()
+        self.assertEqual(array_store.load_arrays(path)["a"][0], 49)
+        # only the current and the previous versions are left, next to their links
+        self.assertEqual(len(os.listdir(self.tmp_dir)), 4)
+
+    def test_replace_plain_directory(self):
+        path = self.tmp_dir + "/arrays"
+        os.makedirs(path)
+        array_store.save_arrays(path, {"a": np.arange(3)}, 1)
+        self.assertEqual(array_store.load_arrays(path)["a"].tolist(), [0, 1, 2])
+        array_store.remove(path)
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+
+    def test_networkx_roundtrip(self):
+        graph = nx.Graph()
+        graph.add_nodes_from(["A", "B", "C", "D"])
+        graph.add_edge("A", "B", weight=0.5)
+        graph.add_edge("C", "B")
+        node_names, csr = graph_store.from_networkx(graph)
+        self.assertEqual(node_names.tolist(), ["A", "B", "C", "D"])
+        self.assertEqual(csr[0, 1], 0.5)
+        self.assertEqual(csr[2, 1], 1.)
+
+        exported = graph_store.to_networkx(node_names, csr)
+        self.assertEqual(list(exported.nodes), ["A", "B", "C", "D"])
+        self.assertEqual(set(map(frozenset, exported.edges)), set(map(frozenset, graph.edges)))
+        self.assertEqual(exported["A"]["B"]["weight"], 0.5)
+
+
+    def test_from_edgelist(self):
+        node_names, csr = graph_store.from_edgelist(["A", "C"], ["B", "A"], nodes=["D"])
+        self.assertEqual(node_names.tolist(), ["D", "A", "B", "C"])
+        self.assertEqual(csr.nnz, 4)
+        self.assertEqual(csr[3, 1], 1.)
+
+    def test_save_load_arrays(self):
+        path = self.tmp_dir + "/edges"
+        graph_store.save_arrays(path, {"rows": np.array([0, 2]), "cols": np.array([1, 3])}, num_edges=2)
+        self.assertTrue(graph_store.is_cached(path))
+        self.assertEqual(graph_store.load_meta(path)["num_edges"], 2)
+        arrays = graph_store.load_arrays(path)
+        self.assertEqual(sorted(arrays.keys()), ["cols", "rows"])
+        self.assertEqual(arrays["cols"].tolist(), [1, 3])
+
+    def test_from_ids(self):
+        node_names, csr = graph_store.from_ids(np.array(["A", "B", "C", "D"]), [3, 1], [1, 1])
+        self.assertEqual(node_names.tolist(), ["D", "B"])
+        self.assertTrue((csr.toarray() == np.array([[0, 1], [1, 1]])).all())
+
+    def test_threshold_top_k(self):
+        # 0 - 1 (0.9), 0 - 2 (0.5), 0 - 3 (0.2), 2 - 3 (0.1)
+        csr = graph_store.to_csr([0, 0, 0, 2], [1, 2, 3, 3], [.9, .5, .2, .1], 4)
+        self.assertEqual(graph_store.threshold(csr, .5).nnz, 4)
+        # 0 keeps 0 - 1, 1 keeps 1 - 0, 2 keeps 2 - 0 and 3 keeps 3 - 0
+        top = graph_store.top_k(csr, 1)
+        expected_result = np.array([[0, .9, .5, .2], [.9, 0, 0, 0], [.5, 0, 0, 0], [.2, 0, 0, 0]], dtype=np.float32)
+        self.assertTrue((top.toarray() == expected_result).all())
+        self.assertEqual(graph_store.top_k(csr, 2).nnz, 8)
+
+    def test_edge_swap(self):
+        rng = np.random.RandomState(0)
+        rows, cols = rng.randint(0, 50, 200), rng.randint(0, 50, 200)
+        csr = graph_store.to_csr(rows, cols, None, 50)
+        swapped = graph_store.edge_swap(csr, seed=1)
+        self.assertTrue((np.diff(swapped.indptr) == np.diff(csr.indptr)).all())
+        self.assertTrue((swapped.diagonal() == csr.diagonal()).all())
+        self.assertTrue((swapped.toarray() == swapped.toarray().T).all())
+        self.assertEqual(swapped.max(), 1.)
+        self.assertNotEqual((swapped != csr).nnz, 0)
+        self.assertEqual((graph_store.edge_swap(csr, seed=1) != swapped).nnz, 0)
+
+    def test_relabel_merges_nodes(self):
+        node_names, csr = graph_store.from_edgelist(["A", "B"], ["C", "C"])
+        node_names, csr = graph_store.relabel(node_names, csr, {"B": "A"})
+        self.assertEqual(node_names.tolist(), ["A", "C"])
+        self.assertTrue((csr.toarray() == np.array([[0, 1], [1, 0]])).all())
+
+    def test_bfs_order(self):
+        # 0 - 2 - 1 - 3, 0 - 4
+        csr = graph_store.to_csr([0, 2, 1, 0], [2, 1, 3, 4], None, 6)
+        self.assertEqual(graph_store.bfs_order(csr, 0).tolist(), [0, 2, 4, 1, 3])
+        self.assertEqual(graph_store.bfs_order(csr, 0, max_nodes=2).tolist(), [0, 2])
+        self.assertEqual(graph_store.bfs_order(csr, 5).tolist(), [5])
+
+    def test_read_adjlist(self):
+        path = self.tmp_dir + "/graph.adjlist"
+        with open(path, "w") as f:
+            f.write("# comment\nA B C\nB D\nE\n")
+        node_names, csr = graph_store.read_adjlist(path)
+        self.assertEqual(node_names.tolist(), ["A", "B", "C", "D", "E"])
+        self.assertEqual(csr.nnz, 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import shutil
+import tempfile
+import unittest
+import h5py
+import numpy as np
+from data import datasets
+from models.mlp import MLP
+
+
+class StreamingFitTestSuite(unittest.TestCase):
+    """Test cases on Model.fit with batch streams over an HDF5 file instead of in-memory data."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data = np.random.RandomState(0).rand(600, 5).astype(np.float32)
+        self.labels = (self.data[:, 0] > .5).astype(np.int64)
+        self.hdf5 = h5py.File(self.tmp_dir + "/data.hdf5", "w")
+        self.hdf5.create_dataset("expression_data", data=self.data, chunks=(64, 5))
+
+    def tearDown(self):
+        self.hdf5.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def streams(self):
+        dataset = self.hdf5["expression_data"]
+        train = datasets.HDF5BatchStream(dataset, self.labels, rows=np.arange(480), batch_size=32, chunk_rows=128)
+        valid = datasets.HDF5BatchStream(dataset, self.labels, rows=np.arange(480, 600), batch_size=32,
+                                         shuffle=False)
+        return train, valid
+
+    def test_fit_streams(self):
+        train, valid = self.streams()
+        model = MLP(num_epochs=15, num_layer=1, channels=16, lr=0.01, patience=100, verbose=False)
+        model.fit(train, valid=valid)
+        self.assertEqual(model.out_dim, 2)
+        probs = model.predict(self.data[480:]).numpy()
+        self.assertEqual(probs.shape, (120, 2))
+        self.assertTrue(np.allclose(probs.sum(axis=1), 1., atol=1e-5))
+        self.assertGreater((probs.argmax(axis=1) == self.labels[480:]).mean(), .8)
+
+    def test_early_stopping(self):
+        train, valid = self.streams()
+        model = MLP(num_epochs=30, num_layer=1, channels=16, lr=0.01, patience=3, evaluate_train=False,
+                    verbose=False)
+        epochs = []
+        metric = model.metric
+        model.metric = lambda y_true, y_pred: epochs.append(len(y_true)) or metric(y_true, y_pred)
+        model.fit(train, valid=valid)
+        # the validation stream is evaluated once per epoch, until the patience runs out
+        self.assertEqual(epochs, [120] * 3)
+        self.assertEqual(model.predict(self.data[:10]).shape, (10, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+import unittest
+import h5py
+import numpy as np
+from data.normalization import ExpressionStats, hdf5_stats
+
+
+class NormalizationTestSuite(unittest.TestCase):
+    """Test cases on the data/normalization.py file."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data = (np.random.RandomState(0).randn(500, 6) * [1, 2, 3, 4, 5, 0] + 100).astype(np.float32)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_streaming_matches_full_pass(self):
+        stats = ExpressionStats.from_array(self.data, chunk_rows=37)
+        self.assertEqual(stats.count, 500)
+        self.assertTrue(np.allclose(stats.mean, self.data.mean(axis=0, dtype=np.float64)))
+        self.assertTrue(np.allclose(stats.variance, self.data.astype(np.float64).var(axis=0)))
+        self.assertTrue((stats.min == self.data.min(axis=0)).all())
+        self.assertTrue((stats.max == self.data.max(axis=0)).all())
+
+    def test_apply(self):
+        stats = ExpressionStats.from_array(self.data)
+        centered = stats.apply(self.data)
+        self.assertTrue(np.allclose(centered.mean(axis=0), 0, atol=1e-3))
+        standardized = stats.apply(self.data, method="standardize")
+        self.assertTrue(np.allclose(standardized.std(axis=0)[:5], 1, atol=1e-3))
+        scaled = stats.apply(self.data, method="min_max")
+        self.assertTrue(np.allclose(scaled.min(axis=0)[:5], -10) and np.allclose(scaled.max(axis=0)[:5], 10))
+        # in place on float32 arrays
+        data = self.data.copy()
+        self.assertTrue(stats.apply(data, copy=False) is data)
+        self.assertTrue(np.allclose(stats.select([4, 1]).apply(self.data[:, [4, 1]]), centered[:, [4, 1]]))
+        with self.assertRaises(ValueError):
+            stats.apply(self.data, method="unknown")
+
+    def test_hdf5_stats_cache(self):
+        filename = os.path.join(self.tmp_dir, "data.hdf5")
+        with h5py.File(filename, "w") as f:
+            f.create_dataset("expression_data", data=self.data)
+        with h5py.File(filename, "r") as f:
+            stats = hdf5_stats(f["expression_data"], chunk_rows=100)
+        path = filename + ".expression_data.stats"
+        self.assertTrue(os.path.isdir(path))
+        loaded = ExpressionStats.load(path)
+        self.assertEqual(loaded.count, 500)
+        self.assertTrue((loaded.mean == stats.mean).all() and (loaded.m2 == stats.m2).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+import os
+import copy
+import time
+import shutil
+import tempfile
+import unittest
+import h5py
+import numpy as np
+from meta_dataloader import TCGA
+
+
+class TCGADataTestCase(unittest.TestCase):
+    """Writes a small TCGA data directory."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmp_dir, "clinicalMatrices"))
+        with open(os.path.join(self.tmp_dir, "all_sample_ids"), "w") as f:
+            f.write("\n".join("S{}".format(i) for i in range(8)) + "\n")
+        self.task_variables_file = os.path.join(self.tmp_dir, "task_variables")
+        with open(self.task_variables_file, "w") as f:
+            f.write("gender\nstage\nmissing_variable\n")
+        # S8 has no expression data, and LUAD has a single stage
+        self.write_matrix("BRCA", [("S0", "M", "I"), ("S1", "F", "II"), ("S2", "M", "I"), ("S3", "F", ""),
+                                   ("S4", "F", "II"), ("S8", "M", "I")])
+        self.write_matrix("LUAD", [("S5", "M", "I"), ("S6", "F", "I"), ("S7", "M", "I"), ("S4", "F", "I")])
+        with open(os.path.join(self.tmp_dir, "gene_ids"), "w") as f:
+            f.write("A\nB\nC\n")
+        self.data = np.arange(24, dtype=np.float64).reshape(8, 3)
+        with h5py.File(os.path.join(self.tmp_dir, "TCGA_HiSeqV2.hdf5"), "w") as f:
+            f.create_dataset("dataset", data=self.data, compression="gzip")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_matrix(self, cancer, rows):
+        with open(os.path.join(self.tmp_dir, "clinicalMatrices", cancer + "_clinicalMatrix"), "w") as f:
+            f.write("sampleID\tgender\tstage\n")
+            for row in rows:
+                f.write("\t".join(row) + "\n")
+
+
+class TCGATaskIndexTestSuite(TCGADataTestCase):
+    """Test cases on the task index of meta_dataloader/TCGA.py."""
+
+    def task_ids(self, min_samples_per_class):
+        return sorted(TCGA.get_TCGA_task_ids(self.tmp_dir, min_samples_per_class, self.task_variables_file))
+
+    def test_task_ids(self):
+        self.assertEqual(self.task_ids(1), [("gender", "BRCA"), ("gender", "LUAD"), ("stage", "BRCA")])
+        self.assertEqual(self.task_ids(2), [])
+        self.assertTrue(os.path.isfile(os.path.join(self.tmp_dir, "task_index.pkl")))
+
+    def test_task_index(self):
+        index = TCGA.get_TCGA_task_index(self.tmp_dir, self.task_variables_file)
+        task_variable, num_samples_per_label, rows = index["BRCA_clinicalMatrix"][0]
+        self.assertEqual(task_variable, "gender")
+        self.assertEqual(num_samples_per_label, {"M": 2, "F": 3})
+        self.assertEqual(rows.tolist(), [0, 1, 2, 3, 4])
+        self.assertEqual(index["BRCA_clinicalMatrix"][1][2].tolist(), [0, 1, 2, 4])
+
+    def test_index_invalidation(self):
+        self.assertEqual(self.task_ids(1), [("gender", "BRCA"), ("gender", "LUAD"), ("stage", "BRCA")])
+        # make sure the modification time changes
+        time.sleep(0.01)
+        self.write_matrix("LUAD", [("S5", "M", "I"), ("S6", "F", "II"), ("S7", "M", "I"), ("S4", "F", "II")])
+        self.assertEqual(self.task_ids(1), [("gender", "BRCA"), ("gender", "LUAD"), ("stage", "BRCA"),
+                                            ("stage", "LUAD")])
+        os.remove(os.path.join(self.tmp_dir, "clinicalMatrices", "BRCA_clinicalMatrix"))
+        self.assertEqual(self.task_ids(1), [("gender", "LUAD"), ("stage", "LUAD")])
+
+
+class ClinicalMatrixTestSuite(TCGADataTestCase):
+    """Test cases on the clinical matrix cache of meta_dataloader/TCGA.py."""
+
+    def test_columns(self):
+        matrix = TCGA.get_clinical_matrix(self.tmp_dir, "BRCA_clinicalMatrix")
+        self.assertEqual(matrix.columns, ["sampleID", "gender", "stage"])
+        self.assertEqual(matrix.sample_ids.tolist(), ["S0", "S1", "S2", "S3", "S4", "S8"])
+        self.assertEqual(matrix.categories("stage"), ["I", "II"])
+        self.assertEqual(matrix.codes("stage").tolist(), [0, 1, 0, -1, 1, 0])
+        with self.assertRaises(KeyError):
+            matrix.codes("missing_variable")
+        self.assertTrue(os.path.isdir(os.path.join(self.tmp_dir, "clinicalMatrices.cache", "BRCA_clinicalMatrix")))
+
+    def test_invalidation(self):
+        self.assertEqual(TCGA.get_clinical_matrix(self.tmp_dir, "LUAD_clinicalMatrix").categories("stage"), ["I"])
+        time.sleep(0.01)
+        self.write_matrix("LUAD", [("S5", "M", "III"), ("S6", "F", "I")])
+        matrix = TCGA.get_clinical_matrix(self.tmp_dir, "LUAD_clinicalMatrix")
+        self.assertEqual(matrix.categories("stage"), ["I", "III"])
+        self.assertEqual(matrix.codes("stage").tolist(), [1, 0])
+
+
+class TCGATaskTestSuite(TCGADataTestCase):
+    """Test cases on TCGATask."""
+
+    def check_task(self, task, columns=slice(None)):
+        # BRCA stage: S0 (I), S1 (II), S2 (I), S4 (II) sorted by row
+        self.assertEqual(len(task), 4)
+        self.assertEqual(task.categories, ["I", "II"])
+        self.assertEqual([task[i][1] for i in range(4)], [0, 1, 0, 1])
+        self.assertTrue((np.stack([task[i][0] for i in range(4)]) == self.data[[0, 1, 2, 4]][:, columns]).all())
+
+    def test_task(self):
+        self.check_task(TCGA.TCGATask(("stage", "BRCA"), data_dir=self.tmp_dir))
+        task = TCGA.TCGATask(("stage", "BRCA"), data_dir=self.tmp_dir, genes=["C", "A"])
+        self.assertEqual(task.gene_ids, ["C", "A"])
+        self.check_task(task, [2, 0])
+        with self.assertRaises(KeyError):
+            TCGA.TCGATask(("stage", "BRCA"), data_dir=self.tmp_dir, genes=["D"])
+
+    def test_preloaded_task(self):
+        gene_ids, all_sample_ids = TCGA._read_id_lists(self.tmp_dir)
+        preloaded = (all_sample_ids, gene_ids, self.data)
+        self.check_task(TCGA.TCGATask(("stage", "BRCA"), data_dir=self.tmp_dir, preloaded=preloaded))
+        self.check_task(TCGA.TCGATask(("stage", "BRCA"), data_dir=self.tmp_dir, preloaded=preloaded,
+                                      genes=["B"]), [1])
+        # the tasks share the lists of ids and their index
+        self.assertTrue(TCGA._read_id_lists(self.tmp_dir)[1] is all_sample_ids)
+        key = TCGA._sample_ids_key(self.tmp_dir)
+        self.assertTrue(TCGA._id_index(all_sample_ids, key) is TCGA._id_index(all_sample_ids, key))
+
+    def test_id_caches_are_replaced(self):
+        TCGA.get_TCGA_task_index(self.tmp_dir, self.task_variables_file)
+        _, all_sample_ids = TCGA._read_id_lists(self.tmp_dir)
+        # a new version of the sample ids replaces the cached list and its index, instead of adding to them
+        with open(os.path.join(self.tmp_dir, 'all_sample_ids'), 'a') as f:
+            f.write('S9\n')
+        entries = len(TCGA._ID_LISTS), len(TCGA._ID_INDICES)
+        _, new_sample_ids = TCGA._read_id_lists(self.tmp_dir)
+        TCGA.TCGATask(("stage", "BRCA"), data_dir=self.tmp_dir)
+        self.assertEqual(new_sample_ids[-1], 'S9')
+        self.assertEqual((len(TCGA._ID_LISTS), len(TCGA._ID_INDICES)), entries)
+        self.assertTrue(TCGA._id_index(new_sample_ids, TCGA._sample_ids_key(self.tmp_dir)).index[-1] == 'S9')
+
+    def test_task_views(self):
+        tasks = TCGA.TCGAMeta(data_dir=self.tmp_dir, task_variables_file=self.task_variables_file,
+                              min_samples_per_class=1, mmap=True)
+        self.assertTrue(isinstance(tasks.gene_expression_data, np.memmap))
+        task = tasks[tasks.task_ids.index(("stage", "BRCA"))]
+        self.check_task(task)
+        # the task only holds its rows, and its copies share the matrix
+        self.assertTrue(task._data is tasks.gene_expression_data)
+        self.assertTrue(copy.deepcopy(task)._data is tasks.gene_expression_data)
+        samples, labels = task.get_batch([3, 0])
+        self.assertTrue((samples == self.data[[4, 0]]).all())
+        self.assertEqual(labels.tolist(), [1, 0])
+        # a task which is given its own samples no longer uses the shared matrix
+        task._samples = task._samples - 1
+        self.assertTrue((task[0][0] == self.data[0] - 1).all())
+        self.assertTrue((tasks.gene_expression_data[0] == self.data[0]).all())
+
+    def test_shared_matrix_is_not_modified(self):
+        tasks = TCGA.TCGAMeta(data_dir=self.tmp_dir, task_variables_file=self.task_variables_file,
+                              min_samples_per_class=1)
+        self.assertFalse(tasks.gene_expression_data.flags.writeable)
+        task = tasks[tasks.task_ids.index(("stage", "BRCA"))]
+        # a single sample is a copy, which can be modified in place e.g. by a transform
+        sample = task[0][0]
+        sample += 1
+        self.assertTrue((tasks.gene_expression_data[0] == self.data[0]).all())
+
+    def test_cohort_store(self):
+        TCGA._write_cohort_store(self.tmp_dir)
+        with h5py.File(os.path.join(self.tmp_dir, TCGA.COHORT_STORE), "r") as f:
+            self.assertEqual(f["dataset"].compression, "lzf")
+            self.assertEqual(f["dataset"].chunks[1], 3)
+            store_rows = f["store_rows"][:]
+            self.assertTrue((f["dataset"][:][store_rows] == self.data).all())
+        # S4 is in BRCA and LUAD, and goes to the smaller LUAD: both cohorts are contiguous ranges of rows
+        for rows in [[0, 1, 2, 3, 4], [4, 5, 6, 7]]:
+            self.assertEqual(sorted(store_rows[rows].tolist()),
+                             list(range(min(store_rows[rows]), max(store_rows[rows]) + 1)))
+        self.assertTrue((TCGA._read_rows(self.tmp_dir, np.array([6, 1, 6])) == self.data[[6, 1, 6]]).all())
+        self.check_task(TCGA.TCGATask(("stage", "BRCA"), data_dir=self.tmp_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
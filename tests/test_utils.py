@@ -0,0 +1,44 @@
+import os
+import shutil
+import tempfile
+import unittest
+from data import utils, array_store
+
+
+class UtilsTestSuite(unittest.TestCase):
+    """Test cases on the gene id table of data/utils.py."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        os.makedirs(self.tmp_dir + "/datastore")
+        with open(self.tmp_dir + "/datastore/ensembl_map.txt", "w") as f:
+            f.write("symbol\tensembl\nTP53\tENSG1\n\tENSG2\nMDM2\tENSG3\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_map_gene_ids(self):
+        symbols = utils.map_gene_ids(["ENSG3", "ENSG2", "ENSG1"], "ensg", datastore=self.tmp_dir)
+        self.assertEqual(symbols.tolist(), ["MDM2", None, "TP53"])
+        self.assertEqual(utils.ensg_to_hugo_map(self.tmp_dir), {"ENSG1": "TP53", "ENSG3": "MDM2"})
+        self.assertTrue(os.path.isdir(self.tmp_dir + "/datastore/gene_ids.map"))
+        # only the namespace which is used is compiled
+        self.assertEqual(array_store.load_meta(self.tmp_dir + "/datastore/gene_ids.map")["namespaces"], ["ensg"])
+
+    def test_map_longer_ids(self):
+        # ids longer than every key must not be truncated to one of them
+        symbols = utils.map_gene_ids(["ENSG10", "ENSG3"], "ensg", datastore=self.tmp_dir)
+        self.assertEqual(symbols.tolist(), [None, "MDM2"])
+
+    def test_missing_namespace(self):
+        with self.assertRaises(IOError):
+            utils.map_gene_ids([1], "entrez", datastore=self.tmp_dir)
+
+    def test_symbol_map(self):
+        # KRAS2 is a previous symbol of KRAS, it is only mapped when KRAS is not already there
+        self.assertEqual(utils.symbol_map(["KRAS2"])["KRAS2"], "KRAS")
+        self.assertNotIn("KRAS2", utils.symbol_map(["KRAS2", "KRAS"]))
+
+
+if __name__ == '__main__':
+    unittest.main()